@@ -1,7 +1,18 @@
 from fastmcp import FastMCP
+import functools
+import hashlib
+import json
+import os
+import shlex
+import shutil
 import subprocess
+import sys
+import tempfile
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import List, Dict
+from typing import Any, Callable, List, Dict, Optional, Tuple
 import logging
 
 # It's a good practice to have a logger for debugging purposes.
@@ -10,6 +21,324 @@ logger = logging.getLogger(__name__)
 
 mcp = FastMCP()
 
+# Outputs are cached by the content of their inputs so reruns skip qiime entirely.
+_CACHE_DIR = Path(os.environ.get("QIIME_MCP_CACHE", "~/.cache/qiime_mcp")).expanduser()
+
+
+def _cache_key(inputs: List[Path], params: Dict[str, Any]) -> str:
+    """Hash the bytes of every input file together with the canonical parameters."""
+    digest = hashlib.blake2b(digest_size=16)
+    for path in inputs:
+        with open(path, "rb") as fh:
+            for chunk in iter(lambda: fh.read(1 << 20), b""):
+                digest.update(chunk)
+    digest.update(json.dumps(params, sort_keys=True, default=str).encode())
+    return digest.hexdigest()
+
+
+def _copy_file(src: Path, dst: Path) -> None:
+    """Copy src to a new file at dst, so cache entries and outputs never share an inode.
+
+    qiime rewrites an existing output path in place, so a hard link between
+    the two would let the next run silently change a cached artifact.
+    """
+    dst.unlink(missing_ok=True)
+    shutil.copy2(src, dst)
+
+
+def _ensure_parent(path: Path) -> None:
+    """Create the parent directory of path if it does not exist."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+
+
+def _restore_cached(key: str, outputs: Dict[str, Path]) -> bool:
+    """Copy cached outputs for key to the requested paths; False on a cache miss."""
+    entry = _CACHE_DIR / key
+    cached = {name: entry / f"{name}{path.suffix}" for name, path in outputs.items()}
+    if not all(path.is_file() for path in cached.values()):
+        return False
+    for name, path in outputs.items():
+        _ensure_parent(path)
+        _copy_file(cached[name], path)
+    return True
+
+
+def _store_cached(key: str, outputs: Dict[str, Path]) -> None:
+    """Publish freshly written outputs into the cache under key."""
+    try:
+        _CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        staging = Path(tempfile.mkdtemp(prefix=f".{key}.", dir=_CACHE_DIR))
+    except OSError as e:
+        logger.warning(f"Could not create cache entry in {_CACHE_DIR}: {e}")
+        return
+    try:
+        for name, path in outputs.items():
+            _copy_file(path, staging / f"{name}{path.suffix}")
+        os.replace(staging, _CACHE_DIR / key)
+    except OSError as e:
+        logger.warning(f"Could not populate cache entry {key}: {e}")
+        shutil.rmtree(staging, ignore_errors=True)
+
+
+def _spawn(cmd: List[str], **kwargs) -> subprocess.Popen:
+    """Start cmd in a way that lets CPython use posix_spawn instead of fork+exec.
+
+    posix_spawn is only chosen for an absolute executable path with
+    close_fds=False and no cwd, preexec_fn or new session. Descriptors opened
+    by Python are non-inheritable, so leaving close_fds off leaks nothing.
+    """
+    executable = shutil.which(cmd[0]) or cmd[0]
+    return subprocess.Popen([executable, *cmd[1:]], close_fds=False, **kwargs)
+
+
+# Source of the long-lived worker: it pays the qiime2/q2cli import and plugin
+# discovery once, then runs newline-delimited JSON requests through q2cli.
+_WORKER_SOURCE = r'''
+import contextlib, io, json, os, sys
+protocol = os.fdopen(os.dup(1), "w")
+os.dup2(2, 1)
+from qiime2.sdk import PluginManager
+from q2cli.commands import RootCommand
+PluginManager()
+root = RootCommand()
+protocol.write(json.dumps({"ready": True}) + "\n")
+protocol.flush()
+for line in sys.stdin:
+    argv = json.loads(line)["argv"]
+    out, err = io.StringIO(), io.StringIO()
+    with contextlib.redirect_stdout(out), contextlib.redirect_stderr(err):
+        try:
+            rc = root.main(args=argv, prog_name="qiime", standalone_mode=False)
+            rc = rc if isinstance(rc, int) else 0
+        except SystemExit as exc:
+            rc = exc.code if isinstance(exc.code, int) else 1
+        except Exception as exc:
+            print(exc, file=sys.stderr)
+            rc = getattr(exc, "exit_code", 1)
+    protocol.write(json.dumps({"ok": rc == 0, "returncode": rc, "stdout": out.getvalue(), "stderr": err.getvalue()}) + "\n")
+    protocol.flush()
+'''
+
+_worker: Optional[subprocess.Popen] = None
+_worker_lock = threading.Lock()
+_worker_disabled = os.environ.get("QIIME_MCP_WORKER", "1") == "0"
+
+
+def _start_worker() -> Optional[subprocess.Popen]:
+    """Spawn the warm worker and wait for its handshake; None if qiime2 cannot load."""
+    process = _spawn(
+        [sys.executable, "-c", _WORKER_SOURCE],
+        stdin=subprocess.PIPE,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL,
+        text=True,
+        bufsize=1,
+    )
+    if process.stdout.readline():
+        return process
+    process.wait()
+    return None
+
+
+def _worker_call(cmd: List[str]) -> Optional[subprocess.CompletedProcess]:
+    """Run a qiime command in the shared warm worker.
+
+    Returns None when the worker is disabled, busy with another call or has
+    died, in which case the caller falls back to the qiime CLI.
+    """
+    global _worker, _worker_disabled
+    if _worker_disabled or cmd[0] != "qiime" or not _worker_lock.acquire(blocking=False):
+        return None
+    try:
+        if _worker is None or _worker.poll() is not None:
+            _worker = _start_worker()
+            if _worker is None:
+                _worker_disabled = True
+                return None
+        request = {"plugin": cmd[1], "action": cmd[2], "argv": cmd[1:]}
+        try:
+            _worker.stdin.write(json.dumps(request) + "\n")
+            _worker.stdin.flush()
+            reply = _worker.stdout.readline()
+        except OSError:
+            reply = ""
+        if not reply:
+            _worker.kill()
+            _worker = None
+            return None
+    finally:
+        _worker_lock.release()
+    reply = json.loads(reply)
+    return subprocess.CompletedProcess(cmd, reply["returncode"], reply["stdout"], reply["stderr"])
+
+
+# Child output is streamed line by line and only the most recent lines are kept.
+_TAIL_LINES = 4096
+
+
+def _drain(pipe, tail: deque, log: Callable[[str], None]) -> None:
+    """Forward each line of a child pipe to log, keeping the last lines in tail."""
+    for line in iter(pipe.readline, ""):
+        line = line.rstrip("\n")
+        tail.append(line)
+        log(line)
+    pipe.close()
+
+
+def _run_streamed(cmd: List[str]) -> subprocess.CompletedProcess:
+    """Run cmd without buffering its whole output; stdout/stderr hold the last lines only."""
+    result = _worker_call(cmd)
+    if result is not None:
+        result.check_returncode()
+        return result
+    process = _spawn(
+        cmd,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        text=True,
+        bufsize=1,
+    )
+    stdout_tail: deque = deque(maxlen=_TAIL_LINES)
+    stderr_tail: deque = deque(maxlen=_TAIL_LINES)
+    readers = [
+        threading.Thread(target=_drain, args=(process.stdout, stdout_tail, logger.info), daemon=True),
+        threading.Thread(target=_drain, args=(process.stderr, stderr_tail, logger.debug), daemon=True),
+    ]
+    for reader in readers:
+        reader.start()
+    returncode = process.wait()
+    for reader in readers:
+        reader.join()
+    stdout = "\n".join(stdout_tail)
+    stderr = "\n".join(stderr_tail)
+    if returncode != 0:
+        raise subprocess.CalledProcessError(returncode, cmd, output=stdout, stderr=stderr)
+    return subprocess.CompletedProcess(cmd, returncode, stdout, stderr)
+
+
+# Beta diversity metrics computed by the pipeline; each feeds its own PCoA and Emperor plot.
+_BETA_METRICS = ("unweighted_unifrac", "weighted_unifrac", "jaccard", "bray_curtis")
+
+
+def _jaccard_distances(presence):
+    """Presence/absence Jaccard distances computed by popcount over bit-packed samples.
+
+    presence is a samples x features scipy sparse matrix. Each sample's
+    feature presence vector is packed eight features per byte, so |A & B| for
+    a sample pair is a byte-wise AND followed by a table lookup popcount
+    instead of a float comparison per feature.
+    """
+    import numpy as np
+
+    presence = presence.tocsr()
+    n_samples, n_features = presence.shape
+    rows, cols = presence.nonzero()
+
+    packed = np.zeros((n_samples, (n_features + 7) // 8), dtype=np.uint8)
+    np.bitwise_or.at(packed, (rows, cols >> 3), (0x80 >> (cols & 7)).astype(np.uint8))
+    popcount = np.array([bin(byte).count("1") for byte in range(256)], dtype=np.int64)
+    richness = popcount[packed].sum(axis=1)
+
+    distances = np.zeros((n_samples, n_samples))
+    for i in range(n_samples - 1):
+        shared = popcount[packed[i] & packed[i + 1:]].sum(axis=1)
+        union = richness[i] + richness[i + 1:] - shared
+        row = np.divide(shared, union, out=np.ones(len(union)), where=union > 0)
+        distances[i, i + 1:] = distances[i + 1:, i] = 1.0 - row
+    return distances
+
+
+def _jaccard_distance_matrix(rarefied):
+    """Jaccard DistanceMatrix artifact for a rarefied FeatureTable artifact."""
+    import biom
+    import qiime2
+    import skbio
+
+    table = rarefied.view(biom.Table)
+    distances = _jaccard_distances(table.matrix_data.T)
+    matrix = skbio.DistanceMatrix(distances, ids=table.ids(axis="sample"))
+    return qiime2.Artifact.import_data("DistanceMatrix", matrix)
+
+
+def _run_beta_chain(metric: str, rarefied, phylogeny, metadata, n_jobs: int):
+    """Compute one distance matrix, its PCoA and its Emperor plot in-process."""
+    from qiime2.plugins import diversity, diversity_lib, emperor
+
+    if metric in ("unweighted_unifrac", "weighted_unifrac"):
+        distance_matrix, = getattr(diversity_lib.methods, metric)(
+            table=rarefied, phylogeny=phylogeny, threads=n_jobs
+        )
+    elif metric == "jaccard":
+        distance_matrix = _jaccard_distance_matrix(rarefied)
+    else:
+        distance_matrix, = getattr(diversity_lib.methods, metric)(table=rarefied, n_jobs=n_jobs)
+    pcoa, = diversity.methods.pcoa(distance_matrix=distance_matrix)
+    visualization, = emperor.visualizers.plot(pcoa=pcoa, metadata=metadata)
+    return distance_matrix, pcoa, visualization
+
+
+@functools.lru_cache(maxsize=8)
+def _merged_metadata(files: Tuple[Tuple[str, int], ...]):
+    """Load and merge metadata files with qiime2.Metadata; keyed by (path, mtime) so edits reload."""
+    import qiime2
+
+    loaded = [qiime2.Metadata.load(path) for path, _ in files]
+    return loaded[0].merge(*loaded[1:]) if len(loaded) > 1 else loaded[0]
+
+
+def _core_metrics_in_process(
+    table: Path,
+    phylogeny: Path,
+    metadata: List[Path],
+    sampling_depth: int,
+    n_jobs: int,
+    output_files: Dict[str, Path],
+) -> None:
+    """Run core-metrics-phylogenetic through the QIIME 2 Python API.
+
+    The four beta diversity chains are independent, so they run on a thread
+    pool while the alpha metrics are computed on the calling thread. The
+    UniFrac and scikit-bio kernels release the GIL, and threads share the
+    rarefied table instead of copying it into worker processes.
+    """
+    import qiime2
+    from qiime2.plugins import diversity_lib, feature_table
+
+    table_artifact = qiime2.Artifact.load(str(table))
+    phylogeny_artifact = qiime2.Artifact.load(str(phylogeny))
+    sample_metadata = _merged_metadata(
+        tuple((str(meta_file), os.stat(meta_file).st_mtime_ns) for meta_file in metadata)
+    )
+
+    rarefied, = feature_table.methods.rarefy(table=table_artifact, sampling_depth=sampling_depth)
+    rarefied.save(str(output_files["rarefied_table"]))
+
+    with ThreadPoolExecutor(max_workers=min(len(_BETA_METRICS), max(n_jobs, 1))) as executor:
+        futures = {
+            metric: executor.submit(
+                _run_beta_chain, metric, rarefied, phylogeny_artifact, sample_metadata, n_jobs
+            )
+            for metric in _BETA_METRICS
+        }
+
+        faith_pd, = diversity_lib.methods.faith_pd(
+            table=rarefied, phylogeny=phylogeny_artifact, threads=n_jobs
+        )
+        observed_features, = diversity_lib.methods.observed_features(table=rarefied)
+        shannon, = diversity_lib.methods.shannon_entropy(table=rarefied)
+        evenness, = diversity_lib.methods.pielou_evenness(table=rarefied)
+        faith_pd.save(str(output_files["faith_pd_vector"]))
+        observed_features.save(str(output_files["observed_features_vector"]))
+        shannon.save(str(output_files["shannon_vector"]))
+        evenness.save(str(output_files["evenness_vector"]))
+
+        for metric, future in futures.items():
+            distance_matrix, pcoa, visualization = future.result()
+            distance_matrix.save(str(output_files[f"{metric}_distance_matrix"]))
+            pcoa.save(str(output_files[f"{metric}_pcoa_results"]))
+            visualization.save(str(output_files[f"{metric}_emperor"]))
+
+
 @mcp.tool()
 def qiime_diversity_core_metrics_phylogenetic(
     phylogeny: Path,
@@ -35,6 +364,8 @@ def qiime_diversity_core_metrics_phylogenetic(
     bray_curtis_emperor: Path,
     n_jobs: int = 1,
     verbose: bool = False,
+    use_cache: bool = True,
+    in_process: bool = False,
 ) -> Dict:
     """
     Applies a core set of diversity metrics to a feature table, including phylogenetic metrics.
@@ -68,6 +399,11 @@ def qiime_diversity_core_metrics_phylogenetic(
         bray_curtis_emperor: Path to save the Emperor plot from Bray-Curtis PCoA (.qzv).
         n_jobs: The number of jobs to use for the computation. (default: 1)
         verbose: Display verbose output to stdout. (default: False)
+        use_cache: Reuse outputs from a previous run with identical inputs and
+            parameters instead of re-running QIIME 2. (default: True)
+        in_process: Run the pipeline through the QIIME 2 Python API in this process,
+            computing the four beta diversity chains concurrently. Requires
+            QIIME 2 to be importable by the server's interpreter. (default: False)
 
     Returns:
         A dictionary containing the command executed, stdout, stderr, and a dictionary of output file paths.
@@ -119,53 +455,84 @@ def qiime_diversity_core_metrics_phylogenetic(
     if verbose:
         cmd.append("--verbose")
 
-    # --- Subprocess Execution ---
-    command_str = " ".join(cmd)
-    logger.info(f"Executing command: {command_str}")
-    try:
-        result = subprocess.run(
-            cmd,
-            capture_output=True,
-            text=True,
-            check=True,
-        )
-    except FileNotFoundError:
-        raise RuntimeError("`qiime` command not found. Please ensure QIIME 2 is installed and in your system's PATH.")
-    except subprocess.CalledProcessError as e:
-        error_message = (
-            f"QIIME 2 command failed with exit code {e.returncode}.\n"
-            f"Command: '{command_str}'\n"
-            f"Stderr: {e.stderr.strip()}\n"
-            f"Stdout: {e.stdout.strip()}"
-        )
-        raise RuntimeError(error_message)
-
-    # --- Structured Result Return ---
+    # --- Output Paths ---
     output_files = {
-        "rarefied_table": str(rarefied_table),
-        "faith_pd_vector": str(faith_pd_vector),
-        "observed_features_vector": str(observed_features_vector),
-        "shannon_vector": str(shannon_vector),
-        "evenness_vector": str(evenness_vector),
-        "unweighted_unifrac_distance_matrix": str(unweighted_unifrac_distance_matrix),
-        "weighted_unifrac_distance_matrix": str(weighted_unifrac_distance_matrix),
-        "jaccard_distance_matrix": str(jaccard_distance_matrix),
-        "bray_curtis_distance_matrix": str(bray_curtis_distance_matrix),
-        "unweighted_unifrac_pcoa_results": str(unweighted_unifrac_pcoa_results),
-        "weighted_unifrac_pcoa_results": str(weighted_unifrac_pcoa_results),
-        "jaccard_pcoa_results": str(jaccard_pcoa_results),
-        "bray_curtis_pcoa_results": str(bray_curtis_pcoa_results),
-        "unweighted_unifrac_emperor": str(unweighted_unifrac_emperor),
-        "weighted_unifrac_emperor": str(weighted_unifrac_emperor),
-        "jaccard_emperor": str(jaccard_emperor),
-        "bray_curtis_emperor": str(bray_curtis_emperor),
+        "rarefied_table": rarefied_table,
+        "faith_pd_vector": faith_pd_vector,
+        "observed_features_vector": observed_features_vector,
+        "shannon_vector": shannon_vector,
+        "evenness_vector": evenness_vector,
+        "unweighted_unifrac_distance_matrix": unweighted_unifrac_distance_matrix,
+        "weighted_unifrac_distance_matrix": weighted_unifrac_distance_matrix,
+        "jaccard_distance_matrix": jaccard_distance_matrix,
+        "bray_curtis_distance_matrix": bray_curtis_distance_matrix,
+        "unweighted_unifrac_pcoa_results": unweighted_unifrac_pcoa_results,
+        "weighted_unifrac_pcoa_results": weighted_unifrac_pcoa_results,
+        "jaccard_pcoa_results": jaccard_pcoa_results,
+        "bray_curtis_pcoa_results": bray_curtis_pcoa_results,
+        "unweighted_unifrac_emperor": unweighted_unifrac_emperor,
+        "weighted_unifrac_emperor": weighted_unifrac_emperor,
+        "jaccard_emperor": jaccard_emperor,
+        "bray_curtis_emperor": bray_curtis_emperor,
     }
+    for output_path in output_files.values():
+        _ensure_parent(output_path)
+
+    command_str = shlex.join(cmd)
+
+    # --- Result Cache Lookup ---
+    cache_key = None
+    if use_cache:
+        cache_key = _cache_key(
+            [table, phylogeny, *metadata],
+            {"action": "diversity core-metrics-phylogenetic", "sampling_depth": sampling_depth},
+        )
+        if _restore_cached(cache_key, output_files):
+            logger.info(f"Cache hit for {cache_key}; skipping: {command_str}")
+            return {
+                "command_executed": command_str,
+                "stdout": f"Restored cached outputs {cache_key} from {_CACHE_DIR}",
+                "stderr": "",
+                "output_files": {name: str(path) for name, path in output_files.items()},
+            }
 
+    # --- In-Process Execution ---
+    if in_process:
+        logger.info(f"Running in-process equivalent of: {command_str}")
+        try:
+            _core_metrics_in_process(table, phylogeny, metadata, sampling_depth, n_jobs, output_files)
+        except ImportError:
+            raise RuntimeError("The QIIME 2 Python API is not importable; run with in_process=False to use the `qiime` CLI.")
+        except Exception as e:
+            raise RuntimeError(f"In-process QIIME 2 pipeline failed: {e}") from e
+        stdout, stderr = "Computed in-process with the QIIME 2 Python API.", ""
+
+    # --- Subprocess Execution ---
+    else:
+        logger.info(f"Executing command: {command_str}")
+        try:
+            result = _run_streamed(cmd)
+        except FileNotFoundError:
+            raise RuntimeError("`qiime` command not found. Please ensure QIIME 2 is installed and in your system's PATH.")
+        except subprocess.CalledProcessError as e:
+            error_message = (
+                f"QIIME 2 command failed with exit code {e.returncode}.\n"
+                f"Command: '{command_str}'\n"
+                f"Stderr: {e.stderr.strip()}\n"
+                f"Stdout: {e.stdout.strip()}"
+            )
+            raise RuntimeError(error_message)
+        stdout, stderr = result.stdout, result.stderr
+
+    if cache_key is not None:
+        _store_cached(cache_key, output_files)
+
+    # --- Structured Result Return ---
     return {
         "command_executed": command_str,
-        "stdout": result.stdout,
-        "stderr": result.stderr,
-        "output_files": output_files,
+        "stdout": stdout,
+        "stderr": stderr,
+        "output_files": {name: str(path) for name, path in output_files.items()},
     }
 
 if __name__ == '__main__':
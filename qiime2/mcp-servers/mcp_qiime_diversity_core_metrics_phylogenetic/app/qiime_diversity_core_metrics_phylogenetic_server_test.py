@@ -0,0 +1,87 @@
+import os
+
+import pytest
+
+import qiime_diversity_core_metrics_phylogenetic_server as server
+
+
+@pytest.fixture
+def cache_dir(tmp_path, monkeypatch):
+    cache = tmp_path / "cache"
+    monkeypatch.setattr(server, "_CACHE_DIR", cache)
+    return cache
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_jaccard_matches_scipy(seed):
+    np = pytest.importorskip("numpy")
+    sparse = pytest.importorskip("scipy.sparse")
+    distance = pytest.importorskip("scipy.spatial.distance")
+
+    rng = np.random.default_rng(seed)
+    n_samples = int(rng.integers(2, 12))
+    n_features = int(rng.integers(1, 70))
+    counts = rng.poisson(0.5, size=(n_samples, n_features))
+    counts[rng.integers(n_samples)] = 0
+
+    expected = distance.squareform(distance.pdist(counts > 0, metric="jaccard"))
+    actual = server._jaccard_distances(sparse.csr_matrix(counts))
+    np.testing.assert_allclose(actual, expected)
+
+
+def test_cache_round_trip(tmp_path, cache_dir):
+    table = tmp_path / "table.qza"
+    table.write_bytes(b"table v1")
+    output = tmp_path / "out" / "rarefied.qza"
+    output.parent.mkdir()
+    output.write_bytes(b"rarefied")
+    outputs = {"rarefied_table": output}
+
+    key = server._cache_key([table], {"sampling_depth": 10})
+    server._store_cached(key, outputs)
+    output.unlink()
+
+    assert server._restore_cached(key, outputs)
+    assert output.read_bytes() == b"rarefied"
+
+
+def test_cache_misses_when_inputs_or_params_change(tmp_path, cache_dir):
+    table = tmp_path / "table.qza"
+    table.write_bytes(b"table v1")
+    output = tmp_path / "rarefied.qza"
+    output.write_bytes(b"rarefied")
+    outputs = {"rarefied_table": output}
+
+    key = server._cache_key([table], {"sampling_depth": 10})
+    server._store_cached(key, outputs)
+
+    other_depth = server._cache_key([table], {"sampling_depth": 20})
+    table.write_bytes(b"table v2")
+    other_table = server._cache_key([table], {"sampling_depth": 10})
+
+    assert len({key, other_depth, other_table}) == 3
+    assert not server._restore_cached(other_depth, outputs)
+    assert not server._restore_cached(other_table, outputs)
+
+
+def test_cache_entry_survives_in_place_rewrite_of_output(tmp_path, cache_dir):
+    table = tmp_path / "table.qza"
+    table.write_bytes(b"table")
+    output = tmp_path / "rarefied.qza"
+    output.write_bytes(b"original")
+    outputs = {"rarefied_table": output}
+
+    key = server._cache_key([table], {})
+    server._store_cached(key, outputs)
+    cached = cache_dir / key / "rarefied_table.qza"
+    assert not os.path.samefile(cached, output)
+
+    with open(output, "r+b") as fh:
+        fh.write(b"REWRITTEN")
+    assert cached.read_bytes() == b"original"
+
+    assert server._restore_cached(key, outputs)
+    assert not os.path.samefile(cached, output)
+    with open(output, "r+b") as fh:
+        fh.write(b"REWRITTEN")
+    assert cached.read_bytes() == b"original"
@@ -0,0 +1,62 @@
+import io
+
+import pytest
+
+import qiime_feature_classifier_classify_consensus_blast_server as server
+
+
+@pytest.fixture
+def imports(monkeypatch):
+    calls = []
+    monkeypatch.setattr(
+        server, "_import_artifact",
+        lambda semantic_type, input_path, output_path, input_format=None: calls.append(
+            (semantic_type, input_path.read_text(), output_path)
+        ),
+    )
+    return calls
+
+
+def test_read_fasta_joins_wrapped_sequences_and_drops_descriptions():
+    fasta = io.StringIO(">a first\nACGT\nAC\n\n>b\nTTTT\n")
+    assert list(server._read_fasta(fasta)) == [("a", "ACGTAC"), ("b", "TTTT")]
+
+
+def test_read_fasta_rejects_header_without_id():
+    fasta = io.StringIO(">a\nACGT\n>\nTTTT\n")
+    with pytest.raises(ValueError, match="line 3"):
+        list(server._read_fasta(fasta))
+
+
+def test_prepare_query_collapses_identical_sequences(tmp_path, imports):
+    query = tmp_path / "query.fasta"
+    query.write_text(">a\nACGT\n>b\nTTTT\n>c\nACGT\n>d\nACGT\n")
+
+    artifact, members = server._prepare_query(query, tmp_path, dedup=True)
+
+    assert artifact == tmp_path / "query.qza"
+    assert members == {"a": ["a", "c", "d"], "b": ["b"]}
+    assert imports == [("FeatureData[Sequence]", ">a\nACGT\n>b\nTTTT\n", artifact)]
+
+
+def test_prepare_query_without_duplicates_imports_fasta_unchanged(tmp_path, imports):
+    query = tmp_path / "query.fasta"
+    query.write_text(">a\nACGT\n>b\nTTTT\n")
+
+    artifact, members = server._prepare_query(query, tmp_path, dedup=True)
+
+    assert members is None
+    assert imports == [("FeatureData[Sequence]", query.read_text(), artifact)]
+
+
+def test_expand_rows_restores_every_original_id():
+    members = {"a": ["a", "c", "d"], "b": ["b"]}
+    rows = ["a\tk__Bacteria\t0.9", "b\tUnassigned\t1.0", "x\tk__Archaea\t1.0"]
+
+    assert server._expand_rows(rows, members) == [
+        "a\tk__Bacteria\t0.9",
+        "c\tk__Bacteria\t0.9",
+        "d\tk__Bacteria\t0.9",
+        "b\tUnassigned\t1.0",
+        "x\tk__Archaea\t1.0",
+    ]
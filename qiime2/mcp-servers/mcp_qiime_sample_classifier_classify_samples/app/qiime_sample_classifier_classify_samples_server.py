@@ -1,23 +1,383 @@
+import asyncio
+import fcntl
+import functools
+import hashlib
+import inspect
+import json
+import os
+import shlex
+import shutil
 import subprocess
+import tempfile
+import zipfile
 from pathlib import Path
-from typing import Optional, List
-from fastmcp import FastMCP
+from typing import Optional, List, Any, Callable, Dict, Tuple
 
-mcp = FastMCP()
+# Successful runs are cached by input content under <cache>/<tool>/<key>/ so reruns skip qiime.
+_CACHE_DIR = Path(os.environ.get("QIIME_MCP_CACHE", "~/.cache/qiime_mcp")).expanduser()
 
-@mcp.tool()
-def qiime_sample_classifier_classify_samples(
+
+@functools.lru_cache(maxsize=256)
+def _file_digest_impl(key: Tuple[str, int, int]) -> str:
+    """BLAKE2b of one file's bytes; key is (resolved path, mtime_ns, size)."""
+    with open(key[0], "rb") as fh:
+        if hasattr(hashlib, "file_digest"):
+            return hashlib.file_digest(fh, lambda: hashlib.blake2b(digest_size=16)).hexdigest()
+        digest = hashlib.blake2b(digest_size=16)
+        for chunk in iter(lambda: fh.read(1 << 20), b""):
+            digest.update(chunk)
+        return digest.hexdigest()
+
+
+def _file_digest(path: Path) -> str:
+    """Digest of path, memoised for as long as its mtime and size are unchanged."""
+    st = os.stat(path)
+    return _file_digest_impl((str(path.resolve()), st.st_mtime_ns, st.st_size))
+
+
+def _hash_inputs(paths: List[Path], params: Dict[str, Any]) -> str:
+    """Hash the per-file digests of every input together with the canonical parameters."""
+    digest = hashlib.blake2b(digest_size=16)
+    for path in paths:
+        digest.update(_file_digest(path).encode())
+    digest.update(json.dumps(params, sort_keys=True, default=str).encode())
+    return digest.hexdigest()
+
+
+def _stat_key(paths: List[Path], params: Dict[str, Any]) -> str:
+    """Cheap prefilter key from each input's resolved path, mtime and size."""
+    digest = hashlib.blake2b(digest_size=16)
+    for path in paths:
+        st = os.stat(path)
+        digest.update(f"{path.resolve()}\0{st.st_mtime_ns}\0{st.st_size}\0".encode())
+    digest.update(json.dumps(params, sort_keys=True, default=str).encode())
+    return digest.hexdigest()
+
+
+def _materialize(src: Path, dst: Path) -> None:
+    """Copy src to a new file at dst without moving bytes through Python where possible.
+
+    Uses os.copy_file_range (which reflinks on Btrfs/XFS and copies in-kernel
+    elsewhere), then shutil.copy2. It never hard-links: qiime rewrites an
+    existing output in place, which would also change the cached artifact.
+    """
+    dst.unlink(missing_ok=True)
+    try:
+        with open(src, "rb") as fin, open(dst, "wb") as fout:
+            remaining = os.fstat(fin.fileno()).st_size
+            while remaining > 0:
+                copied = os.copy_file_range(fin.fileno(), fout.fileno(), remaining)
+                if copied == 0:
+                    break
+                remaining -= copied
+        shutil.copystat(src, dst)
+    except (AttributeError, OSError):
+        shutil.copy2(src, dst)
+
+
+def _retarget(value: Any, paths: Dict[str, str]) -> Any:
+    """Rewrite the paths recorded in a cached result to the ones requested now."""
+    if isinstance(value, str):
+        return paths.get(value, value)
+    if isinstance(value, list):
+        return [_retarget(item, paths) for item in value]
+    if isinstance(value, dict):
+        return {name: _retarget(item, paths) for name, item in value.items()}
+    return value
+
+
+def _artifact_checksums(path: Path) -> Optional[str]:
+    """Digest of a QIIME 2 archive's checksums.md5 member; None for non-archives."""
+    try:
+        with zipfile.ZipFile(path) as archive:
+            member = next((name for name in archive.namelist() if name.endswith("/checksums.md5")), None)
+            if member is None:
+                return None
+            return hashlib.blake2b(archive.read(member), digest_size=16).hexdigest()
+    except (OSError, zipfile.BadZipFile):
+        return None
+
+
+def _ensure_parent(path: Path) -> None:
+    """Create the parent directory of path if it does not exist."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+
+
+def _restore_cached(entry: Path, paths: Dict[str, Path], outputs: Dict[str, Path]) -> Optional[Dict[str, Any]]:
+    """Copy the outputs cached in entry to the requested paths; None on a cache miss.
+
+    Artifacts whose checksums.md5 no longer matches the digest recorded at
+    store time (e.g. a cache file modified after it was stored) evict the entry.
+    """
+    try:
+        manifest = json.loads((entry / "manifest.json").read_text())
+    except (OSError, ValueError):
+        return None
+    if set(manifest["outputs"]) != set(outputs):
+        return None
+    checksums = manifest.get("checksums", {})
+    for name, cached in manifest["outputs"].items():
+        if checksums.get(name) is not None and _artifact_checksums(entry / cached) != checksums[name]:
+            shutil.rmtree(entry, ignore_errors=True)
+            return None
+    for name, path in outputs.items():
+        _ensure_parent(path)
+        _materialize(entry / manifest["outputs"][name], path)
+    renamed = {old: str(paths[name]) for name, old in manifest["paths"].items() if name in paths}
+    result = _retarget(manifest["result"], renamed)
+    command = shlex.split(result["command_executed"])
+    result["command_executed"] = shlex.join(renamed.get(token, token) for token in command)
+    result.pop("log_files", None)
+    result["cached"] = True
+    return result
+
+
+def _store_cached(entry: Path, paths: Dict[str, Path], outputs: Dict[str, Path], result: Dict[str, Any]) -> None:
+    """Publish freshly written outputs and their manifest under entry (best effort)."""
+    try:
+        _ensure_parent(entry)
+        staging = Path(tempfile.mkdtemp(prefix=f".{entry.name}.", dir=entry.parent))
+    except OSError:
+        return
+    try:
+        manifest = {
+            "outputs": {name: f"{name}{path.suffix}" for name, path in outputs.items()},
+            "paths": {name: str(path) for name, path in paths.items()},
+            "result": result,
+            "checksums": {name: _artifact_checksums(path) for name, path in outputs.items()},
+        }
+        for name, path in outputs.items():
+            _materialize(path, staging / manifest["outputs"][name])
+        (staging / "manifest.json").write_text(json.dumps(manifest))
+        os.replace(staging, entry)
+    except OSError:
+        shutil.rmtree(staging, ignore_errors=True)
+
+
+def _cached_tool(inputs: Tuple[str, ...], outputs: Tuple[str, ...]) -> Callable:
+    """Serve repeat calls of a tool from the on-disk cache.
+
+    inputs and outputs name the tool's input and output path parameters; every
+    other parameter except use_cache and force is part of the key. An index
+    keyed by path, mtime and size maps unchanged inputs to their content key
+    without re-reading them. force skips the lookup but still stores the result.
+    """
+    def decorator(fn: Callable) -> Callable:
+        signature = inspect.signature(fn)
+        tool_dir = _CACHE_DIR / fn.__name__
+
+        @functools.wraps(fn)
+        async def wrapper(*args, **kwargs):
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            arguments = bound.arguments
+            if not arguments.get("use_cache", True):
+                return await fn(*args, **kwargs)
+            in_paths = {name: Path(arguments[name]) for name in inputs if arguments[name] is not None}
+            out_paths = {name: Path(arguments[name]) for name in outputs if arguments[name] is not None}
+            params = {
+                name: value for name, value in arguments.items()
+                if name not in inputs and name not in outputs and name not in ("use_cache", "force")
+            }
+            params["inputs"], params["outputs"] = sorted(in_paths), sorted(out_paths)
+            try:
+                stat_key = _stat_key(list(in_paths.values()), params)
+            except OSError:
+                return await fn(*args, **kwargs)
+            index = tool_dir / "index" / stat_key
+            try:
+                key, indexed = index.read_text(), True
+            except OSError:
+                key = await asyncio.to_thread(_hash_inputs, list(in_paths.values()), params)
+                indexed = False
+            paths = {**in_paths, **out_paths}
+            result = None
+            if not arguments.get("force"):
+                result = await asyncio.to_thread(_restore_cached, tool_dir / key, paths, out_paths)
+            if result is None:
+                result = await fn(*args, **kwargs)
+                stored = isinstance(result, dict) and result.get("output_files") and not result.get("error")
+                if not stored:
+                    return result
+                await asyncio.to_thread(_store_cached, tool_dir / key, paths, out_paths, result)
+            if not indexed:
+                try:
+                    _ensure_parent(index)
+                    staged = index.with_name(f".{stat_key}.{os.getpid()}")
+                    staged.write_text(key)
+                    os.replace(staged, index)
+                except OSError:
+                    pass
+            return result
+        return wrapper
+    return decorator
+
+
+# Argument checks are table driven: each schema row is (parameter, check, exception, message).
+def _existing_file(value: Any) -> bool:
+    """True if value names an existing regular file."""
+    return Path(value).is_file()
+
+
+def _positive_int(value: Any) -> bool:
+    """True for an integer greater than zero."""
+    return value > 0
+
+
+def _enum_of(*choices: Any) -> Callable[[Any], bool]:
+    """Build a check that accepts only the given choices."""
+    def check(value: Any) -> bool:
+        return value in choices
+    return check
+
+
+def _chunk_size(value: Any) -> bool:
+    """True for a positive chunk size or the -1 adaptive sentinel."""
+    return value == -1 or value > 0
+
+
+def _validate(arguments: Dict[str, Any], schema: Tuple) -> None:
+    """Raise the schema's exception for the first argument that fails its check."""
+    for name, check, error, message in schema:
+        value = arguments[name]
+        if value is not None and not check(value):
+            raise error(message.format(value=value))
+
+
+def _adaptive_chunk_size(table_path: Path) -> int:
+    """Pick a classify-samples chunk size from the size of the table's BIOM payload."""
+    try:
+        with zipfile.ZipFile(table_path) as archive:
+            size = next(
+                info.file_size for info in archive.infolist()
+                if info.filename.endswith("/data/feature-table.biom")
+            )
+    except (OSError, zipfile.BadZipFile, StopIteration):
+        return 2000
+    return max(2000, min(20000, size // 5000))
+
+
+# Resolved once at import so calls skip the PATH search; None when qiime is not installed.
+_QIIME_BIN = shutil.which("qiime")
+
+# CPython launches children with posix_spawn instead of fork+exec only when the
+# executable path has a directory part and there is no shell, preexec_fn,
+# pass_fds, cwd, start_new_session or close_fds=True. Our descriptors are
+# non-inheritable by default, so close_fds=False leaks nothing into qiime.
+_SPAWN_KWARGS = {"close_fds": False}
+
+# q2cli builds its deployment cache on first use; concurrent first runs can corrupt it.
+_qiime_cache_ready = False
+_qiime_cache_lock = asyncio.Lock()
+
+
+def _q2cli_state_file() -> Path:
+    """Path of q2cli's deployment cache state, following q2cli.util.get_app_dir."""
+    prefix = os.environ.get("CONDA_PREFIX")
+    if prefix and os.access(prefix, os.W_OK | os.X_OK):
+        app_dir = Path(prefix) / "var" / "q2cli"
+    else:
+        app_dir = Path(os.environ.get("XDG_CONFIG_HOME", "~/.config")).expanduser() / "q2cli"
+    return app_dir / "cache" / "state.json"
+
+
+def _init_qiime_cache() -> None:
+    """Under an exclusive file lock, build q2cli's cache with `qiime info` if it is missing or corrupt."""
+    state = _q2cli_state_file()
+    _ensure_parent(state)
+    with open(state.parent / ".init.lock", "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            json.loads(state.read_text())
+        except (OSError, ValueError):
+            subprocess.run([_QIIME_BIN, "info"], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, **_SPAWN_KWARGS)
+
+
+async def _ensure_qiime_cache() -> None:
+    """Initialise q2cli's cache once per process before the first qiime run."""
+    global _qiime_cache_ready
+    if _qiime_cache_ready:
+        return
+    async with _qiime_cache_lock:
+        if not _qiime_cache_ready:
+            await asyncio.to_thread(_init_qiime_cache)
+            _qiime_cache_ready = True
+
+
+# qiime writes straight into log files in a temporary directory of their own, which
+# is removed unless the run fails; only the last _TAIL_BYTES of each are returned.
+_TAIL_BYTES = 64 * 1024
+
+
+def _log_files(output: Path) -> Dict[str, str]:
+    """Paths, in a new temporary directory, for the full stdout and stderr of the run that writes output."""
+    log_dir = tempfile.mkdtemp(prefix="qiime_mcp_logs_")
+    return {stream: os.path.join(log_dir, f"{output.stem}.{stream}.log") for stream in ("stdout", "stderr")}
+
+
+def _discard_logs(log_files: Dict[str, str]) -> None:
+    """Remove the temporary directory holding log_files."""
+    shutil.rmtree(os.path.dirname(log_files["stdout"]), ignore_errors=True)
+
+
+def _log_tail(log_path: str) -> str:
+    """Decode the last _TAIL_BYTES of the log at log_path."""
+    with open(log_path, "rb") as log:
+        size = log.seek(0, os.SEEK_END)
+        log.seek(max(0, size - _TAIL_BYTES))
+        return log.read().decode(errors="replace")
+
+
+async def _run(cmd: List[str], log_files: Dict[str, str]) -> subprocess.CompletedProcess:
+    """Run cmd without blocking the event loop, raising CalledProcessError on failure.
+
+    cmd[0] is replaced by the qiime executable resolved at import. stdout and
+    stderr are redirected to log_files rather than piped through this
+    process; the returned text holds only their last _TAIL_BYTES. The logs
+    are kept only when the command fails.
+    """
+    await _ensure_qiime_cache()
+    with open(log_files["stdout"], "wb") as out, open(log_files["stderr"], "wb") as err:
+        process = await asyncio.create_subprocess_exec(_QIIME_BIN, *cmd[1:], stdout=out, stderr=err, **_SPAWN_KWARGS)
+        try:
+            returncode = await process.wait()
+        except asyncio.CancelledError:
+            process.kill()
+            # Reap the killed child so it does not linger as a zombie.
+            await process.wait()
+            _discard_logs(log_files)
+            raise
+    stdout, stderr = _log_tail(log_files["stdout"]), _log_tail(log_files["stderr"])
+    if returncode != 0:
+        raise subprocess.CalledProcessError(returncode, cmd, output=stdout, stderr=stderr)
+    _discard_logs(log_files)
+    return subprocess.CompletedProcess(cmd, returncode, stdout, stderr)
+
+
+_SCHEMA = (
+    ("i_table", _existing_file, FileNotFoundError, "Input table artifact not found at: {value}"),
+    ("i_sample_estimator", _existing_file, FileNotFoundError, "Input sample estimator artifact not found at: {value}"),
+    ("p_predict_direction", _enum_of("forward", "reverse"), ValueError, "p_predict_direction must be either 'forward' or 'reverse'."),
+    ("p_chunk_size", _chunk_size, ValueError, "p_chunk_size must be a positive integer, or -1 to size chunks from the table."),
+    ("p_n_jobs", _positive_int, ValueError, "p_n_jobs must be a positive integer."),
+)
+
+
+@_cached_tool(inputs=("i_table", "i_sample_estimator"), outputs=("o_prediction", "o_feature_importance", "o_predictions"))
+async def qiime_sample_classifier_classify_samples(
     i_table: Path,
     i_sample_estimator: Path,
     o_prediction: Path,
     o_feature_importance: Optional[Path] = None,
     o_predictions: Optional[Path] = None,
-    p_chunk_size: int = 2000,
+    p_chunk_size: int = -1,
     p_n_jobs: int = 1,
     p_random_state: Optional[int] = None,
     p_predict_direction: str = 'forward',
     verbose: bool = False,
     quiet: bool = False,
+    use_cache: bool = True,
+    force: bool = False,
 ):
     """
     Predicts target values for new samples using a trained QIIME 2 sample classifier.
@@ -31,34 +391,28 @@ def qiime_sample_classifier_classify_samples(
         o_prediction: Path to the output artifact for predicted target values.
         o_feature_importance: Optional path to the output artifact for feature importances.
         o_predictions: Optional path to the output artifact for predicted class probabilities (classifiers only).
-        p_chunk_size: The number of samples to predict on at a time.
+        p_chunk_size: The number of samples to predict on at a time. -1 (the
+                      default) sizes it from the table, between 2000 and 20000.
         p_n_jobs: Number of jobs to run in parallel.
         p_random_state: Seed used by the random number generator.
         p_predict_direction: Direction of feature importances ('forward' or 'reverse').
         verbose: Display verbose output to stdout.
         quiet: Display quiet output to stdout.
+        use_cache: Reuse the outputs of an earlier run with identical inputs and parameters.
+        force: Re-run QIIME 2 even when the cache holds a result for identical inputs and parameters.
 
     Returns:
         A dictionary containing the command executed, stdout, stderr, and a list of output file paths.
     """
     # --- Input Validation ---
-    if not i_table.is_file():
-        raise FileNotFoundError(f"Input table artifact not found at: {i_table}")
-    if not i_sample_estimator.is_file():
-        raise FileNotFoundError(f"Input sample estimator artifact not found at: {i_sample_estimator}")
-
-    if p_predict_direction not in ['forward', 'reverse']:
-        raise ValueError("p_predict_direction must be either 'forward' or 'reverse'.")
-
-    if p_chunk_size <= 0:
-        raise ValueError("p_chunk_size must be a positive integer.")
-    
-    if p_n_jobs <= 0:
-        raise ValueError("p_n_jobs must be a positive integer.")
+    _validate(locals(), _SCHEMA)
 
     if verbose and quiet:
         raise ValueError("Cannot enable both --verbose and --quiet flags simultaneously.")
 
+    if p_chunk_size == -1:
+        p_chunk_size = _adaptive_chunk_size(i_table)
+
     # --- Command Construction ---
     cmd = [
         "qiime", "sample-classifier", "classify-samples",
@@ -88,36 +442,139 @@ def qiime_sample_classifier_classify_samples(
     if quiet:
         cmd.append("--quiet")
 
+    command_executed = shlex.join(cmd)
+
     # --- Subprocess Execution ---
-    try:
-        result = subprocess.run(
-            cmd,
-            capture_output=True,
-            text=True,
-            check=True
-        )
-        return {
-            "command_executed": " ".join(cmd),
-            "stdout": result.stdout,
-            "stderr": result.stderr,
-            "output_files": output_files
-        }
-    except FileNotFoundError:
+    if _QIIME_BIN is None:
         return {
-            "command_executed": " ".join(cmd),
+            "command_executed": command_executed,
             "stdout": "",
             "stderr": "QIIME 2 command not found. Please ensure 'qiime' is installed and in your system's PATH.",
             "error": "Command not found",
             "output_files": []
         }
+
+    log_files = _log_files(o_prediction)
+    try:
+        result = await _run(cmd, log_files)
+        return {
+            "command_executed": command_executed,
+            "stdout": result.stdout,
+            "stderr": result.stderr,
+            "output_files": output_files
+        }
     except subprocess.CalledProcessError as e:
         return {
-            "command_executed": " ".join(cmd),
+            "command_executed": command_executed,
             "stdout": e.stdout,
             "stderr": e.stderr,
+            "log_files": log_files,
             "error": f"Command failed with exit code {e.returncode}",
             "output_files": []
         }
 
+
+async def classify_samples_batched(
+    tables: List[Path],
+    i_sample_estimator: Path,
+    o_prediction: Path,
+    o_predictions: Optional[Path] = None,
+    p_chunk_size: int = -1,
+    p_n_jobs: int = 1,
+    p_random_state: Optional[int] = None,
+    use_cache: bool = True,
+    force: bool = False,
+) -> Dict[str, Any]:
+    """
+    Predicts target values for the samples of several feature tables in one QIIME 2 call.
+
+    The tables are merged with `qiime feature-table merge` and classified
+    together, so the estimator is loaded and the interpreter started once
+    rather than once per table. Sample IDs must not repeat across tables.
+
+    Args:
+        tables: Paths to the feature table artifacts containing features for prediction.
+        i_sample_estimator: Path to the sample classifier artifact trained with fit-classifier or fit-regressor.
+        o_prediction: Path to the output artifact for predicted target values of all samples.
+        o_predictions: Optional path to the output artifact for predicted class probabilities (classifiers only).
+        p_chunk_size: The number of samples to predict on at a time; -1 sizes it from the merged table.
+        p_n_jobs: Number of jobs to run in parallel.
+        p_random_state: Seed used by the random number generator.
+        use_cache: Reuse the outputs of an earlier run with identical inputs and parameters.
+        force: Re-run QIIME 2 even when the cache holds a result for identical inputs and parameters.
+
+    Returns:
+        The classify-samples result for the merged table, plus the merge command
+        under merge_command_executed when more than one table was given.
+    """
+    if not tables:
+        raise ValueError("At least one feature table must be provided.")
+    for table in tables:
+        if not table.is_file():
+            raise FileNotFoundError(f"Input table artifact not found at: {table}")
+    classify = functools.partial(
+        qiime_sample_classifier_classify_samples,
+        i_sample_estimator=i_sample_estimator,
+        o_prediction=o_prediction,
+        o_predictions=o_predictions,
+        p_chunk_size=p_chunk_size,
+        p_n_jobs=p_n_jobs,
+        p_random_state=p_random_state,
+        use_cache=use_cache,
+        force=force,
+    )
+    if len(tables) == 1:
+        return await classify(i_table=tables[0])
+
+    with tempfile.TemporaryDirectory(prefix="classify_samples_") as workdir:
+        merged = Path(workdir) / "merged-table.qza"
+        cmd = ["qiime", "feature-table", "merge"]
+        for table in tables:
+            cmd.extend(["--i-tables", str(table)])
+        cmd.extend(["--o-merged-table", str(merged)])
+        merge_command = shlex.join(cmd)
+        if _QIIME_BIN is None:
+            return {
+                "command_executed": merge_command,
+                "stdout": "",
+                "stderr": "QIIME 2 command not found. Please ensure 'qiime' is installed and in your system's PATH.",
+                "error": "Command not found",
+                "output_files": []
+            }
+        try:
+            await _run(cmd, _log_files(merged))
+        except subprocess.CalledProcessError as e:
+            return {
+                "command_executed": merge_command,
+                "stdout": e.stdout,
+                "stderr": e.stderr,
+                "error": f"Command failed with exit code {e.returncode}",
+                "output_files": []
+            }
+        result = await classify(i_table=merged)
+    result["merge_command_executed"] = merge_command
+    return result
+
+
+def _build():
+    """Create the MCP server; fastmcp is only imported once the server is actually started."""
+    from fastmcp import FastMCP
+
+    mcp = FastMCP()
+    for tool in (qiime_sample_classifier_classify_samples, classify_samples_batched):
+        mcp.tool()(tool)
+    return mcp
+
+
+def __getattr__(name: str):
+    # `from qiime_sample_classifier_classify_samples_server import mcp` still works: the server is
+    # built on first access and then cached as a module attribute.
+    if name == "mcp":
+        global mcp
+        mcp = _build()
+        return mcp
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
 if __name__ == '__main__':
-    mcp.run()
\ No newline at end of file
+    _build().run()
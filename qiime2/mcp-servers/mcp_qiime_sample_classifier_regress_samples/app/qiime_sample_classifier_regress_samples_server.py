@@ -1,12 +1,170 @@
+import asyncio
+import contextlib
+import json
+import os
+import shlex
 import subprocess
+import sys
+from collections import deque
 from pathlib import Path
-from typing import Optional, Literal
+from typing import Optional, Literal, List, get_args
 from fastmcp import FastMCP
 
 mcp = FastMCP()
 
+# Only the last _TAIL_LINES lines of each output stream are kept in memory.
+_TAIL_LINES = 2000
+
+
+async def _drain(stream: asyncio.StreamReader, tail: deque) -> None:
+    """Consume a subprocess stream, keeping its last raw lines in tail for _run to decode."""
+    async for line in stream:
+        tail.append(line.rstrip(b"\n"))
+
+
+# Source of the long-lived workers: each pays the qiime2/q2cli import and plugin
+# discovery once, then runs newline-delimited JSON requests through q2cli.
+_WORKER_SOURCE = r'''
+import contextlib, io, json, os, sys
+TAIL_LINES = int(sys.argv[1])
+protocol = os.fdopen(os.dup(1), "w")
+os.dup2(2, 1)
+from qiime2.sdk import PluginManager
+from q2cli.commands import RootCommand
+PluginManager()
+root = RootCommand()
+protocol.write(json.dumps({"ready": True}) + "\n")
+protocol.flush()
+for line in sys.stdin:
+    argv = json.loads(line)["argv"]
+    out, err = io.StringIO(), io.StringIO()
+    with contextlib.redirect_stdout(out), contextlib.redirect_stderr(err):
+        try:
+            rc = root.main(args=argv, prog_name="qiime", standalone_mode=False)
+            rc = rc if isinstance(rc, int) else 0
+        except SystemExit as exc:
+            rc = exc.code if isinstance(exc.code, int) else 1
+        except Exception as exc:
+            print(exc, file=sys.stderr)
+            rc = getattr(exc, "exit_code", 1)
+    tails = {name: "\n".join(buf.getvalue().splitlines()[-TAIL_LINES:]) for name, buf in (("stdout", out), ("stderr", err))}
+    protocol.write(json.dumps({"ok": rc == 0, "returncode": rc, **tails}) + "\n")
+    protocol.flush()
+'''
+
+# Pool of warm workers, created on first use; a slot holds None until its worker is started.
+# There is always at least one slot, so waiting for a worker cannot hang; set
+# QIIME_MCP_WORKER=0 to turn the workers off.
+_WORKER_COUNT = max(1, int(os.environ.get("QIIME_MCP_WORKERS", "2")))
+_worker_pool: Optional[asyncio.Queue] = None
+_worker_disabled = os.environ.get("QIIME_MCP_WORKER", "1") == "0"
+
+
+async def _start_worker() -> Optional[asyncio.subprocess.Process]:
+    """Spawn a warm worker and wait for its handshake; None if qiime2 cannot load."""
+    process = await asyncio.create_subprocess_exec(
+        sys.executable, "-c", _WORKER_SOURCE, str(_TAIL_LINES),
+        stdin=asyncio.subprocess.PIPE, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.DEVNULL,
+        limit=1 << 24,
+    )
+    if await process.stdout.readline():
+        return process
+    await process.wait()
+    return None
+
+
+async def _worker_call(cmd: List[str]) -> Optional[subprocess.CompletedProcess]:
+    """Run a qiime command in an idle warm worker from the pool.
+
+    Returns None when workers are disabled, all busy or the chosen one has
+    died, in which case the caller falls back to the qiime CLI.
+    """
+    global _worker_pool, _worker_disabled
+    if _worker_disabled or cmd[0] != "qiime":
+        return None
+    if _worker_pool is None:
+        _worker_pool = asyncio.Queue()
+        for _ in range(_WORKER_COUNT):
+            _worker_pool.put_nowait(None)
+    try:
+        worker = _worker_pool.get_nowait()
+    except asyncio.QueueEmpty:
+        return None
+    try:
+        if worker is None or worker.returncode is not None:
+            worker = await _start_worker()
+            if worker is None:
+                _worker_disabled = True
+                return None
+        try:
+            worker.stdin.write((json.dumps({"argv": cmd[1:]}) + "\n").encode())
+            await worker.stdin.drain()
+            reply = await worker.stdout.readline()
+        except (OSError, ValueError):
+            reply = b""
+        if not reply:
+            with contextlib.suppress(ProcessLookupError):
+                worker.kill()
+            worker = None
+            return None
+    except asyncio.CancelledError:
+        # The worker may still be running the abandoned command, so it cannot be reused.
+        if worker is not None:
+            with contextlib.suppress(ProcessLookupError):
+                worker.kill()
+            worker = None
+        raise
+    finally:
+        _worker_pool.put_nowait(worker)
+    reply = json.loads(reply)
+    return subprocess.CompletedProcess(cmd, reply["returncode"], reply["stdout"], reply["stderr"])
+
+
+async def _run(cmd: List[str]) -> subprocess.CompletedProcess:
+    """Run cmd without blocking the event loop, raising CalledProcessError on failure.
+
+    A warm worker from the pool runs the command when one is idle; otherwise
+    the qiime CLI is spawned. Only the last _TAIL_LINES lines of stdout and
+    stderr are kept.
+    """
+    result = await _worker_call(cmd)
+    if result is not None:
+        result.check_returncode()
+        return result
+    process = await asyncio.create_subprocess_exec(
+        *cmd, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE, limit=1 << 20
+    )
+    stdout_tail: deque = deque(maxlen=_TAIL_LINES)
+    stderr_tail: deque = deque(maxlen=_TAIL_LINES)
+    try:
+        await asyncio.gather(_drain(process.stdout, stdout_tail), _drain(process.stderr, stderr_tail))
+        returncode = await process.wait()
+    except asyncio.CancelledError:
+        process.kill()
+        raise
+    # Only the kept tail is decoded, once, rather than every line as it streams past.
+    stdout = b"\n".join(stdout_tail).decode(errors="replace")
+    stderr = b"\n".join(stderr_tail).decode(errors="replace")
+    if returncode != 0:
+        raise subprocess.CalledProcessError(returncode, cmd, output=stdout, stderr=stderr)
+    return subprocess.CompletedProcess(cmd, returncode, stdout, stderr)
+
+
+# Invariant head of the qiime command line, built once at import.
+_REGRESS_SAMPLES_PREFIX = ("qiime", "sample-classifier", "regress-samples")
+
+# Accepted choices, kept as Literal aliases for the tool schema and as frozensets for the checks.
+_Estimator = Literal[
+    'RandomForestRegressor', 'ExtraTreesRegressor', 'GradientBoostingRegressor',
+    'AdaBoostRegressor', 'KNeighborsRegressor', 'SVR', 'Ridge', 'Lasso', 'ElasticNet'
+]
+_MissingSamples = Literal['error', 'ignore']
+_ESTIMATORS = frozenset(get_args(_Estimator))
+_MISSING_SAMPLES = frozenset(get_args(_MissingSamples))
+
+
 @mcp.tool()
-def qiime_sample_classifier_regress_samples(
+async def qiime_sample_classifier_regress_samples(
     table: Path,
     metadata_file: Path,
     metadata_column: str,
@@ -19,13 +177,10 @@ def qiime_sample_classifier_regress_samples(
     random_state: Optional[int] = None,
     n_jobs: int = 1,
     n_estimators: int = 100,
-    estimator: Literal[
-        'RandomForestRegressor', 'ExtraTreesRegressor', 'GradientBoostingRegressor',
-        'AdaBoostRegressor', 'KNeighborsRegressor', 'SVR', 'Ridge', 'Lasso', 'ElasticNet'
-    ] = 'RandomForestRegressor',
+    estimator: _Estimator = 'RandomForestRegressor',
     optimize_feature_selection: bool = False,
     parameter_tuning: bool = False,
-    missing_samples: Literal['error', 'ignore'] = 'error',
+    missing_samples: _MissingSamples = 'error',
     model_summary: Optional[Path] = None,
     accuracy_results: Optional[Path] = None,
     verbose: bool = False,
@@ -51,12 +206,16 @@ def qiime_sample_classifier_regress_samples(
         raise ValueError("cv (cross-validation folds) must be at least 1.")
     if n_estimators < 1:
         raise ValueError("n_estimators must be at least 1.")
+    if estimator not in _ESTIMATORS:
+        raise ValueError(f"estimator must be one of {sorted(_ESTIMATORS)}, but got '{estimator}'.")
+    if missing_samples not in _MISSING_SAMPLES:
+        raise ValueError(f"missing_samples must be one of {sorted(_MISSING_SAMPLES)}, but got '{missing_samples}'.")
 
     # --- Command Construction ---
     cmd = [
-        "qiime", "sample-classifier", "regress-samples",
-        "--i-table", str(table),
-        "--m-metadata-file", str(metadata_file),
+        *_REGRESS_SAMPLES_PREFIX,
+        "--i-table", os.fspath(table),
+        "--m-metadata-file", os.fspath(metadata_file),
         "--m-metadata-column", metadata_column,
         "--p-test-size", str(test_size),
         "--p-step", str(step),
@@ -65,9 +224,9 @@ def qiime_sample_classifier_regress_samples(
         "--p-n-estimators", str(n_estimators),
         "--p-estimator", estimator,
         "--p-missing-samples", missing_samples,
-        "--o-sample-estimator", str(sample_estimator),
-        "--o-feature-importance", str(feature_importance),
-        "--o-predictions", str(predictions),
+        "--o-sample-estimator", os.fspath(sample_estimator),
+        "--o-feature-importance", os.fspath(feature_importance),
+        "--o-predictions", os.fspath(predictions),
     ]
 
     if random_state is not None:
@@ -76,24 +235,21 @@ def qiime_sample_classifier_regress_samples(
         cmd.append("--p-optimize-feature-selection")
     if parameter_tuning:
         cmd.append("--p-parameter-tuning")
-    if model_summary:
-        cmd.extend(["--o-model-summary", str(model_summary)])
-    if accuracy_results:
-        cmd.extend(["--o-accuracy-results", str(accuracy_results)])
+    if model_summary is not None:
+        cmd.extend(["--o-model-summary", os.fspath(model_summary)])
+    if accuracy_results is not None:
+        cmd.extend(["--o-accuracy-results", os.fspath(accuracy_results)])
     if verbose:
         cmd.append("--verbose")
 
+    command_executed = shlex.join(cmd)
+
     # --- Subprocess Execution ---
     try:
-        result = subprocess.run(
-            cmd,
-            capture_output=True,
-            text=True,
-            check=True
-        )
+        result = await _run(cmd)
     except FileNotFoundError:
         return {
-            "command_executed": " ".join(cmd),
+            "command_executed": command_executed,
             "stdout": "",
             "stderr": "Error: 'qiime' command not found. Make sure QIIME 2 is installed and activated in your environment.",
             "output_files": {},
@@ -101,7 +257,7 @@ def qiime_sample_classifier_regress_samples(
         }
     except subprocess.CalledProcessError as e:
         return {
-            "command_executed": " ".join(cmd),
+            "command_executed": command_executed,
             "stdout": e.stdout,
             "stderr": e.stderr,
             "output_files": {},
@@ -110,33 +266,36 @@ def qiime_sample_classifier_regress_samples(
         }
 
     # --- Output Handling ---
+    # Held as strings from the start, so the same dict is checked and returned.
     output_files = {
-        "sample_estimator": sample_estimator,
-        "feature_importance": feature_importance,
-        "predictions": predictions,
+        "sample_estimator": os.fspath(sample_estimator),
+        "feature_importance": os.fspath(feature_importance),
+        "predictions": os.fspath(predictions),
     }
     if model_summary:
-        output_files["model_summary"] = model_summary
+        output_files["model_summary"] = os.fspath(model_summary)
     if accuracy_results:
-        output_files["accuracy_results"] = accuracy_results
-
-    # Verify that output files were created
-    for key, path in output_files.items():
-        if not path.exists():
-            return {
-                "command_executed": " ".join(cmd),
-                "stdout": result.stdout,
-                "stderr": result.stderr + f"\nError: Expected output file '{key}' was not created at {path}.",
-                "output_files": {},
-                "error": "Output file generation failed."
-            }
+        output_files["accuracy_results"] = os.fspath(accuracy_results)
+
+    # qiime exits non-zero if it cannot save an output and saves them in signature
+    # order, so a single stat of the last one requested catches a missing result.
+    key = list(output_files)[-1]
+    path = output_files[key]
+    if not os.path.exists(path):
+        return {
+            "command_executed": command_executed,
+            "stdout": result.stdout,
+            "stderr": result.stderr + f"\nError: Expected output file '{key}' was not created at {path}.",
+            "output_files": {},
+            "error": "Output file generation failed."
+        }
 
     # --- Structured Result Return ---
     return {
-        "command_executed": " ".join(cmd),
+        "command_executed": command_executed,
         "stdout": result.stdout,
         "stderr": result.stderr,
-        "output_files": {k: str(v) for k, v in output_files.items()}
+        "output_files": output_files
     }
 
 if __name__ == '__main__':
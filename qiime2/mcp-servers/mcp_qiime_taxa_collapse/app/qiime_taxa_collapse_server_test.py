@@ -0,0 +1,52 @@
+import asyncio
+import sys
+
+import pytest
+
+import qiime_taxa_collapse_server as server
+
+# Stand-in for the qiime CLI: writes the --o-collapsed-table it is given.
+FAKE_QIIME = f"""#!{sys.executable}
+import sys
+args = sys.argv[1:]
+output = args[args.index("--o-collapsed-table") + 1]
+open(output, "w").write("collapsed")
+print("Saved FeatureTable[Frequency] to: " + output)
+"""
+
+
+@pytest.fixture
+def fake_qiime(tmp_path, monkeypatch):
+    bin_dir = tmp_path / "bin"
+    bin_dir.mkdir()
+    qiime = bin_dir / "qiime"
+    qiime.write_text(FAKE_QIIME)
+    qiime.chmod(0o755)
+    monkeypatch.setenv("PATH", f"{bin_dir}:{server.os.environ['PATH']}")
+    monkeypatch.setattr(server, "_worker_disabled", True)
+
+
+def test_batch_runs_every_table_through_the_mcp_server(tmp_path, fake_qiime):
+    from fastmcp import Client
+
+    taxonomy = tmp_path / "taxonomy.qza"
+    taxonomy.write_text("taxonomy")
+    tables = [tmp_path / f"table{i}.qza" for i in range(3)]
+    for table in tables:
+        table.write_text("table")
+    outputs = [tmp_path / "out" / f"collapsed{i}.qza" for i in range(3)]
+
+    async def call():
+        async with Client(server.mcp) as client:
+            return await client.call_tool("taxa_collapse_batch", {
+                "i_tables": [str(path) for path in tables],
+                "i_taxonomy": str(taxonomy),
+                "p_level": 2,
+                "o_collapsed_tables": [str(path) for path in outputs],
+            })
+
+    results = asyncio.run(call()).structured_content["result"]
+
+    assert [result.get("error") for result in results] == [None] * 3
+    assert [result["output_files"]["collapsed_table"] for result in results] == [str(path) for path in outputs]
+    assert all(path.read_text() == "collapsed" for path in outputs)
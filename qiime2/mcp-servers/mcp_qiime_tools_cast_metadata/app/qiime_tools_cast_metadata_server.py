@@ -1,17 +1,167 @@
 from fastmcp import FastMCP
+import asyncio
+import contextlib
+import json
+import os
+import shlex
 import subprocess
+import sys
+from collections import deque
 from pathlib import Path
-from typing import List, Dict, Union
+from typing import List, Dict, Union, Optional
 import logging
 
-# It's a good practice to set up a logger for server-side applications.
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
 mcp = FastMCP()
 
+# Only the last _TAIL_LINES lines of each output stream are kept in memory.
+_TAIL_LINES = 2000
+
+
+async def _drain(stream: asyncio.StreamReader, tail: deque) -> None:
+    """Consume a subprocess stream, keeping its last raw lines in tail for _run to decode."""
+    async for line in stream:
+        tail.append(line.rstrip(b"\n"))
+
+
+# Source of the long-lived workers: each pays the qiime2/q2cli import and plugin
+# discovery once, then runs newline-delimited JSON requests through q2cli.
+_WORKER_SOURCE = r'''
+import contextlib, io, json, os, sys
+TAIL_LINES = int(sys.argv[1])
+protocol = os.fdopen(os.dup(1), "w")
+os.dup2(2, 1)
+from qiime2.sdk import PluginManager
+from q2cli.commands import RootCommand
+PluginManager()
+root = RootCommand()
+protocol.write(json.dumps({"ready": True}) + "\n")
+protocol.flush()
+for line in sys.stdin:
+    argv = json.loads(line)["argv"]
+    out, err = io.StringIO(), io.StringIO()
+    with contextlib.redirect_stdout(out), contextlib.redirect_stderr(err):
+        try:
+            rc = root.main(args=argv, prog_name="qiime", standalone_mode=False)
+            rc = rc if isinstance(rc, int) else 0
+        except SystemExit as exc:
+            rc = exc.code if isinstance(exc.code, int) else 1
+        except Exception as exc:
+            print(exc, file=sys.stderr)
+            rc = getattr(exc, "exit_code", 1)
+    tails = {name: "\n".join(buf.getvalue().splitlines()[-TAIL_LINES:]) for name, buf in (("stdout", out), ("stderr", err))}
+    protocol.write(json.dumps({"ok": rc == 0, "returncode": rc, **tails}) + "\n")
+    protocol.flush()
+'''
+
+# Pool of warm workers, created on first use; a slot holds None until its worker is started.
+# There is always at least one slot, so waiting for a worker cannot hang; set
+# QIIME_MCP_WORKER=0 to turn the workers off.
+_WORKER_COUNT = max(1, int(os.environ.get("QIIME_MCP_WORKERS", "2")))
+_worker_pool: Optional[asyncio.Queue] = None
+_worker_disabled = os.environ.get("QIIME_MCP_WORKER", "1") == "0"
+
+
+async def _start_worker() -> Optional[asyncio.subprocess.Process]:
+    """Spawn a warm worker and wait for its handshake; None if qiime2 cannot load."""
+    process = await asyncio.create_subprocess_exec(
+        sys.executable, "-c", _WORKER_SOURCE, str(_TAIL_LINES),
+        stdin=asyncio.subprocess.PIPE, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.DEVNULL,
+        limit=1 << 24,
+    )
+    if await process.stdout.readline():
+        return process
+    await process.wait()
+    return None
+
+
+async def _worker_call(cmd: List[str]) -> Optional[subprocess.CompletedProcess]:
+    """Run a qiime command in an idle warm worker from the pool.
+
+    Returns None when workers are disabled, all busy or the chosen one has
+    died, in which case the caller falls back to the qiime CLI.
+    """
+    global _worker_pool, _worker_disabled
+    if _worker_disabled or cmd[0] != "qiime":
+        return None
+    if _worker_pool is None:
+        _worker_pool = asyncio.Queue()
+        for _ in range(_WORKER_COUNT):
+            _worker_pool.put_nowait(None)
+    try:
+        worker = _worker_pool.get_nowait()
+    except asyncio.QueueEmpty:
+        return None
+    try:
+        if worker is None or worker.returncode is not None:
+            worker = await _start_worker()
+            if worker is None:
+                _worker_disabled = True
+                return None
+        try:
+            worker.stdin.write((json.dumps({"argv": cmd[1:]}) + "\n").encode())
+            await worker.stdin.drain()
+            reply = await worker.stdout.readline()
+        except (OSError, ValueError):
+            reply = b""
+        if not reply:
+            with contextlib.suppress(ProcessLookupError):
+                worker.kill()
+            worker = None
+            return None
+    except asyncio.CancelledError:
+        # The worker may still be running the abandoned command, so it cannot be reused.
+        if worker is not None:
+            with contextlib.suppress(ProcessLookupError):
+                worker.kill()
+            worker = None
+        raise
+    finally:
+        _worker_pool.put_nowait(worker)
+    reply = json.loads(reply)
+    return subprocess.CompletedProcess(cmd, reply["returncode"], reply["stdout"], reply["stderr"])
+
+
+async def _run(cmd: List[str]) -> subprocess.CompletedProcess:
+    """Run cmd without blocking the event loop, raising CalledProcessError on failure.
+
+    A warm worker from the pool runs the command when one is idle; otherwise
+    the qiime CLI is spawned. Only the last _TAIL_LINES lines of stdout and
+    stderr are kept.
+    """
+    result = await _worker_call(cmd)
+    if result is not None:
+        result.check_returncode()
+        return result
+    process = await asyncio.create_subprocess_exec(
+        *cmd, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE, limit=1 << 20
+    )
+    stdout_tail: deque = deque(maxlen=_TAIL_LINES)
+    stderr_tail: deque = deque(maxlen=_TAIL_LINES)
+    try:
+        await asyncio.gather(_drain(process.stdout, stdout_tail), _drain(process.stderr, stderr_tail))
+        returncode = await process.wait()
+    except asyncio.CancelledError:
+        process.kill()
+        raise
+    # Only the kept tail is decoded, once, rather than every line as it streams past.
+    stdout = b"\n".join(stdout_tail).decode(errors="replace")
+    stderr = b"\n".join(stderr_tail).decode(errors="replace")
+    if returncode != 0:
+        raise subprocess.CalledProcessError(returncode, cmd, output=stdout, stderr=stderr)
+    return subprocess.CompletedProcess(cmd, returncode, stdout, stderr)
+
+
+# Invariant head of the qiime command line, built once at import.
+_CAST_METADATA_PREFIX = ("qiime", "tools", "cast-metadata")
+
+# Lines of stderr quoted when a qiime run fails.
+_ERROR_TAIL_LINES = 20
+
+
 @mcp.tool()
-def cast_metadata(
+async def cast_metadata(
     metadata_files: List[Path],
     cast: List[str],
     output_file: Path,
@@ -41,8 +191,9 @@ def cast_metadata(
     Raises:
         ValueError: If required list arguments `metadata_files` or `cast` are empty.
         FileNotFoundError: If any of the input metadata files do not exist.
-        RuntimeError: If the 'qiime' command is not found in the system's PATH.
-        subprocess.CalledProcessError: If the QIIME 2 command fails for any reason.
+        RuntimeError: If the 'qiime' command is not found in the system's PATH, or
+                      if the QIIME 2 command fails; the message ends with the
+                      last lines of its stderr.
     """
     # 1. Input Validation
     if not metadata_files:
@@ -55,58 +206,53 @@ def cast_metadata(
             raise FileNotFoundError(f"Input metadata file not found: {f}")
     
     for c in cast:
-        if ':' not in c or len(c.split(':')) != 2:
+        column, sep, cast_type = c.partition(':')
+        if not sep or not column or ':' in cast_type:
             raise ValueError(f"Invalid format for --cast argument: '{c}'. Expected 'COLUMN:TYPE'.")
 
     # 2. File Path Handling: Ensure the output directory exists
     try:
         output_file.parent.mkdir(parents=True, exist_ok=True)
     except Exception as e:
-        logger.error(f"Failed to create output directory for {output_file}: {e}")
+        logger.error("Failed to create output directory for %s: %s", output_file, e)
         raise
 
     # 3. Command Construction
-    cmd = ["qiime", "tools", "cast-metadata"]
+    cmd = [*_CAST_METADATA_PREFIX]
     
     # Add options
     for c in cast:
         cmd.extend(["--cast", c])
     
-    cmd.extend(["--output-file", str(output_file)])
+    cmd.extend(["--output-file", os.fspath(output_file)])
     
     if ignore_missing_samples:
         cmd.append("--ignore-missing-samples")
     
     # Add positional arguments (inputs) at the end
-    cmd.extend([str(f) for f in metadata_files])
+    cmd.extend(map(os.fspath, metadata_files))
 
-    command_executed = " ".join(cmd)
-    logger.info(f"Executing command: {command_executed}")
+    command_executed = shlex.join(cmd)
+    logger.info("Executing command: %s", command_executed)
 
     # 4. Subprocess Execution and Error Handling
     try:
-        result = subprocess.run(
-            cmd,
-            check=True,
-            capture_output=True,
-            text=True
-        )
+        result = await _run(cmd)
     except FileNotFoundError:
         # This handles the case where 'qiime' is not in the system's PATH
         error_msg = "QIIME 2 command-line tool ('qiime') not found. Please ensure QIIME 2 is installed and its environment is activated."
         logger.error(error_msg)
         raise RuntimeError(error_msg)
     except subprocess.CalledProcessError as e:
-        # Capture and log detailed error information from the failed process
-        error_message = (
+        # QIIME's own error message is at the end of stderr; keep a bounded tail
+        # of it in both the log record and the error returned to the client.
+        stderr_tail = "\n".join((e.stderr or "").strip().splitlines()[-_ERROR_TAIL_LINES:])
+        logger.error("QIIME 2 command failed with exit code %s: %s\n%s", e.returncode, command_executed, stderr_tail)
+        raise RuntimeError(
             f"QIIME 2 command failed with exit code {e.returncode}.\n"
             f"Command: {command_executed}\n"
-            f"Stderr: {e.stderr.strip()}\n"
-            f"Stdout: {e.stdout.strip()}"
-        )
-        logger.error(error_message)
-        # Re-raise the exception to let the MCP framework handle the failure response
-        raise e
+            f"Stderr: {stderr_tail}"
+        ) from e
 
     # 5. Structured Result Return
     return {
@@ -119,4 +265,6 @@ def cast_metadata(
     }
 
 if __name__ == '__main__':
+    # Configure root logging only when run as a server, not on import.
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
     mcp.run()
\ No newline at end of file
@@ -0,0 +1,54 @@
+import asyncio
+import sys
+
+import pytest
+
+import qiime_tools_export_server as server
+
+# Stand-in for the qiime CLI: creates the --output-path directory with two files.
+FAKE_QIIME = f"""#!{sys.executable}
+import os, sys
+args = sys.argv[1:]
+output = args[args.index("--output-path") + 1]
+os.makedirs(os.path.join(output, "data"))
+open(os.path.join(output, "dna-sequences.fasta"), "w").write(">a\\nACGT\\n")
+open(os.path.join(output, "data", "metadata.yaml"), "w").write("{{}}")
+print("Exported to " + output)
+"""
+
+
+@pytest.fixture
+def fake_qiime(tmp_path, monkeypatch):
+    bin_dir = tmp_path / "bin"
+    bin_dir.mkdir()
+    qiime = bin_dir / "qiime"
+    qiime.write_text(FAKE_QIIME)
+    qiime.chmod(0o755)
+    monkeypatch.setenv("PATH", f"{bin_dir}:{server.os.environ['PATH']}")
+    monkeypatch.setattr(server, "_worker_disabled", True)
+
+
+def test_batch_exports_every_artifact_through_the_mcp_server(tmp_path, fake_qiime):
+    from fastmcp import Client
+
+    inputs = [tmp_path / f"seqs{i}.qza" for i in range(3)]
+    for path in inputs:
+        path.write_text("artifact")
+    outputs = [tmp_path / "out" / f"seqs{i}" for i in range(3)]
+
+    async def call():
+        async with Client(server.mcp) as client:
+            return await client.call_tool("tools_export_batch", {
+                "input_paths": [str(path) for path in inputs],
+                "output_paths": [str(path) for path in outputs],
+            })
+
+    results = asyncio.run(call()).structured_content["result"]
+
+    assert [result.get("error") for result in results] == [None] * 3
+    for result, output in zip(results, outputs):
+        assert result["output_directory"] == str(output)
+        assert result["exported_file_count"] == 2
+        assert sorted(result["exported_files"]) == sorted([
+            str(output / "dna-sequences.fasta"), str(output / "data" / "metadata.yaml"),
+        ])
@@ -1,14 +1,227 @@
+import asyncio
+import contextlib
+import contextvars
+import hashlib
+import json
+import os
+import shlex
+import shutil
 import subprocess
+import sys
+from collections import deque
 from pathlib import Path
-from typing import Optional, Dict, List
+from typing import Optional, Dict, List, Any, Awaitable, Callable, Tuple
 
 from fastmcp import FastMCP
 
 mcp = FastMCP()
 
 
-@mcp.tool()
-def tools_import(
+# Only the last _TAIL_LINES lines of each output stream are kept in memory.
+_TAIL_LINES = 2000
+
+
+async def _drain(stream: asyncio.StreamReader, tail: deque) -> None:
+    """Consume a subprocess stream, keeping its last raw lines in tail for _run to decode."""
+    async for line in stream:
+        tail.append(line.rstrip(b"\n"))
+
+
+# Source of the long-lived workers: each pays the qiime2/q2cli import and plugin
+# discovery once, then runs newline-delimited JSON requests through q2cli.
+_WORKER_SOURCE = r'''
+import contextlib, io, json, os, sys
+TAIL_LINES = int(sys.argv[1])
+protocol = os.fdopen(os.dup(1), "w")
+os.dup2(2, 1)
+from qiime2.sdk import PluginManager
+from q2cli.commands import RootCommand
+PluginManager()
+root = RootCommand()
+protocol.write(json.dumps({"ready": True}) + "\n")
+protocol.flush()
+for line in sys.stdin:
+    argv = json.loads(line)["argv"]
+    out, err = io.StringIO(), io.StringIO()
+    with contextlib.redirect_stdout(out), contextlib.redirect_stderr(err):
+        try:
+            rc = root.main(args=argv, prog_name="qiime", standalone_mode=False)
+            rc = rc if isinstance(rc, int) else 0
+        except SystemExit as exc:
+            rc = exc.code if isinstance(exc.code, int) else 1
+        except Exception as exc:
+            print(exc, file=sys.stderr)
+            rc = getattr(exc, "exit_code", 1)
+    tails = {name: "\n".join(buf.getvalue().splitlines()[-TAIL_LINES:]) for name, buf in (("stdout", out), ("stderr", err))}
+    protocol.write(json.dumps({"ok": rc == 0, "returncode": rc, **tails}) + "\n")
+    protocol.flush()
+'''
+
+# Pool of warm workers, created on first use; a slot holds None until its worker is started.
+# There is always at least one slot, so waiting for a worker cannot hang; set
+# QIIME_MCP_WORKER=0 to turn the workers off.
+_WORKER_COUNT = max(1, int(os.environ.get("QIIME_MCP_WORKERS", "2")))
+_worker_pool: Optional[asyncio.Queue] = None
+_worker_disabled = os.environ.get("QIIME_MCP_WORKER", "1") == "0"
+
+
+async def _start_worker() -> Optional[asyncio.subprocess.Process]:
+    """Spawn a warm worker and wait for its handshake; None if qiime2 cannot load."""
+    process = await asyncio.create_subprocess_exec(
+        sys.executable, "-c", _WORKER_SOURCE, str(_TAIL_LINES),
+        stdin=asyncio.subprocess.PIPE, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.DEVNULL,
+        limit=1 << 24,
+    )
+    if await process.stdout.readline():
+        return process
+    await process.wait()
+    return None
+
+
+# Set by _batch_worker so that every command of a batch runs in the same warm worker.
+_pinned_worker: contextvars.ContextVar = contextvars.ContextVar("_pinned_worker", default=None)
+
+
+def _pool() -> asyncio.Queue:
+    """The worker pool, with one empty slot per allowed worker on first use."""
+    global _worker_pool
+    if _worker_pool is None:
+        _worker_pool = asyncio.Queue()
+        for _ in range(_WORKER_COUNT):
+            _worker_pool.put_nowait(None)
+    return _worker_pool
+
+
+async def _exchange(worker: asyncio.subprocess.Process, cmd: List[str]) -> Optional[subprocess.CompletedProcess]:
+    """Run cmd in worker; None, after killing it, if the worker has died or the call is cancelled."""
+    try:
+        worker.stdin.write((json.dumps({"argv": cmd[1:]}) + "\n").encode())
+        await worker.stdin.drain()
+        reply = await worker.stdout.readline()
+    except (OSError, ValueError):
+        reply = b""
+    except asyncio.CancelledError:
+        # The worker may still be running the abandoned command, so it cannot be reused.
+        with contextlib.suppress(ProcessLookupError):
+            worker.kill()
+        raise
+    if not reply:
+        with contextlib.suppress(ProcessLookupError):
+            worker.kill()
+        await worker.wait()
+        return None
+    reply = json.loads(reply)
+    return subprocess.CompletedProcess(cmd, reply["returncode"], reply["stdout"], reply["stderr"])
+
+
+async def _worker_call(cmd: List[str]) -> Optional[subprocess.CompletedProcess]:
+    """Run a qiime command in the batch's pinned worker, or pin an idle one for this call.
+
+    Returns None when workers are disabled, all busy or the chosen one has
+    died, in which case the caller falls back to the qiime CLI.
+    """
+    if _worker_disabled or cmd[0] != "qiime":
+        return None
+    pinned = _pinned_worker.get()
+    if pinned is not None:
+        return None if pinned.returncode is not None else await _exchange(pinned, cmd)
+    async with _batch_worker(wait=False):
+        worker = _pinned_worker.get()
+        return None if worker is None else await _exchange(worker, cmd)
+
+
+@contextlib.asynccontextmanager
+async def _batch_worker(wait: bool = True):
+    """Pin one warm worker for the commands run inside the block.
+
+    With wait=False the block runs unpinned, on whatever worker or CLI
+    _worker_call finds, instead of waiting for a worker to become idle.
+    _worker_call also uses it, with wait=False, to pin a worker for a
+    single command.
+    """
+    global _worker_disabled
+    if _worker_disabled:
+        yield
+        return
+    try:
+        worker = await _pool().get() if wait else _pool().get_nowait()
+    except asyncio.QueueEmpty:
+        yield
+        return
+    token = None
+    try:
+        if worker is None or worker.returncode is not None:
+            worker = await _start_worker()
+            if worker is None:
+                _worker_disabled = True
+        if worker is not None:
+            token = _pinned_worker.set(worker)
+        yield
+    finally:
+        if token is not None:
+            _pinned_worker.reset(token)
+        _pool().put_nowait(worker)
+
+
+# Batch jobs run on up to _CONCURRENCY lanes; _qiime_slots caps jobs in flight across all batches.
+_CONCURRENCY = max(1, int(os.environ.get("QIIME_MCP_CONCURRENCY", "4")))
+_qiime_slots = asyncio.Semaphore(_CONCURRENCY)
+
+
+async def _fan_out(jobs: List[Any], run_job: Callable[[Any], Awaitable[Any]]) -> List[Any]:
+    """Await run_job for every job concurrently on up to _CONCURRENCY lanes, keeping input order.
+
+    Each lane pins its own warm worker; only the first waits for one to
+    become idle, the others fall back to unpinned runs.
+    """
+    results: List[Any] = [None] * len(jobs)
+    pending = iter(enumerate(jobs))
+
+    async def lane(wait: bool) -> None:
+        async with _batch_worker(wait):
+            for index, job in pending:
+                async with _qiime_slots:
+                    results[index] = await run_job(job)
+
+    await asyncio.gather(*(lane(n == 0) for n in range(min(_CONCURRENCY, len(jobs)))))
+    return results
+
+
+async def _run(cmd: List[str]) -> subprocess.CompletedProcess:
+    """Run cmd without blocking the event loop, raising CalledProcessError on failure.
+
+    A warm worker from the pool runs the command when one is idle; otherwise
+    the qiime CLI is spawned. Only the last _TAIL_LINES lines of stdout and
+    stderr are kept.
+    """
+    result = await _worker_call(cmd)
+    if result is not None:
+        result.check_returncode()
+        return result
+    process = await asyncio.create_subprocess_exec(
+        *cmd, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE, limit=1 << 20
+    )
+    stdout_tail: deque = deque(maxlen=_TAIL_LINES)
+    stderr_tail: deque = deque(maxlen=_TAIL_LINES)
+    try:
+        await asyncio.gather(_drain(process.stdout, stdout_tail), _drain(process.stderr, stderr_tail))
+        returncode = await process.wait()
+    except asyncio.CancelledError:
+        process.kill()
+        raise
+    # Only the kept tail is decoded, once, rather than every line as it streams past.
+    stdout = b"\n".join(stdout_tail).decode(errors="replace")
+    stderr = b"\n".join(stderr_tail).decode(errors="replace")
+    if returncode != 0:
+        raise subprocess.CalledProcessError(returncode, cmd, output=stdout, stderr=stderr)
+    return subprocess.CompletedProcess(cmd, returncode, stdout, stderr)
+
+
+# Invariant head of the qiime command line, built once at import.
+_IMPORT_PREFIX = ("qiime", "tools", "import")
+
+
+async def tools_import(
     semantic_type: str,
     input_path: Path,
     output_path: Path,
@@ -46,25 +259,20 @@ def tools_import(
 
     # 2. Command Construction
     cmd: List[str] = [
-        "qiime", "tools", "import",
+        *_IMPORT_PREFIX,
         "--type", semantic_type,
-        "--input-path", str(input_path),
-        "--output-path", str(output_path),
+        "--input-path", os.fspath(input_path),
+        "--output-path", os.fspath(output_path),
     ]
 
     if input_format:
         cmd.extend(["--input-format", input_format])
 
-    command_executed = " ".join(cmd)
+    command_executed = shlex.join(cmd)
 
     # 3. Subprocess Execution and Error Handling
     try:
-        result = subprocess.run(
-            cmd,
-            check=True,
-            capture_output=True,
-            text=True,
-        )
+        result = await _run(cmd)
     except FileNotFoundError:
         raise RuntimeError(
             "The 'qiime' command was not found. Please ensure QIIME 2 is "
@@ -90,8 +298,64 @@ def tools_import(
     }
 
 
+# Registered without the decorator so that tools_import_batch can await
+# the coroutine itself, whatever fastmcp's tool() returns.
+mcp.tool()(tools_import)
+
+
+# The importable types and formats only change when the QIIME 2 install does, so
+# their listings are kept in memory and under <cache>/importable/ per install.
+_CACHE_DIR = Path(os.environ.get("QIIME_MCP_CACHE", "~/.cache/qiime_mcp")).expanduser()
+_listings: Dict[Path, Dict] = {}
+
+
+def _install_key() -> Optional[str]:
+    """Fingerprint the QIIME 2 install by its conda-meta directory, else its qiime executable."""
+    prefix = os.environ.get("CONDA_PREFIX")
+    marker = Path(prefix) / "conda-meta" if prefix else None
+    if marker is None or not marker.is_dir():
+        found = shutil.which("qiime")
+        if found is None:
+            return None
+        marker = Path(found).resolve()
+    st = marker.stat()
+    return hashlib.blake2b(f"{marker}\0{st.st_mtime_ns}".encode(), digest_size=8).hexdigest()
+
+
+def _listing_path(cmd: List[str]) -> Optional[Path]:
+    """Cache file for the listing cmd prints under the current install; None if qiime is missing."""
+    key = _install_key()
+    return None if key is None else _CACHE_DIR / "importable" / f"{cmd[-1].lstrip('-')}-{key}.json"
+
+
+def _cached_listing(path: Optional[Path]) -> Optional[Dict]:
+    """Listing stored at path, from memory or disk; None on a miss."""
+    if path is None:
+        return None
+    if path not in _listings:
+        try:
+            _listings[path] = json.loads(path.read_text())
+        except (OSError, ValueError):
+            return None
+    return {**_listings[path], "cached": True}
+
+
+def _store_listing(path: Optional[Path], result: Dict) -> Dict:
+    """Remember result at path in memory and on disk (best effort) and return it."""
+    if path is not None:
+        _listings[path] = result
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            staged = path.with_name(f".{path.name}.{os.getpid()}")
+            staged.write_text(json.dumps(result))
+            os.replace(staged, path)
+        except OSError:
+            pass
+    return result
+
+
 @mcp.tool()
-def tools_show_importable_types() -> Dict:
+async def tools_show_importable_types() -> Dict:
     """
     Show the semantic types that can be imported into QIIME 2.
 
@@ -103,17 +367,16 @@ def tools_show_importable_types() -> Dict:
         A dictionary containing the command executed, stdout, and stderr.
     """
     # 1. Command Construction
-    cmd = ["qiime", "tools", "import", "--show-importable-types"]
-    command_executed = " ".join(cmd)
+    cmd = [*_IMPORT_PREFIX, "--show-importable-types"]
+    command_executed = shlex.join(cmd)
+    listing_path = _listing_path(cmd)
+    cached = _cached_listing(listing_path)
+    if cached is not None:
+        return cached
 
     # 2. Subprocess Execution and Error Handling
     try:
-        result = subprocess.run(
-            cmd,
-            check=True,
-            capture_output=True,
-            text=True,
-        )
+        result = await _run(cmd)
     except FileNotFoundError:
         raise RuntimeError(
             "The 'qiime' command was not found. Please ensure QIIME 2 is "
@@ -129,15 +392,15 @@ def tools_show_importable_types() -> Dict:
         raise RuntimeError(error_message) from e
 
     # 3. Structured Result Return
-    return {
+    return _store_listing(listing_path, {
         "command_executed": command_executed,
         "stdout": result.stdout,
         "stderr": result.stderr,
-    }
+    })
 
 
 @mcp.tool()
-def tools_show_importable_formats() -> Dict:
+async def tools_show_importable_formats() -> Dict:
     """
     Show the file and directory formats that can be imported into QIIME 2.
 
@@ -149,17 +412,16 @@ def tools_show_importable_formats() -> Dict:
         A dictionary containing the command executed, stdout, and stderr.
     """
     # 1. Command Construction
-    cmd = ["qiime", "tools", "import", "--show-importable-formats"]
-    command_executed = " ".join(cmd)
+    cmd = [*_IMPORT_PREFIX, "--show-importable-formats"]
+    command_executed = shlex.join(cmd)
+    listing_path = _listing_path(cmd)
+    cached = _cached_listing(listing_path)
+    if cached is not None:
+        return cached
 
     # 2. Subprocess Execution and Error Handling
     try:
-        result = subprocess.run(
-            cmd,
-            check=True,
-            capture_output=True,
-            text=True,
-        )
+        result = await _run(cmd)
     except FileNotFoundError:
         raise RuntimeError(
             "The 'qiime' command was not found. Please ensure QIIME 2 is "
@@ -175,11 +437,50 @@ def tools_show_importable_formats() -> Dict:
         raise RuntimeError(error_message) from e
 
     # 3. Structured Result Return
-    return {
+    return _store_listing(listing_path, {
         "command_executed": command_executed,
         "stdout": result.stdout,
         "stderr": result.stderr,
-    }
+    })
+
+
+@mcp.tool()
+async def tools_import_batch(
+    semantic_type: str,
+    input_paths: List[Path],
+    output_paths: List[Path],
+    input_format: Optional[str] = None,
+) -> List[Dict]:
+    """
+    Import many files or directories of the same type into QIIME 2 Artifacts.
+
+    The imports run concurrently on up to QIIME_MCP_CONCURRENCY lanes
+    (default 4). Each lane runs its inputs one after another inside one
+    warm QIIME 2 worker, so the interpreter and plugin start-up is paid
+    once per lane rather than once per input.
+
+    Args:
+        semantic_type: The semantic type of every artifact that will be created.
+        input_paths: Paths to the files or directories that should be imported.
+        output_paths: Paths where the new artifacts (.qza) should be written,
+                      one per input path.
+        input_format: The format of the data to be imported, shared by all inputs.
+
+    Returns:
+        A list with one tools_import result per input, in input order. An
+        import that failed is reported as a dictionary with an "error" key.
+    """
+    if len(input_paths) != len(output_paths):
+        raise ValueError("input_paths and output_paths must have the same length.")
+
+    async def run_job(job: Tuple[Path, Path]) -> Dict:
+        input_path, output_path = job
+        try:
+            return await tools_import(semantic_type, input_path, output_path, input_format)
+        except Exception as e:
+            return {"input_path": str(input_path), "error": str(e)}
+
+    return await _fan_out(list(zip(input_paths, output_paths)), run_job)
 
 
 if __name__ == '__main__':
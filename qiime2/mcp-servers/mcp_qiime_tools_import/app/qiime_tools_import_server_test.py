@@ -0,0 +1,49 @@
+import asyncio
+import sys
+
+import pytest
+
+import qiime_tools_import_server as server
+
+# Stand-in for the qiime CLI: writes the --output-path it is given.
+FAKE_QIIME = f"""#!{sys.executable}
+import sys
+args = sys.argv[1:]
+output = args[args.index("--output-path") + 1]
+open(output, "w").write("artifact")
+print("Imported to " + output)
+"""
+
+
+@pytest.fixture
+def fake_qiime(tmp_path, monkeypatch):
+    bin_dir = tmp_path / "bin"
+    bin_dir.mkdir()
+    qiime = bin_dir / "qiime"
+    qiime.write_text(FAKE_QIIME)
+    qiime.chmod(0o755)
+    monkeypatch.setenv("PATH", f"{bin_dir}:{server.os.environ['PATH']}")
+    monkeypatch.setattr(server, "_worker_disabled", True)
+
+
+def test_batch_imports_every_input_through_the_mcp_server(tmp_path, fake_qiime):
+    from fastmcp import Client
+
+    inputs = [tmp_path / f"seqs{i}.fasta" for i in range(3)]
+    for path in inputs:
+        path.write_text(">a\nACGT\n")
+    outputs = [tmp_path / "out" / f"seqs{i}.qza" for i in range(3)]
+
+    async def call():
+        async with Client(server.mcp) as client:
+            return await client.call_tool("tools_import_batch", {
+                "semantic_type": "FeatureData[Sequence]",
+                "input_paths": [str(path) for path in inputs],
+                "output_paths": [str(path) for path in outputs],
+            })
+
+    results = asyncio.run(call()).structured_content["result"]
+
+    assert [result.get("error") for result in results] == [None] * 3
+    assert [result["output_files"]["output_artifact"] for result in results] == [str(path) for path in outputs]
+    assert all(path.read_text() == "artifact" for path in outputs)
@@ -1,23 +1,146 @@
+import hashlib
+import json
+import os
+import re
+import shlex
+import shutil
 import subprocess
+import sys
 import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
 from pathlib import Path
-from typing import List, Optional
-
-from fastmcp import FastMCP
-
-mcp = FastMCP()
-
-
-def _run_qiime_command(cmd: List[str]):
+from typing import TYPE_CHECKING, Callable, Dict, Iterator, List, Optional
+
+if TYPE_CHECKING:
+    from fastmcp import FastMCP
+
+
+# Source of the long-lived worker: it pays the qiime2/q2cli import and plugin
+# discovery once, then runs newline-delimited JSON requests through q2cli, or
+# through the qiime2 SDK when a request carries an "api" call (peek and
+# validate), printing what the matching q2cli command would.
+_WORKER_SOURCE = r'''
+import contextlib, io, json, os, sys
+protocol = os.fdopen(os.dup(1), "w")
+os.dup2(2, 1)
+from qiime2.sdk import PluginManager, Result
+from q2cli.commands import RootCommand
+PluginManager()
+root = RootCommand()
+def run_peek(path):
+    metadata = Result.peek(path)
+    print("UUID:        %s" % metadata.uuid)
+    print("Type:        %s" % metadata.type)
+    if metadata.format is not None:
+        print("Data format: %s" % metadata.format)
+    return 0
+def run_validate(path, level):
+    Result.load(path).validate(level)
+    print("Result %s appears to be valid at level=%s." % (path, level))
+    return 0
+API = {"peek": run_peek, "validate": run_validate}
+protocol.write(json.dumps({"ready": True}) + "\n")
+protocol.flush()
+for line in sys.stdin:
+    request = json.loads(line)
+    out, err = io.StringIO(), io.StringIO()
+    with contextlib.redirect_stdout(out), contextlib.redirect_stderr(err):
+        try:
+            if request.get("api"):
+                rc = API[request["api"]["name"]](**request["api"]["kwargs"])
+            else:
+                rc = root.main(args=request["argv"], prog_name="qiime", standalone_mode=False)
+                rc = rc if isinstance(rc, int) else 0
+        except SystemExit as exc:
+            rc = exc.code if isinstance(exc.code, int) else 1
+        except Exception as exc:
+            print(exc, file=sys.stderr)
+            rc = getattr(exc, "exit_code", 1)
+    protocol.write(json.dumps({"ok": rc == 0, "returncode": rc, "stdout": out.getvalue(), "stderr": err.getvalue()}) + "\n")
+    protocol.flush()
+'''
+
+# Environment for the worker and the qiime CLI, built once: the server's own,
+# plus a headless matplotlib backend and no .pyc writes into the conda env.
+_QIIME_ENV = {**os.environ, "MPLBACKEND": "Agg", "PYTHONDONTWRITEBYTECODE": "1"}
+
+_worker: Optional[subprocess.Popen] = None
+_worker_lock = threading.Lock()
+_worker_disabled = os.environ.get("QIIME_MCP_WORKER", "1") == "0"
+
+
+def _start_worker() -> Optional[subprocess.Popen]:
+    """Spawn the warm worker and wait for its handshake; None if qiime2 cannot load."""
+    process = subprocess.Popen(
+        [sys.executable, "-c", _WORKER_SOURCE],
+        env=_QIIME_ENV,
+        stdin=subprocess.PIPE,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL,
+        text=True,
+        bufsize=1,
+    )
+    if process.stdout.readline():
+        return process
+    process.wait()
+    return None
+
+
+def _worker_call(cmd: List[str], call: Optional[dict] = None) -> Optional[subprocess.CompletedProcess]:
+    """Run a qiime command in the shared warm worker.
+
+    A call, the name and keyword arguments of one of the worker's API
+    functions, runs through the qiime2 SDK instead of q2cli. Returns None
+    when the worker is disabled, busy with another call or has died, in
+    which case the caller falls back to the qiime CLI.
+    """
+    global _worker, _worker_disabled
+    if _worker_disabled or cmd[0] != "qiime" or not _worker_lock.acquire(blocking=False):
+        return None
+    try:
+        if _worker is None or _worker.poll() is not None:
+            _worker = _start_worker()
+            if _worker is None:
+                _worker_disabled = True
+                return None
+        try:
+            _worker.stdin.write(json.dumps({"argv": cmd[1:], "api": call}) + "\n")
+            _worker.stdin.flush()
+            reply = _worker.stdout.readline()
+        except OSError:
+            reply = ""
+        if not reply:
+            _worker.kill()
+            _worker = None
+            return None
+    finally:
+        _worker_lock.release()
+    reply = json.loads(reply)
+    return subprocess.CompletedProcess(cmd, reply["returncode"], reply["stdout"], reply["stderr"])
+
+
+def _run(cmd: List[str], call: Optional[dict] = None) -> subprocess.CompletedProcess:
+    """Run cmd, or its equivalent call, in the warm worker or the qiime CLI, raising CalledProcessError on failure."""
+    result = _worker_call(cmd, call)
+    if result is not None:
+        result.check_returncode()
+        return result
+    # The CLI's output is captured as bytes and decoded once, not through a text wrapper.
+    process = subprocess.run(cmd, capture_output=True, bufsize=-1, env=_QIIME_ENV)
+    stdout = process.stdout.decode(errors="replace")
+    stderr = process.stderr.decode(errors="replace")
+    if process.returncode != 0:
+        raise subprocess.CalledProcessError(process.returncode, cmd, output=stdout, stderr=stderr)
+    return subprocess.CompletedProcess(cmd, process.returncode, stdout, stderr)
+
+
+def _run_qiime_command(cmd: List[str], call: Optional[dict] = None):
     """Helper function to run a QIIME command and handle common errors."""
-    command_executed = " ".join(cmd)
+    command_executed = shlex.join(cmd)
     try:
-        result = subprocess.run(
-            cmd,
-            capture_output=True,
-            text=True,
-            check=True
-        )
+        result = _run(cmd, call)
         return {
             "command_executed": command_executed,
             "stdout": result.stdout,
@@ -35,7 +158,38 @@ def _run_qiime_command(cmd: List[str]):
         )
 
 
-@mcp.tool()
+def _walk_files(root: str) -> Iterator[str]:
+    """Yield the regular files under root using scandir's cached entry types, without extra stats."""
+    stack = [root]
+    while stack:
+        try:
+            with os.scandir(stack.pop()) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(entry.path)
+                    elif entry.is_file(follow_symlinks=False):
+                        yield entry.path
+        except (FileNotFoundError, NotADirectoryError):
+            continue
+
+
+# q2cli's closing line for export and extract, naming the directory it wrote.
+_WROTE_DIRECTORY = re.compile(r"^(?:Exported|Extracted) .* to directory (.+)$", re.M)
+
+
+def _reported_directory(stdout: str, default: str) -> str:
+    """Directory q2cli reports having written in stdout, or default if it names none."""
+    match = _WROTE_DIRECTORY.search(stdout)
+    return match.group(1).strip() if match else default
+
+
+def _require_existing(paths: List[Path]) -> None:
+    """Raise FileNotFoundError for the first missing path."""
+    for path in paths:
+        if not path.exists():
+            raise FileNotFoundError(f"Input file not found: {path}")
+
+
 def qiime_tools_cast_metadata(
     column: str,
     metadata_file: Path,
@@ -54,7 +208,7 @@ def qiime_tools_cast_metadata(
 
     cmd = [
         "qiime", "tools", "cast-metadata", column,
-        "--metadata-file", str(metadata_file),
+        "--metadata-file", os.fspath(metadata_file),
         "--to-type", to_type,
     ]
     if ignore_missing_values:
@@ -65,95 +219,120 @@ def qiime_tools_cast_metadata(
     return result
 
 
-@mcp.tool()
 def qiime_tools_citations(
     paths: List[Path],
     verbose: bool = False,
+    parallel_per_path: bool = False,
 ):
     """
     Prints citations for one or more QIIME 2 results.
 
-    Citations are returned in BibTeX format.
+    Citations are returned in BibTeX format. With `parallel_per_path`, each
+    result is cited by its own concurrent qiime run and the outputs are
+    concatenated in input order.
     """
-    cmd = ["qiime", "tools", "citations"]
     if not paths:
         raise ValueError("At least one input path must be provided.")
-    for path in paths:
-        if not path.exists():
-            raise FileNotFoundError(f"Input file not found: {path}")
-        cmd.append(str(path))
-
-    if verbose:
-        cmd.append("--verbose")
+    _require_existing(paths)
+    flags = ["--verbose"] if verbose else []
+
+    if parallel_per_path and len(paths) > 1:
+        with ThreadPoolExecutor(max_workers=min(8, len(paths))) as executor:
+            runs = list(executor.map(
+                lambda path: _run_qiime_command(["qiime", "tools", "citations", os.fspath(path), *flags]),
+                paths,
+            ))
+        result = {
+            key: "\n".join(run[key] for run in runs)
+            for key in ("command_executed", "stdout", "stderr")
+        }
+        result["return_code"] = 0
+        result["citations"] = result["stdout"]
+        return result
 
+    cmd = ["qiime", "tools", "citations", *map(os.fspath, paths), *flags]
     result = _run_qiime_command(cmd)
     result["citations"] = result["stdout"]
     return result
 
 
-@mcp.tool()
 def qiime_tools_export(
     input_path: Path,
     output_path: Path,
+    list_files: bool = True,
+    max_files: Optional[int] = None,
 ):
     """
     Exports a QIIME 2 Artifact or Visualization to a directory.
+
+    The directory is taken from QIIME's own report. At most `max_files`
+    exported file paths are listed (all by default); pass `list_files=False`
+    to skip walking the directory, in which case `output_files` is None.
     """
     if not input_path.exists() or not input_path.is_file():
         raise FileNotFoundError(f"Input artifact/visualization not found: {input_path}")
+    if max_files is not None and max_files < 0:
+        raise ValueError("`max_files` must be a non-negative integer.")
 
     # QIIME will create the output directory, but its parent must exist.
     output_path.parent.mkdir(parents=True, exist_ok=True)
     if output_path.exists() and any(output_path.iterdir()):
         raise ValueError(f"Output directory '{output_path}' already exists and is not empty.")
 
+    output_dir = os.fspath(output_path)
     cmd = [
         "qiime", "tools", "export",
-        "--input-path", str(input_path),
-        "--output-path", str(output_path),
+        "--input-path", os.fspath(input_path),
+        "--output-path", output_dir,
     ]
 
     result = _run_qiime_command(cmd)
     
-    exported_files = [str(f) for f in output_path.rglob('*') if f.is_file()]
-    result["output_directory"] = str(output_path)
-    result["output_files"] = exported_files
+    output_dir = _reported_directory(result["stdout"], output_dir)
+    result["output_directory"] = output_dir
+    result["output_files"] = list(islice(_walk_files(output_dir), max_files)) if list_files else None
     return result
 
 
-@mcp.tool()
 def qiime_tools_extract(
     input_path: Path,
     output_path: Path,
+    list_files: bool = True,
+    max_files: Optional[int] = None,
 ):
     """
     Extracts a QIIME 2 Artifact or Visualization.
 
     This is an advanced feature that extracts the raw, untransformed data.
     For most use cases, `qiime_tools_export` is more appropriate.
+    The directory is taken from QIIME's own report. At most `max_files`
+    extracted file paths are listed (all by default); pass `list_files=False`
+    to skip walking the directory, in which case `output_files` is None.
     """
     if not input_path.exists() or not input_path.is_file():
         raise FileNotFoundError(f"Input artifact/visualization not found: {input_path}")
+    if max_files is not None and max_files < 0:
+        raise ValueError("`max_files` must be a non-negative integer.")
 
     output_path.parent.mkdir(parents=True, exist_ok=True)
     if output_path.exists() and any(output_path.iterdir()):
         raise ValueError(f"Output directory '{output_path}' already exists and is not empty.")
 
+    output_dir = os.fspath(output_path)
     cmd = [
         "qiime", "tools", "extract",
-        "--input-path", str(input_path),
-        "--output-path", str(output_path),
+        "--input-path", os.fspath(input_path),
+        "--output-path", output_dir,
     ]
 
     result = _run_qiime_command(cmd)
 
-    extracted_files = [str(f) for f in output_path.rglob('*') if f.is_file()]
-    result["output_directory"] = str(output_path)
-    result["output_files"] = extracted_files
+    output_dir = _reported_directory(result["stdout"], output_dir)
+    result["output_directory"] = output_dir
+    result["output_files"] = list(islice(_walk_files(output_dir), max_files)) if list_files else None
     return result
 
 
-@mcp.tool()
 def qiime_tools_import(
     artifact_type: str,
     input_path: Path,
@@ -170,39 +349,82 @@ def qiime_tools_import(
     if output_path.exists():
         raise ValueError(f"Output path '{output_path}' already exists.")
 
+    output_artifact = os.fspath(output_path)
     cmd = [
         "qiime", "tools", "import",
         "--type", artifact_type,
-        "--input-path", str(input_path),
-        "--output-path", str(output_path),
+        "--input-path", os.fspath(input_path),
+        "--output-path", output_artifact,
     ]
     if input_format:
         cmd.extend(["--input-format", input_format])
 
     result = _run_qiime_command(cmd)
-    result["output_artifact"] = str(output_path)
+    result["output_artifact"] = output_artifact
     return result
 
 
-@mcp.tool()
+# The importable types and formats only change when the QIIME 2 install does, so
+# their listings are kept in memory and under <cache>/tools_view/ per install,
+# fingerprinted the same way as in the tools import server.
+_CACHE_DIR = Path(os.environ.get("QIIME_MCP_CACHE", "~/.cache/qiime_mcp")).expanduser()
+_listings: Dict[Path, dict] = {}
+
+
+def _install_key() -> Optional[str]:
+    """Fingerprint the QIIME 2 install by its conda-meta directory, else its qiime executable."""
+    prefix = os.environ.get("CONDA_PREFIX")
+    marker = Path(prefix) / "conda-meta" if prefix else None
+    if marker is None or not marker.is_dir():
+        found = shutil.which("qiime")
+        if found is None:
+            return None
+        marker = Path(found).resolve()
+    st = marker.stat()
+    return hashlib.blake2b(f"{marker}\0{st.st_mtime_ns}".encode(), digest_size=8).hexdigest()
+
+
+def _store_listing(path: Path, result: dict) -> None:
+    """Write result to path atomically; a cache that cannot be written is skipped."""
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        staged = path.with_name(f".{path.name}.{os.getpid()}")
+        staged.write_text(json.dumps(result))
+        os.replace(staged, path)
+    except OSError:
+        pass
+
+
+def _importable_listing(flag: str) -> dict:
+    """Run `qiime tools import <flag>` once per qiime install; failures are not cached."""
+    cmd = ["qiime", "tools", "import", flag]
+    key = _install_key()
+    if key is None:
+        return _run_qiime_command(cmd)
+    path = _CACHE_DIR / "tools_view" / f"{flag.lstrip('-')}-{key}.json"
+    if path not in _listings:
+        try:
+            _listings[path] = json.loads(path.read_text())
+        except (OSError, ValueError):
+            _listings[path] = _run_qiime_command(cmd)
+            _store_listing(path, _listings[path])
+    return _listings[path]
+
+
 def qiime_tools_show_importable_types():
     """Shows the semantic types that can be imported."""
-    cmd = ["qiime", "tools", "import", "--show-importable-types"]
-    result = _run_qiime_command(cmd)
+    result = dict(_importable_listing("--show-importable-types"))
     result["importable_types"] = result["stdout"].strip().split('\n')
     return result
 
 
-@mcp.tool()
 def qiime_tools_show_importable_formats():
     """Shows the file formats that can be imported."""
-    cmd = ["qiime", "tools", "import", "--show-importable-formats"]
-    result = _run_qiime_command(cmd)
+    result = dict(_importable_listing("--show-importable-formats"))
     result["importable_formats"] = result["stdout"].strip().split('\n')
     return result
 
 
-@mcp.tool()
 def qiime_tools_inspect_metadata(
     paths: List[Path],
     tsv: bool = False,
@@ -210,13 +432,10 @@ def qiime_tools_inspect_metadata(
     """
     Inspects columns of one or more metadata files or artifacts.
     """
-    cmd = ["qiime", "tools", "inspect-metadata"]
     if not paths:
         raise ValueError("At least one input path must be provided.")
-    for path in paths:
-        if not path.exists():
-            raise FileNotFoundError(f"Input file not found: {path}")
-        cmd.append(str(path))
+    _require_existing(paths)
+    cmd = ["qiime", "tools", "inspect-metadata", *map(os.fspath, paths)]
 
     if tsv:
         cmd.append("--tsv")
@@ -226,7 +445,6 @@ def qiime_tools_inspect_metadata(
     return result
 
 
-@mcp.tool()
 def qiime_tools_peek(
     path: Path,
 ):
@@ -236,13 +454,13 @@ def qiime_tools_peek(
     if not path.exists() or not path.is_file():
         raise FileNotFoundError(f"Input file not found: {path}")
 
-    cmd = ["qiime", "tools", "peek", str(path)]
-    result = _run_qiime_command(cmd)
+    path_str = os.fspath(path)
+    cmd = ["qiime", "tools", "peek", path_str]
+    result = _run_qiime_command(cmd, {"name": "peek", "kwargs": {"path": path_str}})
     result["artifact_info"] = result["stdout"]
     return result
 
 
-@mcp.tool()
 def qiime_tools_validate(
     path: Path,
     level: str = "max",
@@ -255,31 +473,39 @@ def qiime_tools_validate(
     if level not in ["max", "min"]:
         raise ValueError("`level` must be either 'max' or 'min'.")
 
-    cmd = ["qiime", "tools", "validate", str(path), "--level", level]
-    
+    path_str = os.fspath(path)
+    cmd = ["qiime", "tools", "validate", path_str, "--level", level]
+
     # A successful validation returns exit code 0 and prints to stdout.
     # A failed validation returns a non-zero exit code and prints to stderr.
     # The helper function handles this logic.
-    result = _run_qiime_command(cmd)
+    result = _run_qiime_command(cmd, {"name": "validate", "kwargs": {"path": path_str, "level": level}})
     result["validation_status"] = "Success"
     result["validation_report"] = result["stdout"]
     return result
 
 
-@mcp.tool()
 def qiime_tools_view(
     path: Path,
     index_path: Optional[Path] = None,
+    max_files: Optional[int] = None,
+    enumerate_all: bool = False,
 ):
     """
     Views a QIIME 2 Artifact or Visualization by extracting it to a directory.
 
     This tool extracts the contents of a QIIME 2 Artifact (.qza) or
     Visualization (.qzv) to a specified directory, making it viewable.
-    If no output directory is specified, a temporary one will be created.
+    If no output directory is specified, a temporary one will be created;
+    it is removed again if the extraction fails.
+    `index_html` points at the page to open. Only the top-level entries of
+    the directory are listed unless `enumerate_all` is set, in which case
+    every extracted file is; at most `max_files` paths are listed either way.
     """
     if not path.exists() or not path.is_file():
         raise FileNotFoundError(f"Input file not found: {path}")
+    if max_files is not None and max_files < 0:
+        raise ValueError("`max_files` must be a non-negative integer.")
 
     if index_path is None:
         # Create a directory that persists after the function returns.
@@ -289,20 +515,74 @@ def qiime_tools_view(
         output_dir = index_path
         output_dir.mkdir(parents=True, exist_ok=True)
 
+    output_dir_str = os.fspath(output_dir)
     cmd = [
         "qiime", "tools", "view",
-        str(path),
-        "--index-path", str(output_dir),
+        os.fspath(path),
+        "--index-path", output_dir_str,
     ]
 
-    result = _run_qiime_command(cmd)
-
-    output_files_list = [str(f) for f in output_dir.rglob('*') if f.is_file()]
-    result["output_directory"] = str(output_dir)
+    try:
+        result = _run_qiime_command(cmd)
+    except RuntimeError:
+        if index_path is None:
+            shutil.rmtree(output_dir, ignore_errors=True)
+        raise
+
+    index_html = output_dir / "index.html"
+    if enumerate_all:
+        output_files_list = list(islice(_walk_files(output_dir_str), max_files))
+        has_index = index_html.is_file()
+    else:
+        # The view is index.html at the root with its assets below it, so one
+        # directory read describes it without walking every asset.
+        names = os.listdir(output_dir_str)
+        output_files_list = [os.path.join(output_dir_str, name) for name in names[:max_files]]
+        has_index = "index.html" in names
+    result["output_directory"] = output_dir_str
     result["output_files"] = output_files_list
+    result["index_html"] = os.fspath(index_html) if has_index else None
     result["message"] = f"Visualization extracted to {output_dir}. Open 'index.html' in that directory to view."
     return result
 
 
+
+# Every tool the server exposes. Importing the module only defines these
+# functions; nothing is registered with FastMCP until build_mcp() runs.
+TOOLS: List[Callable] = [
+    qiime_tools_cast_metadata,
+    qiime_tools_citations,
+    qiime_tools_export,
+    qiime_tools_extract,
+    qiime_tools_import,
+    qiime_tools_show_importable_types,
+    qiime_tools_show_importable_formats,
+    qiime_tools_inspect_metadata,
+    qiime_tools_peek,
+    qiime_tools_validate,
+    qiime_tools_view,
+]
+
+
+def build_mcp() -> "FastMCP":
+    """Create a FastMCP server with every function in TOOLS registered as a tool."""
+    from fastmcp import FastMCP
+
+    server = FastMCP()
+    for tool in TOOLS:
+        server.tool()(tool)
+    return server
+
+
+def __getattr__(name: str):
+    # `from qiime_tools_view_server import mcp` still works: the server is
+    # built on first access and then cached as a module attribute.
+    if name == "mcp":
+        global mcp
+        mcp = build_mcp()
+        return mcp
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
 if __name__ == '__main__':
-    mcp.run()
\ No newline at end of file
+    build_mcp().run()
@@ -1,12 +1,180 @@
+import hashlib
+import json
+import os
+import shlex
+import shutil
 import subprocess
+import sys
 import tempfile
+import threading
 from pathlib import Path
-from typing import Optional
+from typing import Any, Dict, List, Optional
 
 from fastmcp import FastMCP
 
 mcp = FastMCP()
 
+# Outputs are cached by the content of their inputs so reruns skip qiime entirely.
+_CACHE_DIR = Path(os.environ.get("QIIME_MCP_CACHE", "~/.cache/qiime_mcp")).expanduser()
+
+
+def _cache_key(inputs: List[Path], params: Dict[str, Any]) -> str:
+    """Hash the bytes of every input file together with the canonical parameters."""
+    digest = hashlib.blake2b(digest_size=16)
+    for path in inputs:
+        with open(path, "rb") as fh:
+            for chunk in iter(lambda: fh.read(1 << 20), b""):
+                digest.update(chunk)
+    digest.update(json.dumps(params, sort_keys=True, default=str).encode())
+    return digest.hexdigest()
+
+
+def _copy_file(src: Path, dst: Path) -> None:
+    """Copy src to a new file at dst, so cache entries and outputs never share an inode.
+
+    qiime rewrites an existing output path in place, so a hard link between
+    the two would let the next run silently change a cached artifact.
+    """
+    dst.unlink(missing_ok=True)
+    shutil.copy2(src, dst)
+
+
+def _ensure_parent(path: Path) -> None:
+    """Create the parent directory of path if it does not exist."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+
+
+def _restore_cached(key: str, outputs: Dict[str, Path]) -> bool:
+    """Copy cached outputs for key to the requested paths; False on a cache miss."""
+    entry = _CACHE_DIR / key
+    cached = {name: entry / f"{name}{path.suffix}" for name, path in outputs.items()}
+    if not all(path.is_file() for path in cached.values()):
+        return False
+    for name, path in outputs.items():
+        _ensure_parent(path)
+        _copy_file(cached[name], path)
+    return True
+
+
+def _store_cached(key: str, outputs: Dict[str, Path]) -> None:
+    """Publish freshly written outputs into the cache under key (best effort)."""
+    try:
+        _CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        staging = Path(tempfile.mkdtemp(prefix=f".{key}.", dir=_CACHE_DIR))
+    except OSError:
+        return
+    try:
+        for name, path in outputs.items():
+            _copy_file(path, staging / f"{name}{path.suffix}")
+        os.replace(staging, _CACHE_DIR / key)
+    except OSError:
+        shutil.rmtree(staging, ignore_errors=True)
+
+
+def _spawn(cmd: List[str], **kwargs) -> subprocess.Popen:
+    """Start cmd in a way that lets CPython use posix_spawn instead of fork+exec.
+
+    posix_spawn is only chosen for an absolute executable path with
+    close_fds=False and no cwd, preexec_fn or new session. Descriptors opened
+    by Python are non-inheritable, so leaving close_fds off leaks nothing.
+    """
+    executable = shutil.which(cmd[0]) or cmd[0]
+    return subprocess.Popen([executable, *cmd[1:]], close_fds=False, **kwargs)
+
+
+# Source of the long-lived worker: it pays the qiime2/q2cli import and plugin
+# discovery once, then runs newline-delimited JSON requests through q2cli.
+_WORKER_SOURCE = r'''
+import contextlib, io, json, os, sys
+protocol = os.fdopen(os.dup(1), "w")
+os.dup2(2, 1)
+from qiime2.sdk import PluginManager
+from q2cli.commands import RootCommand
+PluginManager()
+root = RootCommand()
+protocol.write(json.dumps({"ready": True}) + "\n")
+protocol.flush()
+for line in sys.stdin:
+    argv = json.loads(line)["argv"]
+    out, err = io.StringIO(), io.StringIO()
+    with contextlib.redirect_stdout(out), contextlib.redirect_stderr(err):
+        try:
+            rc = root.main(args=argv, prog_name="qiime", standalone_mode=False)
+            rc = rc if isinstance(rc, int) else 0
+        except SystemExit as exc:
+            rc = exc.code if isinstance(exc.code, int) else 1
+        except Exception as exc:
+            print(exc, file=sys.stderr)
+            rc = getattr(exc, "exit_code", 1)
+    protocol.write(json.dumps({"ok": rc == 0, "returncode": rc, "stdout": out.getvalue(), "stderr": err.getvalue()}) + "\n")
+    protocol.flush()
+'''
+
+_worker: Optional[subprocess.Popen] = None
+_worker_lock = threading.Lock()
+_worker_disabled = os.environ.get("QIIME_MCP_WORKER", "1") == "0"
+
+
+def _start_worker() -> Optional[subprocess.Popen]:
+    """Spawn the warm worker and wait for its handshake; None if qiime2 cannot load."""
+    process = _spawn(
+        [sys.executable, "-c", _WORKER_SOURCE],
+        stdin=subprocess.PIPE,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL,
+        text=True,
+        bufsize=1,
+    )
+    if process.stdout.readline():
+        return process
+    process.wait()
+    return None
+
+
+def _worker_call(cmd: List[str]) -> Optional[subprocess.CompletedProcess]:
+    """Run a qiime command in the shared warm worker.
+
+    Returns None when the worker is disabled, busy with another call or has
+    died, in which case the caller falls back to the qiime CLI.
+    """
+    global _worker, _worker_disabled
+    if _worker_disabled or cmd[0] != "qiime" or not _worker_lock.acquire(blocking=False):
+        return None
+    try:
+        if _worker is None or _worker.poll() is not None:
+            _worker = _start_worker()
+            if _worker is None:
+                _worker_disabled = True
+                return None
+        request = {"plugin": cmd[1], "action": cmd[2], "argv": cmd[1:]}
+        try:
+            _worker.stdin.write(json.dumps(request) + "\n")
+            _worker.stdin.flush()
+            reply = _worker.stdout.readline()
+        except OSError:
+            reply = ""
+        if not reply:
+            _worker.kill()
+            _worker = None
+            return None
+    finally:
+        _worker_lock.release()
+    reply = json.loads(reply)
+    return subprocess.CompletedProcess(cmd, reply["returncode"], reply["stdout"], reply["stderr"])
+
+
+def _run(cmd: List[str]) -> subprocess.CompletedProcess:
+    """Run cmd to completion, raising CalledProcessError on a non-zero exit."""
+    result = _worker_call(cmd)
+    if result is not None:
+        result.check_returncode()
+        return result
+    process = _spawn(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    stdout, stderr = process.communicate()
+    if process.returncode != 0:
+        raise subprocess.CalledProcessError(process.returncode, cmd, output=stdout, stderr=stderr)
+    return subprocess.CompletedProcess(cmd, process.returncode, stdout, stderr)
+
 
 @mcp.tool()
 def emperor_plot(
@@ -18,6 +186,7 @@ def emperor_plot(
     ignore_missing_samples: bool = False,
     verbose: bool = False,
     quiet: bool = False,
+    use_cache: bool = True,
 ) -> dict:
     """
     Generate an Emperor plot from a PCoA results artifact.
@@ -39,6 +208,9 @@ def emperor_plot(
                                        will fail if samples are missing from the metadata.
         verbose (bool): Display verbose output to stdout. Defaults to False.
         quiet (bool): Silence output if execution is successful. Defaults to False.
+        use_cache (bool): Reuse the visualization from a previous run with identical
+                          inputs and parameters instead of re-running QIIME 2.
+                          Defaults to True.
 
     Returns:
         dict: A dictionary containing the execution command, stdout, stderr,
@@ -83,23 +255,43 @@ def emperor_plot(
     if quiet:
         cmd.append("--quiet")
 
+    command_str = shlex.join(cmd)
+
+    # --- Result Cache Lookup ---
+    cache_key = None
+    if use_cache:
+        cache_key = _cache_key(
+            [pcoa] + ([metadata] if metadata else []),
+            {
+                "action": "emperor plot",
+                "metadata_column": metadata_column,
+                "custom_axes": custom_axes,
+                "ignore_missing_samples": ignore_missing_samples,
+            },
+        )
+        if _restore_cached(cache_key, {"visualization": visualization}):
+            return {
+                "command_executed": command_str,
+                "stdout": f"Restored cached output {cache_key} from {_CACHE_DIR}",
+                "stderr": "",
+                "output_files": [str(visualization)],
+            }
+
     # --- Subprocess Execution ---
     try:
-        process = subprocess.run(
-            cmd, check=True, capture_output=True, text=True
-        )
+        process = _run(cmd)
         stdout = process.stdout
         stderr = process.stderr
     except FileNotFoundError:
         return {
-            "command_executed": " ".join(cmd),
+            "command_executed": command_str,
             "stdout": "",
             "stderr": "Error: 'qiime' command not found. Please ensure QIIME 2 is installed and in your PATH.",
             "output_files": [],
         }
     except subprocess.CalledProcessError as e:
         return {
-            "command_executed": " ".join(cmd),
+            "command_executed": command_str,
             "stdout": e.stdout,
             "stderr": e.stderr,
             "output_files": [],
@@ -107,9 +299,11 @@ def emperor_plot(
 
     # --- Structured Result Return ---
     output_files = [str(visualization)] if visualization.exists() else []
+    if cache_key is not None and output_files:
+        _store_cached(cache_key, {"visualization": visualization})
 
     return {
-        "command_executed": " ".join(cmd),
+        "command_executed": command_str,
         "stdout": stdout,
         "stderr": stderr,
         "output_files": output_files,
@@ -1,9 +1,351 @@
+import hashlib
+import io
+import json
+import logging
+import os
+import shlex
+import shutil
 import subprocess
+import sys
+import tempfile
+import threading
+import zipfile
+from collections import deque
 from pathlib import Path
-from typing import Optional, List
+from typing import Any, Callable, Dict, Iterator, Optional, List, Tuple
 from fastmcp import FastMCP
 
 mcp = FastMCP()
+logger = logging.getLogger(__name__)
+
+# Outputs are cached by the content of their inputs so reruns skip qiime entirely.
+_CACHE_DIR = Path(os.environ.get("QIIME_MCP_CACHE", "~/.cache/qiime_mcp")).expanduser()
+
+
+def _cache_key(inputs: List[Path], params: Dict[str, Any]) -> str:
+    """Hash the bytes of every input file together with the canonical parameters."""
+    digest = hashlib.blake2b(digest_size=16)
+    for path in inputs:
+        with open(path, "rb") as fh:
+            for chunk in iter(lambda: fh.read(1 << 20), b""):
+                digest.update(chunk)
+    digest.update(json.dumps(params, sort_keys=True, default=str).encode())
+    return digest.hexdigest()
+
+
+def _copy_file(src: Path, dst: Path) -> None:
+    """Copy src to a new file at dst, so cache entries and outputs never share an inode.
+
+    qiime rewrites an existing output path in place, so a hard link between
+    the two would let the next run silently change a cached artifact.
+    """
+    dst.unlink(missing_ok=True)
+    shutil.copy2(src, dst)
+
+
+def _ensure_parent(path: Path) -> None:
+    """Create the parent directory of path if it does not exist."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+
+
+def _restore_cached(key: str, outputs: Dict[str, Path]) -> bool:
+    """Copy cached outputs for key to the requested paths; False on a cache miss."""
+    entry = _CACHE_DIR / key
+    cached = {name: entry / f"{name}{path.suffix}" for name, path in outputs.items()}
+    if not all(path.is_file() for path in cached.values()):
+        return False
+    for name, path in outputs.items():
+        _ensure_parent(path)
+        _copy_file(cached[name], path)
+    return True
+
+
+def _store_cached(key: str, outputs: Dict[str, Path]) -> None:
+    """Publish freshly written outputs into the cache under key (best effort)."""
+    try:
+        _CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        staging = Path(tempfile.mkdtemp(prefix=f".{key}.", dir=_CACHE_DIR))
+    except OSError:
+        return
+    try:
+        for name, path in outputs.items():
+            _copy_file(path, staging / f"{name}{path.suffix}")
+        os.replace(staging, _CACHE_DIR / key)
+    except OSError:
+        shutil.rmtree(staging, ignore_errors=True)
+
+
+def _spawn(cmd: List[str], **kwargs) -> subprocess.Popen:
+    """Start cmd in a way that lets CPython use posix_spawn instead of fork+exec.
+
+    posix_spawn is only chosen for an absolute executable path with
+    close_fds=False and no cwd, preexec_fn or new session. Descriptors opened
+    by Python are non-inheritable, so leaving close_fds off leaks nothing.
+    """
+    executable = shutil.which(cmd[0]) or cmd[0]
+    return subprocess.Popen([executable, *cmd[1:]], close_fds=False, **kwargs)
+
+
+# Source of the long-lived worker: it pays the qiime2/q2cli import and plugin
+# discovery once, then runs newline-delimited JSON requests through q2cli.
+_WORKER_SOURCE = r'''
+import contextlib, io, json, os, sys
+protocol = os.fdopen(os.dup(1), "w")
+os.dup2(2, 1)
+from qiime2.sdk import PluginManager
+from q2cli.commands import RootCommand
+PluginManager()
+root = RootCommand()
+protocol.write(json.dumps({"ready": True}) + "\n")
+protocol.flush()
+for line in sys.stdin:
+    argv = json.loads(line)["argv"]
+    out, err = io.StringIO(), io.StringIO()
+    with contextlib.redirect_stdout(out), contextlib.redirect_stderr(err):
+        try:
+            rc = root.main(args=argv, prog_name="qiime", standalone_mode=False)
+            rc = rc if isinstance(rc, int) else 0
+        except SystemExit as exc:
+            rc = exc.code if isinstance(exc.code, int) else 1
+        except Exception as exc:
+            print(exc, file=sys.stderr)
+            rc = getattr(exc, "exit_code", 1)
+    protocol.write(json.dumps({"ok": rc == 0, "returncode": rc, "stdout": out.getvalue(), "stderr": err.getvalue()}) + "\n")
+    protocol.flush()
+'''
+
+_worker: Optional[subprocess.Popen] = None
+_worker_lock = threading.Lock()
+_worker_disabled = os.environ.get("QIIME_MCP_WORKER", "1") == "0"
+
+
+def _start_worker() -> Optional[subprocess.Popen]:
+    """Spawn the warm worker and wait for its handshake; None if qiime2 cannot load."""
+    process = _spawn(
+        [sys.executable, "-c", _WORKER_SOURCE],
+        stdin=subprocess.PIPE,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL,
+        text=True,
+        bufsize=1,
+    )
+    if process.stdout.readline():
+        return process
+    process.wait()
+    return None
+
+
+def _worker_call(cmd: List[str]) -> Optional[subprocess.CompletedProcess]:
+    """Run a qiime command in the shared warm worker.
+
+    Returns None when the worker is disabled, busy with another call or has
+    died, in which case the caller falls back to the qiime CLI.
+    """
+    global _worker, _worker_disabled
+    if _worker_disabled or cmd[0] != "qiime" or not _worker_lock.acquire(blocking=False):
+        return None
+    try:
+        if _worker is None or _worker.poll() is not None:
+            _worker = _start_worker()
+            if _worker is None:
+                _worker_disabled = True
+                return None
+        request = {"plugin": cmd[1], "action": cmd[2], "argv": cmd[1:]}
+        try:
+            _worker.stdin.write(json.dumps(request) + "\n")
+            _worker.stdin.flush()
+            reply = _worker.stdout.readline()
+        except OSError:
+            reply = ""
+        if not reply:
+            _worker.kill()
+            _worker = None
+            return None
+    finally:
+        _worker_lock.release()
+    reply = json.loads(reply)
+    return subprocess.CompletedProcess(cmd, reply["returncode"], reply["stdout"], reply["stderr"])
+
+
+# Child output is streamed line by line and only the most recent lines are kept.
+_TAIL_LINES = 4096
+
+
+def _drain(pipe, tail: deque, log: Callable[[str], None]) -> None:
+    """Forward each line of a child pipe to log, keeping the last lines in tail."""
+    for line in iter(pipe.readline, ""):
+        line = line.rstrip("\n")
+        tail.append(line)
+        log(line)
+    pipe.close()
+
+
+def _run_streamed(cmd: List[str]) -> subprocess.CompletedProcess:
+    """Run cmd without buffering its whole output; stdout/stderr hold the last lines only."""
+    result = _worker_call(cmd)
+    if result is not None:
+        result.check_returncode()
+        return result
+    process = _spawn(
+        cmd,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        text=True,
+        bufsize=1,
+    )
+    stdout_tail: deque = deque(maxlen=_TAIL_LINES)
+    stderr_tail: deque = deque(maxlen=_TAIL_LINES)
+    readers = [
+        threading.Thread(target=_drain, args=(process.stdout, stdout_tail, logger.info), daemon=True),
+        threading.Thread(target=_drain, args=(process.stderr, stderr_tail, logger.debug), daemon=True),
+    ]
+    for reader in readers:
+        reader.start()
+    returncode = process.wait()
+    for reader in readers:
+        reader.join()
+    stdout = "\n".join(stdout_tail)
+    stderr = "\n".join(stderr_tail)
+    if returncode != 0:
+        raise subprocess.CalledProcessError(returncode, cmd, output=stdout, stderr=stderr)
+    return subprocess.CompletedProcess(cmd, returncode, stdout, stderr)
+
+
+def _read_fasta(handle) -> Iterator[Tuple[str, str]]:
+    """Yield (id, sequence) records from a text FASTA stream.
+
+    Raises ValueError for a header line with no ID.
+    """
+    seq_id, chunks = None, []
+    for line_number, line in enumerate(handle, start=1):
+        line = line.strip()
+        if not line:
+            continue
+        if line.startswith(">"):
+            if seq_id is not None:
+                yield seq_id, "".join(chunks)
+            fields = line[1:].split(maxsplit=1)
+            if not fields:
+                raise ValueError(f"FASTA header on line {line_number} has no sequence ID.")
+            seq_id, chunks = fields[0], []
+        else:
+            chunks.append(line)
+    if seq_id is not None:
+        yield seq_id, "".join(chunks)
+
+
+def _read_artifact_lines(artifact: Path, data_file: str) -> List[str]:
+    """Return the lines of a file stored under the data/ directory of an artifact."""
+    with zipfile.ZipFile(artifact) as archive:
+        member = next(name for name in archive.namelist() if name.endswith(f"/data/{data_file}"))
+        with io.TextIOWrapper(archive.open(member), encoding="utf-8") as fh:
+            return fh.read().splitlines()
+
+
+def _import_artifact(semantic_type: str, input_path: Path, output_path: Path, input_format: Optional[str] = None) -> None:
+    """Wrap a plain file into a QIIME 2 artifact with `qiime tools import`."""
+    cmd = [
+        "qiime", "tools", "import",
+        "--type", semantic_type,
+        "--input-path", str(input_path),
+        "--output-path", str(output_path),
+    ]
+    if input_format:
+        cmd.extend(["--input-format", input_format])
+    _run_streamed(cmd)
+
+
+# Query files with these suffixes are plain FASTA rather than QIIME 2 artifacts.
+_FASTA_SUFFIXES = (".fasta", ".fa", ".fna")
+
+
+def _with_arg(cmd: List[str], flag: str, value: Path) -> List[str]:
+    """Return a copy of cmd with the value following flag replaced."""
+    cmd = list(cmd)
+    cmd[cmd.index(flag) + 1] = str(value)
+    return cmd
+
+
+def _prepare_query(query: Path, workdir: Path, dedup: bool) -> Tuple[Path, Optional[Dict[str, List[str]]]]:
+    """Resolve the query artifact to hand to BLAST+, collapsing duplicates if asked.
+
+    Plain FASTA queries are read directly and imported once, skipping the
+    separate import/zip round-trip a caller would otherwise need. Artifact
+    queries are streamed out of the zip without extracting it to disk.
+    Returns the artifact to classify and, when identical sequences were
+    collapsed, a map from each representative ID to every ID sharing its
+    sequence (None when results need no expansion).
+    """
+    is_fasta = query.suffix.lower() in _FASTA_SUFFIXES
+    if not dedup and not is_fasta:
+        return query, None
+
+    groups: Dict[str, List[str]] = {}
+    try:
+        if is_fasta:
+            with open(query) as fh:
+                for seq_id, sequence in _read_fasta(fh):
+                    groups.setdefault(sequence, []).append(seq_id)
+        else:
+            with zipfile.ZipFile(query) as archive:
+                member = next(name for name in archive.namelist() if name.endswith("/data/dna-sequences.fasta"))
+                with io.TextIOWrapper(archive.open(member), encoding="utf-8") as fh:
+                    for seq_id, sequence in _read_fasta(fh):
+                        groups.setdefault(sequence, []).append(seq_id)
+    except (zipfile.BadZipFile, StopIteration):
+        return query, None
+
+    query_artifact = workdir / "query.qza"
+    n_sequences = sum(len(ids) for ids in groups.values())
+    if not dedup or n_sequences == len(groups):
+        if not is_fasta:
+            return query, None
+        _import_artifact("FeatureData[Sequence]", query, query_artifact)
+        return query_artifact, None
+
+    fasta = workdir / "query-unique.fasta"
+    with open(fasta, "w") as fh:
+        for sequence, ids in groups.items():
+            fh.write(f">{ids[0]}\n{sequence}\n")
+    _import_artifact("FeatureData[Sequence]", fasta, query_artifact)
+    logger.info(f"Collapsed {n_sequences} query sequences to {len(groups)} unique sequences")
+    return query_artifact, {ids[0]: ids for ids in groups.values()}
+
+
+def _expand_rows(lines: List[str], members: Dict[str, List[str]]) -> List[str]:
+    """Repeat each tab-separated row once per query ID sharing its representative."""
+    expanded = []
+    for line in lines:
+        row_id, sep, rest = line.partition("\t")
+        for member in members.get(row_id, [row_id]):
+            expanded.append(f"{member}{sep}{rest}")
+    return expanded
+
+
+def _classify_deduplicated(
+    cmd: List[str],
+    outputs: Dict[str, Path],
+    members: Dict[str, List[str]],
+    workdir: Path,
+) -> subprocess.CompletedProcess:
+    """Classify the unique query sequences, then fan results out to every original ID."""
+    staged = {name: workdir / f"{name}.qza" for name in outputs}
+    cmd = _with_arg(cmd, "--o-classification", staged["classification"])
+    if "search_results" in staged:
+        cmd = _with_arg(cmd, "--o-search-results", staged["search_results"])
+    result = _run_streamed(cmd)
+
+    header, *rows = _read_artifact_lines(staged["classification"], "taxonomy.tsv")
+    taxonomy = workdir / "taxonomy.tsv"
+    taxonomy.write_text("\n".join([header, *_expand_rows(rows, members)]) + "\n")
+    _import_artifact("FeatureData[Taxonomy]", taxonomy, outputs["classification"], "TSVTaxonomyFormat")
+
+    if "search_results" in staged:
+        hits = workdir / "blast6.tsv"
+        hits.write_text("\n".join(_expand_rows(_read_artifact_lines(staged["search_results"], "blast6.tsv"), members)) + "\n")
+        _import_artifact("FeatureData[BLAST6]", hits, outputs["search_results"], "BLAST6Format")
+    return result
+
 
 @mcp.tool()
 def classify_consensus_blast(
@@ -21,6 +363,8 @@ def classify_consensus_blast(
     unassignable_label: str = 'Unassigned',
     num_threads: int = 1,
     verbose: bool = False,
+    use_cache: bool = True,
+    dedup: bool = True,
 ):
     """
     Assign taxonomy to query sequences using BLAST+.
@@ -32,7 +376,8 @@ def classify_consensus_blast(
     Parameters
     ----------
     query : Path
-        QIIME 2 artifact (.qza) of type FeatureData[Sequence]. Sequences to classify.
+        QIIME 2 artifact (.qza) of type FeatureData[Sequence], or a plain FASTA
+        file (.fasta, .fa, .fna). Sequences to classify.
     reference_reads : Path
         QIIME 2 artifact (.qza) of type FeatureData[Sequence]. Reference sequences.
     reference_taxonomy : Path
@@ -59,6 +404,13 @@ def classify_consensus_blast(
         Number of threads to use for job parallelization. Defaults to 1.
     verbose : bool, optional
         Display verbose output. Defaults to False.
+    use_cache : bool, optional
+        Reuse outputs from a previous run with identical inputs and parameters
+        instead of re-running BLAST+. Defaults to True.
+    dedup : bool, optional
+        Collapse identical query sequences before running BLAST+ and copy each
+        result back to every ID sharing that sequence. The outputs are
+        re-imported, so their provenance starts at the import. Defaults to True.
 
     Returns
     -------
@@ -110,19 +462,50 @@ def classify_consensus_blast(
     if verbose:
         cmd.append("--verbose")
 
+    outputs: Dict[str, Path] = {"classification": classification}
+    if search_results:
+        outputs["search_results"] = search_results
+    output_files: List[str] = [str(path) for path in outputs.values()]
+    command_str = shlex.join(cmd)
+
+    # --- Result Cache Lookup ---
+    cache_key = None
+    if use_cache:
+        cache_key = _cache_key(
+            [query, reference_reads, reference_taxonomy],
+            {
+                "action": "feature-classifier classify-consensus-blast",
+                "outputs": sorted(outputs),
+                "maxaccepts": maxaccepts,
+                "perc_identity": perc_identity,
+                "query_cov": query_cov,
+                "strand": strand,
+                "evalue": evalue,
+                "min_consensus": min_consensus,
+                "unassignable_label": unassignable_label,
+                "dedup": dedup,
+            },
+        )
+        if _restore_cached(cache_key, outputs):
+            return {
+                "command_executed": command_str,
+                "stdout": f"Restored cached outputs {cache_key} from {_CACHE_DIR}",
+                "stderr": "",
+                "output_files": output_files
+            }
+
     # --- Subprocess Execution ---
-    command_str = " ".join(cmd)
     try:
-        result = subprocess.run(
-            cmd,
-            capture_output=True,
-            text=True,
-            check=True
-        )
+        with tempfile.TemporaryDirectory(prefix="classify_blast_") as workdir:
+            query_artifact, members = _prepare_query(query, Path(workdir), dedup)
+            run_cmd = _with_arg(cmd, "--i-query", query_artifact)
+            if members is None:
+                result = _run_streamed(run_cmd)
+            else:
+                result = _classify_deduplicated(run_cmd, outputs, members, Path(workdir))
 
-        output_files: List[str] = [str(classification)]
-        if search_results:
-            output_files.append(str(search_results))
+        if cache_key is not None:
+            _store_cached(cache_key, outputs)
 
         return {
             "command_executed": command_str,
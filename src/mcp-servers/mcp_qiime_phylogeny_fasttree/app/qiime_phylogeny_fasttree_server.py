@@ -1,21 +1,392 @@
-from fastmcp import FastMCP
+import asyncio
+import fcntl
+import functools
+import hashlib
+import inspect
+import json
+import os
+import shlex
+import shutil
 import subprocess
+import tempfile
+import zipfile
 from pathlib import Path
-from typing import Optional
+from typing import Optional, Any, Callable, Dict, List, Tuple
 import logging
 
 # Setup logging for better feedback
 logging.basicConfig(level=logging.INFO)
 log = logging.getLogger(__name__)
 
-# Initialize the MCP server
-mcp = FastMCP()
+# Successful runs are cached by input content under <cache>/<tool>/<key>/ so reruns skip qiime.
+_CACHE_DIR = Path(os.environ.get("QIIME_MCP_CACHE", "~/.cache/qiime_mcp")).expanduser()
 
-@mcp.tool()
-def fasttree(
+
+@functools.lru_cache(maxsize=256)
+def _file_digest_impl(key: Tuple[str, int, int]) -> str:
+    """BLAKE2b of one file's bytes; key is (resolved path, mtime_ns, size)."""
+    with open(key[0], "rb") as fh:
+        if hasattr(hashlib, "file_digest"):
+            return hashlib.file_digest(fh, lambda: hashlib.blake2b(digest_size=16)).hexdigest()
+        digest = hashlib.blake2b(digest_size=16)
+        for chunk in iter(lambda: fh.read(1 << 20), b""):
+            digest.update(chunk)
+        return digest.hexdigest()
+
+
+def _file_digest(path: Path) -> str:
+    """Digest of path, memoised for as long as its mtime and size are unchanged."""
+    st = os.stat(path)
+    return _file_digest_impl((str(path.resolve()), st.st_mtime_ns, st.st_size))
+
+
+def _hash_inputs(paths: List[Path], params: Dict[str, Any]) -> str:
+    """Hash the per-file digests of every input together with the canonical parameters."""
+    digest = hashlib.blake2b(digest_size=16)
+    for path in paths:
+        digest.update(_file_digest(path).encode())
+    digest.update(json.dumps(params, sort_keys=True, default=str).encode())
+    return digest.hexdigest()
+
+
+def _stat_key(paths: List[Path], params: Dict[str, Any]) -> str:
+    """Cheap prefilter key from each input's resolved path, mtime and size."""
+    digest = hashlib.blake2b(digest_size=16)
+    for path in paths:
+        st = os.stat(path)
+        digest.update(f"{path.resolve()}\0{st.st_mtime_ns}\0{st.st_size}\0".encode())
+    digest.update(json.dumps(params, sort_keys=True, default=str).encode())
+    return digest.hexdigest()
+
+
+def _materialize(src: Path, dst: Path) -> None:
+    """Copy src to a new file at dst without moving bytes through Python where possible.
+
+    Uses os.copy_file_range (which reflinks on Btrfs/XFS and copies in-kernel
+    elsewhere), then shutil.copy2. It never hard-links: qiime rewrites an
+    existing output in place, which would also change the cached artifact.
+    """
+    dst.unlink(missing_ok=True)
+    try:
+        with open(src, "rb") as fin, open(dst, "wb") as fout:
+            remaining = os.fstat(fin.fileno()).st_size
+            while remaining > 0:
+                copied = os.copy_file_range(fin.fileno(), fout.fileno(), remaining)
+                if copied == 0:
+                    break
+                remaining -= copied
+        shutil.copystat(src, dst)
+    except (AttributeError, OSError):
+        shutil.copy2(src, dst)
+
+
+def _retarget(value: Any, paths: Dict[str, str]) -> Any:
+    """Rewrite the paths recorded in a cached result to the ones requested now."""
+    if isinstance(value, str):
+        return paths.get(value, value)
+    if isinstance(value, list):
+        return [_retarget(item, paths) for item in value]
+    if isinstance(value, dict):
+        return {name: _retarget(item, paths) for name, item in value.items()}
+    return value
+
+
+def _artifact_checksums(path: Path) -> Optional[str]:
+    """Digest of a QIIME 2 archive's checksums.md5 member; None for non-archives."""
+    try:
+        with zipfile.ZipFile(path) as archive:
+            member = next((name for name in archive.namelist() if name.endswith("/checksums.md5")), None)
+            if member is None:
+                return None
+            return hashlib.blake2b(archive.read(member), digest_size=16).hexdigest()
+    except (OSError, zipfile.BadZipFile):
+        return None
+
+
+def _ensure_parent(path: Path) -> None:
+    """Create the parent directory of path if it does not exist."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+
+
+def _restore_cached(entry: Path, paths: Dict[str, Path], outputs: Dict[str, Path]) -> Optional[Dict[str, Any]]:
+    """Copy the outputs cached in entry to the requested paths; None on a cache miss.
+
+    Artifacts whose checksums.md5 no longer matches the digest recorded at
+    store time (e.g. a cache file modified after it was stored) evict the entry.
+    """
+    try:
+        manifest = json.loads((entry / "manifest.json").read_text())
+    except (OSError, ValueError):
+        return None
+    if set(manifest["outputs"]) != set(outputs):
+        return None
+    checksums = manifest.get("checksums", {})
+    for name, cached in manifest["outputs"].items():
+        if checksums.get(name) is not None and _artifact_checksums(entry / cached) != checksums[name]:
+            shutil.rmtree(entry, ignore_errors=True)
+            return None
+    for name, path in outputs.items():
+        _ensure_parent(path)
+        _materialize(entry / manifest["outputs"][name], path)
+    renamed = {old: str(paths[name]) for name, old in manifest["paths"].items() if name in paths}
+    result = _retarget(manifest["result"], renamed)
+    command = shlex.split(result["command_executed"])
+    result["command_executed"] = shlex.join(renamed.get(token, token) for token in command)
+    result.pop("log_files", None)
+    result["cached"] = True
+    return result
+
+
+def _store_cached(entry: Path, paths: Dict[str, Path], outputs: Dict[str, Path], result: Dict[str, Any]) -> None:
+    """Publish freshly written outputs and their manifest under entry (best effort)."""
+    try:
+        _ensure_parent(entry)
+        staging = Path(tempfile.mkdtemp(prefix=f".{entry.name}.", dir=entry.parent))
+    except OSError:
+        return
+    try:
+        manifest = {
+            "outputs": {name: f"{name}{path.suffix}" for name, path in outputs.items()},
+            "paths": {name: str(path) for name, path in paths.items()},
+            "result": result,
+            "checksums": {name: _artifact_checksums(path) for name, path in outputs.items()},
+        }
+        for name, path in outputs.items():
+            _materialize(path, staging / manifest["outputs"][name])
+        (staging / "manifest.json").write_text(json.dumps(manifest))
+        os.replace(staging, entry)
+    except OSError:
+        shutil.rmtree(staging, ignore_errors=True)
+
+
+def _cached_tool(inputs: Tuple[str, ...], outputs: Tuple[str, ...]) -> Callable:
+    """Serve repeat calls of a tool from the on-disk cache.
+
+    inputs and outputs name the tool's input and output path parameters; every
+    other parameter except use_cache and force is part of the key. An index
+    keyed by path, mtime and size maps unchanged inputs to their content key
+    without re-reading them. force skips the lookup but still stores the result.
+    """
+    def decorator(fn: Callable) -> Callable:
+        signature = inspect.signature(fn)
+        tool_dir = _CACHE_DIR / fn.__name__
+
+        @functools.wraps(fn)
+        async def wrapper(*args, **kwargs):
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            arguments = bound.arguments
+            if not arguments.get("use_cache", True):
+                return await fn(*args, **kwargs)
+            in_paths = {name: Path(arguments[name]) for name in inputs if arguments[name] is not None}
+            out_paths = {name: Path(arguments[name]) for name in outputs if arguments[name] is not None}
+            params = {
+                name: value for name, value in arguments.items()
+                if name not in inputs and name not in outputs and name not in ("use_cache", "force")
+            }
+            params["inputs"], params["outputs"] = sorted(in_paths), sorted(out_paths)
+            try:
+                stat_key = _stat_key(list(in_paths.values()), params)
+            except OSError:
+                return await fn(*args, **kwargs)
+            index = tool_dir / "index" / stat_key
+            try:
+                key, indexed = index.read_text(), True
+            except OSError:
+                key = await asyncio.to_thread(_hash_inputs, list(in_paths.values()), params)
+                indexed = False
+            paths = {**in_paths, **out_paths}
+            result = None
+            if not arguments.get("force"):
+                result = await asyncio.to_thread(_restore_cached, tool_dir / key, paths, out_paths)
+            if result is None:
+                result = await fn(*args, **kwargs)
+                stored = isinstance(result, dict) and result.get("output_files") and not result.get("error")
+                if not stored:
+                    return result
+                await asyncio.to_thread(_store_cached, tool_dir / key, paths, out_paths, result)
+            if not indexed:
+                try:
+                    _ensure_parent(index)
+                    staged = index.with_name(f".{stat_key}.{os.getpid()}")
+                    staged.write_text(key)
+                    os.replace(staged, index)
+                except OSError:
+                    pass
+            return result
+        return wrapper
+    return decorator
+
+
+# Argument checks are table driven: each schema row is (parameter, check, exception, message).
+def _existing_file(value: Any) -> bool:
+    """True if value names an existing regular file."""
+    return Path(value).is_file()
+
+
+def _non_negative_int(value: Any) -> bool:
+    """True for an integer of zero or more."""
+    return value >= 0
+
+
+def _validate(arguments: Dict[str, Any], schema: Tuple) -> None:
+    """Raise the schema's exception for the first argument that fails its check."""
+    for name, check, error, message in schema:
+        value = arguments[name]
+        if value is not None and not check(value):
+            raise error(message.format(value=value))
+
+
+# Resolved once at import so calls skip the PATH search; None when qiime is not installed.
+_QIIME_BIN = shutil.which("qiime")
+
+# CPython launches children with posix_spawn instead of fork+exec only when the
+# executable path has a directory part and there is no shell, preexec_fn,
+# pass_fds, cwd, start_new_session or close_fds=True. Our descriptors are
+# non-inheritable by default, so close_fds=False leaks nothing into qiime.
+_SPAWN_KWARGS = {"close_fds": False}
+
+# q2cli builds its deployment cache on first use; concurrent first runs can corrupt it.
+_qiime_cache_ready = False
+_qiime_cache_lock = asyncio.Lock()
+
+
+def _q2cli_state_file() -> Path:
+    """Path of q2cli's deployment cache state, following q2cli.util.get_app_dir."""
+    prefix = os.environ.get("CONDA_PREFIX")
+    if prefix and os.access(prefix, os.W_OK | os.X_OK):
+        app_dir = Path(prefix) / "var" / "q2cli"
+    else:
+        app_dir = Path(os.environ.get("XDG_CONFIG_HOME", "~/.config")).expanduser() / "q2cli"
+    return app_dir / "cache" / "state.json"
+
+
+def _init_qiime_cache() -> None:
+    """Under an exclusive file lock, build q2cli's cache with `qiime info` if it is missing or corrupt."""
+    state = _q2cli_state_file()
+    _ensure_parent(state)
+    with open(state.parent / ".init.lock", "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            json.loads(state.read_text())
+        except (OSError, ValueError):
+            subprocess.run([_QIIME_BIN, "info"], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, **_SPAWN_KWARGS)
+
+
+async def _ensure_qiime_cache() -> None:
+    """Initialise q2cli's cache once per process before the first qiime run."""
+    global _qiime_cache_ready
+    if _qiime_cache_ready:
+        return
+    async with _qiime_cache_lock:
+        if not _qiime_cache_ready:
+            await asyncio.to_thread(_init_qiime_cache)
+            _qiime_cache_ready = True
+
+
+# qiime writes straight into log files in a temporary directory of their own, which
+# is removed unless the run fails; only the last _TAIL_BYTES of each are returned.
+_TAIL_BYTES = 64 * 1024
+
+
+def _log_files(output: Path) -> Dict[str, str]:
+    """Paths, in a new temporary directory, for the full stdout and stderr of the run that writes output."""
+    log_dir = tempfile.mkdtemp(prefix="qiime_mcp_logs_")
+    return {stream: os.path.join(log_dir, f"{output.stem}.{stream}.log") for stream in ("stdout", "stderr")}
+
+
+def _discard_logs(log_files: Dict[str, str]) -> None:
+    """Remove the temporary directory holding log_files."""
+    shutil.rmtree(os.path.dirname(log_files["stdout"]), ignore_errors=True)
+
+
+def _log_tail(log_path: str) -> str:
+    """Decode the last _TAIL_BYTES of the log at log_path."""
+    with open(log_path, "rb") as log:
+        size = log.seek(0, os.SEEK_END)
+        log.seek(max(0, size - _TAIL_BYTES))
+        return log.read().decode(errors="replace")
+
+
+# Number of qiime subprocesses this process is running; "auto" thread counts share the host among them.
+_RUNNING = 0
+
+
+def _pick_threads(requested: int) -> int:
+    """Return requested, or for 0 an even share of the host's cores with the calls already running."""
+    if requested > 0:
+        return requested
+    return max(1, (os.cpu_count() or 1) // (_RUNNING + 1))
+
+
+async def _run(cmd: List[str], log_files: Dict[str, str]) -> subprocess.CompletedProcess:
+    """Run cmd via _run_process, counting it in _RUNNING while it is in flight."""
+    global _RUNNING
+    _RUNNING += 1
+    try:
+        return await _run_process(cmd, log_files)
+    finally:
+        _RUNNING -= 1
+
+
+async def _run_process(cmd: List[str], log_files: Dict[str, str]) -> subprocess.CompletedProcess:
+    """Run cmd without blocking the event loop, raising CalledProcessError on failure.
+
+    cmd[0] is replaced by the qiime executable resolved at import. stdout and
+    stderr are redirected to log_files rather than piped through this
+    process; the returned text holds only their last _TAIL_BYTES. The logs
+    are kept only when the command fails.
+    """
+    await _ensure_qiime_cache()
+    with open(log_files["stdout"], "wb") as out, open(log_files["stderr"], "wb") as err:
+        process = await asyncio.create_subprocess_exec(_QIIME_BIN, *cmd[1:], stdout=out, stderr=err, **_SPAWN_KWARGS)
+        try:
+            returncode = await process.wait()
+        except asyncio.CancelledError:
+            process.kill()
+            # Reap the killed child so it does not linger as a zombie.
+            await process.wait()
+            _discard_logs(log_files)
+            raise
+    stdout, stderr = _log_tail(log_files["stdout"]), _log_tail(log_files["stderr"])
+    if returncode != 0:
+        raise subprocess.CalledProcessError(returncode, cmd, output=stdout, stderr=stderr)
+    _discard_logs(log_files)
+    return subprocess.CompletedProcess(cmd, returncode, stdout, stderr)
+
+
+# Plain FASTA inputs are imported straight into a QIIME 2 cache, skipping the .qza zip pass.
+_FASTA_SUFFIXES = (".fasta", ".fa", ".fna")
+_Q2_CACHE = _CACHE_DIR / "q2cache"
+
+
+async def _import_to_cache(raw_fasta: Path, semantic_type: str, input_format: str, log_files: Dict[str, str]) -> str:
+    """Import raw_fasta into the QIIME 2 cache once per content and return its cache:key reference."""
+    key = f"fasta_{await asyncio.to_thread(_file_digest, raw_fasta)}"
+    if not (_Q2_CACHE / "keys" / key).exists():
+        await _run([
+            "qiime", "tools", "cache-import",
+            "--type", semantic_type,
+            "--input-path", str(raw_fasta),
+            "--input-format", input_format,
+            "--cache", str(_Q2_CACHE),
+            "--key", key,
+        ], log_files)
+    return f"{_Q2_CACHE}:{key}"
+
+
+_SCHEMA = (
+    ("alignment", _existing_file, FileNotFoundError, "Input alignment file not found at: {value}"),
+    ("scaffold_path", _existing_file, FileNotFoundError, "Optional scaffold tree file not found at: {value}"),
+    ("n_threads", _non_negative_int, ValueError, "n_threads must be a non-negative integer (0 for auto)."),
+)
+
+
+@_cached_tool(inputs=("alignment", "scaffold_path"), outputs=("tree",))
+async def fasttree(
     alignment: Path,
     tree: Path,
-    n_threads: int = 1,
+    n_threads: int = 0,
     parttree: bool = False,
     no_support: bool = False,
     fastest: bool = False,
@@ -23,6 +394,8 @@ def fasttree(
     scaffold_path: Optional[Path] = None,
     verbose: bool = False,
     quiet: bool = False,
+    use_cache: bool = True,
+    force: bool = False,
 ):
     """
     Construct a phylogenetic tree with FastTree using QIIME 2.
@@ -34,12 +407,13 @@ def fasttree(
     Parameters
     ----------
     alignment : Path
-        Path to the input aligned sequences artifact (`--i-alignment`). [required]
+        Path to the input aligned sequences artifact (`--i-alignment`), or an aligned
+        .fasta/.fa/.fna file, which is imported directly into the QIIME 2 cache. [required]
     tree : Path
         Path for the output phylogenetic tree artifact (`--o-tree`). [required]
     n_threads : int, optional
-        The number of threads to use. Use 0 to automatically use all available cores.
-        Corresponds to `--p-n-threads`. (default: 1)
+        The number of threads to use. Use 0 to share the host's cores evenly with
+        the qiime runs already in flight. Corresponds to `--p-n-threads`. (default: 0)
     parttree : bool, optional
         (EXPERIMENTAL) Build a tree from a subset of sequences and add the rest
         using the "-fastest" option. Corresponds to `--p-parttree`. (default: False)
@@ -59,6 +433,12 @@ def fasttree(
         Display verbose output during execution. (default: False)
     quiet : bool, optional
         Silence output if execution is successful. (default: False)
+    use_cache : bool, optional
+        Reuse the outputs of an earlier run with identical inputs and
+        parameters instead of re-running QIIME 2. (default: True)
+    force : bool, optional
+        Re-run QIIME 2 even when the cache holds a result for identical
+        inputs and parameters. (default: False)
 
     Returns
     -------
@@ -68,27 +448,20 @@ def fasttree(
         includes an error message and return code.
     """
     # --- Input Validation ---
-    if not alignment.is_file():
-        raise FileNotFoundError(f"Input alignment file not found at: {alignment}")
-    if scaffold_path and not scaffold_path.is_file():
-        raise FileNotFoundError(f"Optional scaffold tree file not found at: {scaffold_path}")
-    if n_threads < 0:
-        raise ValueError("n_threads must be a non-negative integer (0 for all cores).")
-    
+    _validate(locals(), _SCHEMA)
+
     # Ensure the output directory exists
-    if tree.parent and not tree.parent.is_dir():
-        try:
-            tree.parent.mkdir(parents=True, exist_ok=True)
-            log.info(f"Created output directory: {tree.parent}")
-        except OSError as e:
-            raise OSError(f"Could not create output directory {tree.parent}: {e}")
+    try:
+        _ensure_parent(tree)
+    except OSError as e:
+        raise OSError(f"Could not create output directory {tree.parent}: {e}")
 
     # --- Command Construction ---
     cmd = [
         "qiime", "phylogeny", "fasttree",
         "--i-alignment", str(alignment),
         "--o-tree", str(tree),
-        "--p-n-threads", str(n_threads),
+        "--p-n-threads", str(_pick_threads(n_threads)),
     ]
 
     if parttree:
@@ -106,22 +479,11 @@ def fasttree(
     if quiet:
         cmd.append("--quiet")
 
-    command_str = " ".join(cmd)
+    command_str = shlex.join(cmd)
     log.info(f"Executing command: {command_str}")
 
     # --- Subprocess Execution and Error Handling ---
-    try:
-        result = subprocess.run(
-            cmd,
-            check=True,
-            capture_output=True,
-            text=True,
-        )
-        stdout = result.stdout
-        stderr = result.stderr
-        log.info("QIIME 2 fasttree execution completed successfully.")
-
-    except FileNotFoundError:
+    if _QIIME_BIN is None:
         error_msg = "Executable 'qiime' not found. Please ensure QIIME 2 is installed and in your system's PATH."
         log.error(error_msg)
         return {
@@ -132,6 +494,20 @@ def fasttree(
             "return_code": 127,
             "output_files": {}
         }
+
+    log_files = _log_files(tree)
+    try:
+        if alignment.suffix.lower() in _FASTA_SUFFIXES:
+            import_logs = _log_files(tree.with_name(f"{tree.stem}-import{tree.suffix}"))
+            cmd[cmd.index("--i-alignment") + 1] = await _import_to_cache(
+                alignment, "FeatureData[AlignedSequence]", "AlignedDNAFASTAFormat", import_logs
+            )
+            command_str = shlex.join(cmd)
+        result = await _run(cmd, log_files)
+        stdout = result.stdout
+        stderr = result.stderr
+        log.info("QIIME 2 fasttree execution completed successfully.")
+
     except subprocess.CalledProcessError as e:
         log.error(f"QIIME 2 fasttree execution failed with return code {e.returncode}")
         log.error(f"Stderr:\n{e.stderr}")
@@ -139,6 +515,7 @@ def fasttree(
             "command_executed": command_str,
             "stdout": e.stdout,
             "stderr": e.stderr,
+            "log_files": log_files,
             "error": "QIIME 2 fasttree execution failed.",
             "return_code": e.returncode,
             "output_files": {}
@@ -154,5 +531,97 @@ def fasttree(
         }
     }
 
+
+async def fasttree_batch(
+    alignments: List[Path],
+    trees: List[Path],
+    max_concurrency: int = 2,
+    n_threads: Optional[int] = None,
+    parttree: bool = False,
+    no_support: bool = False,
+    fastest: bool = False,
+    raxml_one_per_branch: bool = False,
+    use_cache: bool = True,
+) -> List[Dict[str, Any]]:
+    """
+    Construct FastTree phylogenies for many alignments concurrently.
+
+    Each alignment is an independent `qiime phylogeny fasttree` run; up to
+    `max_concurrency` of them run at once and the host's cores are split
+    between them.
+
+    Parameters
+    ----------
+    alignments : List[Path]
+        Paths to the input aligned sequences artifacts. [required]
+    trees : List[Path]
+        Output tree artifact paths, one per alignment. [required]
+    max_concurrency : int, optional
+        Maximum number of FastTree runs in flight. (default: 2)
+    n_threads : Optional[int], optional
+        Threads per run. Defaults to the CPU count divided by
+        `max_concurrency`, and at least 1.
+    parttree, no_support, fastest, raxml_one_per_branch, use_cache : optional
+        Passed through to `fasttree` for every alignment.
+
+    Returns
+    -------
+    list of dict
+        One `fasttree` result per alignment, in input order. A run that
+        raised instead of returning is reported as a dict with an `error` key.
+    """
+    if len(alignments) != len(trees):
+        raise ValueError("alignments and trees must have the same length.")
+    if max_concurrency < 1:
+        raise ValueError("max_concurrency must be a positive integer.")
+    if n_threads is None:
+        n_threads = max(1, (os.cpu_count() or 1) // max_concurrency)
+
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def run_one(alignment: Path, tree: Path) -> Dict[str, Any]:
+        async with semaphore:
+            return await fasttree(
+                alignment,
+                tree,
+                n_threads=n_threads,
+                parttree=parttree,
+                no_support=no_support,
+                fastest=fastest,
+                raxml_one_per_branch=raxml_one_per_branch,
+                use_cache=use_cache,
+            )
+
+    results = await asyncio.gather(
+        *(run_one(alignment, tree) for alignment, tree in zip(alignments, trees)),
+        return_exceptions=True,
+    )
+    return [
+        {"alignment": str(alignment), "error": str(result), "output_files": {}}
+        if isinstance(result, Exception) else result
+        for alignment, result in zip(alignments, results)
+    ]
+
+
+def _build():
+    """Create the MCP server; fastmcp is only imported once the server is actually started."""
+    from fastmcp import FastMCP
+
+    mcp = FastMCP()
+    for tool in (fasttree, fasttree_batch):
+        mcp.tool()(tool)
+    return mcp
+
+
+def __getattr__(name: str):
+    # `from qiime_phylogeny_fasttree_server import mcp` still works: the server is
+    # built on first access and then cached as a module attribute.
+    if name == "mcp":
+        global mcp
+        mcp = _build()
+        return mcp
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
 if __name__ == '__main__':
-    mcp.run()
\ No newline at end of file
+    _build().run()
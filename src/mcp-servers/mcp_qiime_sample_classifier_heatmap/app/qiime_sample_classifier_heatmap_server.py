@@ -1,19 +1,166 @@
+import asyncio
+import contextlib
+import json
+import os
+import shlex
 import subprocess
+import sys
 import logging
+from collections import deque
 from pathlib import Path
 from typing import Optional, List
 
 from fastmcp import FastMCP
 
-# Setup logging
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 # Initialize MCP
 mcp = FastMCP()
 
+# Only the last _TAIL_LINES lines of each output stream are kept in memory.
+_TAIL_LINES = 2000
+
+
+async def _drain(stream: asyncio.StreamReader, tail: deque) -> None:
+    """Consume a subprocess stream, keeping its last raw lines in tail for _run to decode."""
+    async for line in stream:
+        tail.append(line.rstrip(b"\n"))
+
+
+# Source of the long-lived workers: each pays the qiime2/q2cli import and plugin
+# discovery once, then runs newline-delimited JSON requests through q2cli.
+_WORKER_SOURCE = r'''
+import contextlib, io, json, os, sys
+TAIL_LINES = int(sys.argv[1])
+protocol = os.fdopen(os.dup(1), "w")
+os.dup2(2, 1)
+from qiime2.sdk import PluginManager
+from q2cli.commands import RootCommand
+PluginManager()
+root = RootCommand()
+protocol.write(json.dumps({"ready": True}) + "\n")
+protocol.flush()
+for line in sys.stdin:
+    argv = json.loads(line)["argv"]
+    out, err = io.StringIO(), io.StringIO()
+    with contextlib.redirect_stdout(out), contextlib.redirect_stderr(err):
+        try:
+            rc = root.main(args=argv, prog_name="qiime", standalone_mode=False)
+            rc = rc if isinstance(rc, int) else 0
+        except SystemExit as exc:
+            rc = exc.code if isinstance(exc.code, int) else 1
+        except Exception as exc:
+            print(exc, file=sys.stderr)
+            rc = getattr(exc, "exit_code", 1)
+    tails = {name: "\n".join(buf.getvalue().splitlines()[-TAIL_LINES:]) for name, buf in (("stdout", out), ("stderr", err))}
+    protocol.write(json.dumps({"ok": rc == 0, "returncode": rc, **tails}) + "\n")
+    protocol.flush()
+'''
+
+# Pool of warm workers, created on first use; a slot holds None until its worker is started.
+# There is always at least one slot, so waiting for a worker cannot hang; set
+# QIIME_MCP_WORKER=0 to turn the workers off.
+_WORKER_COUNT = max(1, int(os.environ.get("QIIME_MCP_WORKERS", "2")))
+_worker_pool: Optional[asyncio.Queue] = None
+_worker_disabled = os.environ.get("QIIME_MCP_WORKER", "1") == "0"
+
+
+async def _start_worker() -> Optional[asyncio.subprocess.Process]:
+    """Spawn a warm worker and wait for its handshake; None if qiime2 cannot load."""
+    process = await asyncio.create_subprocess_exec(
+        sys.executable, "-c", _WORKER_SOURCE, str(_TAIL_LINES),
+        stdin=asyncio.subprocess.PIPE, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.DEVNULL,
+        limit=1 << 24,
+    )
+    if await process.stdout.readline():
+        return process
+    await process.wait()
+    return None
+
+
+async def _worker_call(cmd: List[str]) -> Optional[subprocess.CompletedProcess]:
+    """Run a qiime command in an idle warm worker from the pool.
+
+    Returns None when workers are disabled, all busy or the chosen one has
+    died, in which case the caller falls back to the qiime CLI.
+    """
+    global _worker_pool, _worker_disabled
+    if _worker_disabled or cmd[0] != "qiime":
+        return None
+    if _worker_pool is None:
+        _worker_pool = asyncio.Queue()
+        for _ in range(_WORKER_COUNT):
+            _worker_pool.put_nowait(None)
+    try:
+        worker = _worker_pool.get_nowait()
+    except asyncio.QueueEmpty:
+        return None
+    try:
+        if worker is None or worker.returncode is not None:
+            worker = await _start_worker()
+            if worker is None:
+                _worker_disabled = True
+                return None
+        try:
+            worker.stdin.write((json.dumps({"argv": cmd[1:]}) + "\n").encode())
+            await worker.stdin.drain()
+            reply = await worker.stdout.readline()
+        except (OSError, ValueError):
+            reply = b""
+        if not reply:
+            with contextlib.suppress(ProcessLookupError):
+                worker.kill()
+            worker = None
+            return None
+    except asyncio.CancelledError:
+        # The worker may still be running the abandoned command, so it cannot be reused.
+        if worker is not None:
+            with contextlib.suppress(ProcessLookupError):
+                worker.kill()
+            worker = None
+        raise
+    finally:
+        _worker_pool.put_nowait(worker)
+    reply = json.loads(reply)
+    return subprocess.CompletedProcess(cmd, reply["returncode"], reply["stdout"], reply["stderr"])
+
+
+async def _run(cmd: List[str]) -> subprocess.CompletedProcess:
+    """Run cmd without blocking the event loop, raising CalledProcessError on failure.
+
+    A warm worker from the pool runs the command when one is idle; otherwise
+    the qiime CLI is spawned. Only the last _TAIL_LINES lines of stdout and
+    stderr are kept.
+    """
+    result = await _worker_call(cmd)
+    if result is not None:
+        result.check_returncode()
+        return result
+    process = await asyncio.create_subprocess_exec(
+        *cmd, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE, limit=1 << 20
+    )
+    stdout_tail: deque = deque(maxlen=_TAIL_LINES)
+    stderr_tail: deque = deque(maxlen=_TAIL_LINES)
+    try:
+        await asyncio.gather(_drain(process.stdout, stdout_tail), _drain(process.stderr, stderr_tail))
+        returncode = await process.wait()
+    except asyncio.CancelledError:
+        process.kill()
+        raise
+    # Only the kept tail is decoded, once, rather than every line as it streams past.
+    stdout = b"\n".join(stdout_tail).decode(errors="replace")
+    stderr = b"\n".join(stderr_tail).decode(errors="replace")
+    if returncode != 0:
+        raise subprocess.CalledProcessError(returncode, cmd, output=stdout, stderr=stderr)
+    return subprocess.CompletedProcess(cmd, returncode, stdout, stderr)
+
+
+# Invariant head of the qiime command line, built once at import.
+_HEATMAP_PREFIX = ("qiime", "sample-classifier", "heatmap")
+
+
 @mcp.tool()
-def sample_classifier_heatmap(
+async def sample_classifier_heatmap(
     i_table: Path,
     i_importance: Path,
     o_heatmap: Path,
@@ -47,19 +194,17 @@ def sample_classifier_heatmap(
 
     # --- Command Construction ---
     cmd = [
-        "qiime", "sample-classifier", "heatmap",
-        "--i-table", str(i_table),
-        "--i-importance", str(i_importance),
-        "--o-heatmap", str(o_heatmap),
+        *_HEATMAP_PREFIX,
+        "--i-table", os.fspath(i_table),
+        "--i-importance", os.fspath(i_importance),
+        "--o-heatmap", os.fspath(o_heatmap),
         "--p-feature-count", str(p_feature_count),
     ]
 
     if o_filtered_table:
-        cmd.extend(["--o-filtered-table", str(o_filtered_table)])
-
+        cmd.extend(["--o-filtered-table", os.fspath(o_filtered_table)])
     if m_sample_metadata_file:
-        cmd.extend(["--m-sample-metadata-file", str(m_sample_metadata_file)])
-
+        cmd.extend(["--m-sample-metadata-file", os.fspath(m_sample_metadata_file)])
     if m_sample_metadata_column:
         cmd.extend(["--m-sample-metadata-column", m_sample_metadata_column])
 
@@ -76,16 +221,11 @@ def sample_classifier_heatmap(
         cmd.append("--verbose")
 
     # --- Subprocess Execution ---
-    command_executed = " ".join(cmd)
+    command_executed = shlex.join(cmd)
     logger.info(f"Executing command: {command_executed}")
 
     try:
-        result = subprocess.run(
-            cmd,
-            capture_output=True,
-            text=True,
-            check=True,
-        )
+        result = await _run(cmd)
         stdout = result.stdout
         stderr = result.stderr
         logger.info("Command executed successfully.")
@@ -121,4 +261,6 @@ def sample_classifier_heatmap(
     }
 
 if __name__ == '__main__':
+    # Configure root logging only when run as a server, not on import.
+    logging.basicConfig(level=logging.INFO)
     mcp.run()
\ No newline at end of file
@@ -1,18 +1,251 @@
 from fastmcp import FastMCP
+import asyncio
+import contextlib
+import contextvars
+import json
+import os
+import shlex
 import subprocess
+import sys
+from collections import deque
 from pathlib import Path
-from typing import Optional
+from typing import Optional, List, Any, Awaitable, Callable, Tuple
 import logging
 
-# Setup basic logging
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 # Initialize the MCP application
 mcp = FastMCP()
 
-@mcp.tool()
-def taxa_collapse(
+# Only the last _TAIL_LINES lines of each output stream are kept in memory.
+_TAIL_LINES = 2000
+
+
+async def _drain(stream: asyncio.StreamReader, tail: deque) -> None:
+    """Consume a subprocess stream, keeping its last raw lines in tail for _run to decode."""
+    async for line in stream:
+        tail.append(line.rstrip(b"\n"))
+
+
+# Source of the long-lived workers: each pays the qiime2/q2cli import and plugin
+# discovery once, then runs newline-delimited JSON requests through q2cli, or
+# through the taxa plugin's Python API when a request carries a "collapse" call.
+# API calls reuse recently loaded artifacts, so a batch against one taxonomy
+# unzips and parses it once per worker.
+_WORKER_SOURCE = r'''
+import contextlib, functools, io, json, os, sys
+TAIL_LINES = int(sys.argv[1])
+protocol = os.fdopen(os.dup(1), "w")
+os.dup2(2, 1)
+from qiime2 import Artifact
+from qiime2.sdk import PluginManager
+from q2cli.commands import RootCommand
+PluginManager()
+root = RootCommand()
+@functools.lru_cache(maxsize=32)
+def cached_artifact(path, mtime_ns, size):
+    return Artifact.load(path)
+def load_artifact(path):
+    # Keyed by the file's mtime and size, so a rewritten artifact is loaded afresh.
+    st = os.stat(path)
+    return cached_artifact(path, st.st_mtime_ns, st.st_size)
+def run_collapse(table, taxonomy, level, output):
+    from qiime2.plugins.taxa.methods import collapse
+    result = collapse(table=load_artifact(table), taxonomy=load_artifact(taxonomy), level=level)
+    print("Saved FeatureTable[Frequency] to: " + result.collapsed_table.save(output))
+    return 0
+protocol.write(json.dumps({"ready": True}) + "\n")
+protocol.flush()
+for line in sys.stdin:
+    request = json.loads(line)
+    out, err = io.StringIO(), io.StringIO()
+    with contextlib.redirect_stdout(out), contextlib.redirect_stderr(err):
+        try:
+            if request.get("collapse"):
+                rc = run_collapse(**request["collapse"])
+            else:
+                rc = root.main(args=request["argv"], prog_name="qiime", standalone_mode=False)
+                rc = rc if isinstance(rc, int) else 0
+        except SystemExit as exc:
+            rc = exc.code if isinstance(exc.code, int) else 1
+        except Exception as exc:
+            print(exc, file=sys.stderr)
+            rc = getattr(exc, "exit_code", 1)
+    tails = {name: "\n".join(buf.getvalue().splitlines()[-TAIL_LINES:]) for name, buf in (("stdout", out), ("stderr", err))}
+    protocol.write(json.dumps({"ok": rc == 0, "returncode": rc, **tails}) + "\n")
+    protocol.flush()
+'''
+
+# Pool of warm workers, created on first use; a slot holds None until its worker is started.
+# There is always at least one slot, so waiting for a worker cannot hang; set
+# QIIME_MCP_WORKER=0 to turn the workers off.
+_WORKER_COUNT = max(1, int(os.environ.get("QIIME_MCP_WORKERS", "2")))
+_worker_pool: Optional[asyncio.Queue] = None
+_worker_disabled = os.environ.get("QIIME_MCP_WORKER", "1") == "0"
+
+
+async def _start_worker() -> Optional[asyncio.subprocess.Process]:
+    """Spawn a warm worker and wait for its handshake; None if qiime2 cannot load."""
+    process = await asyncio.create_subprocess_exec(
+        sys.executable, "-c", _WORKER_SOURCE, str(_TAIL_LINES),
+        stdin=asyncio.subprocess.PIPE, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.DEVNULL,
+        limit=1 << 24,
+    )
+    if await process.stdout.readline():
+        return process
+    await process.wait()
+    return None
+
+
+# Set by _batch_worker so that every command of a batch runs in the same warm worker.
+_pinned_worker: contextvars.ContextVar = contextvars.ContextVar("_pinned_worker", default=None)
+
+
+def _pool() -> asyncio.Queue:
+    """The worker pool, with one empty slot per allowed worker on first use."""
+    global _worker_pool
+    if _worker_pool is None:
+        _worker_pool = asyncio.Queue()
+        for _ in range(_WORKER_COUNT):
+            _worker_pool.put_nowait(None)
+    return _worker_pool
+
+
+async def _exchange(
+    worker: asyncio.subprocess.Process, cmd: List[str], call: Optional[dict] = None
+) -> Optional[subprocess.CompletedProcess]:
+    """Run cmd, or call, in worker; None, after killing it, if the worker has died or the call is cancelled."""
+    try:
+        worker.stdin.write((json.dumps({"argv": cmd[1:], "collapse": call}) + "\n").encode())
+        await worker.stdin.drain()
+        reply = await worker.stdout.readline()
+    except (OSError, ValueError):
+        reply = b""
+    except asyncio.CancelledError:
+        # The worker may still be running the abandoned command, so it cannot be reused.
+        with contextlib.suppress(ProcessLookupError):
+            worker.kill()
+        raise
+    if not reply:
+        with contextlib.suppress(ProcessLookupError):
+            worker.kill()
+        await worker.wait()
+        return None
+    reply = json.loads(reply)
+    return subprocess.CompletedProcess(cmd, reply["returncode"], reply["stdout"], reply["stderr"])
+
+
+async def _worker_call(cmd: List[str], call: Optional[dict] = None) -> Optional[subprocess.CompletedProcess]:
+    """Run a qiime command in the batch's pinned worker, or pin an idle one for this call.
+
+    A call, the keyword arguments of the worker's run_collapse, runs
+    through the taxa plugin's Python API instead of q2cli.
+
+    Returns None when workers are disabled, all busy or the chosen one has
+    died, in which case the caller falls back to the qiime CLI.
+    """
+    if _worker_disabled or cmd[0] != "qiime":
+        return None
+    pinned = _pinned_worker.get()
+    if pinned is not None:
+        return None if pinned.returncode is not None else await _exchange(pinned, cmd, call)
+    async with _batch_worker(wait=False):
+        worker = _pinned_worker.get()
+        return None if worker is None else await _exchange(worker, cmd, call)
+
+
+@contextlib.asynccontextmanager
+async def _batch_worker(wait: bool = True):
+    """Pin one warm worker for the commands run inside the block.
+
+    With wait=False the block runs unpinned, on whatever worker or CLI
+    _worker_call finds, instead of waiting for a worker to become idle.
+    _worker_call also uses it, with wait=False, to pin a worker for a
+    single command.
+    """
+    global _worker_disabled
+    if _worker_disabled:
+        yield
+        return
+    try:
+        worker = await _pool().get() if wait else _pool().get_nowait()
+    except asyncio.QueueEmpty:
+        yield
+        return
+    token = None
+    try:
+        if worker is None or worker.returncode is not None:
+            worker = await _start_worker()
+            if worker is None:
+                _worker_disabled = True
+        if worker is not None:
+            token = _pinned_worker.set(worker)
+        yield
+    finally:
+        if token is not None:
+            _pinned_worker.reset(token)
+        _pool().put_nowait(worker)
+
+
+# Batch jobs run on up to _CONCURRENCY lanes; _qiime_slots caps jobs in flight across all batches.
+_CONCURRENCY = max(1, int(os.environ.get("QIIME_MCP_CONCURRENCY", "4")))
+_qiime_slots = asyncio.Semaphore(_CONCURRENCY)
+
+
+async def _fan_out(jobs: List[Any], run_job: Callable[[Any], Awaitable[Any]]) -> List[Any]:
+    """Await run_job for every job concurrently on up to _CONCURRENCY lanes, keeping input order.
+
+    Each lane pins its own warm worker; only the first waits for one to
+    become idle, the others fall back to unpinned runs.
+    """
+    results: List[Any] = [None] * len(jobs)
+    pending = iter(enumerate(jobs))
+
+    async def lane(wait: bool) -> None:
+        async with _batch_worker(wait):
+            for index, job in pending:
+                async with _qiime_slots:
+                    results[index] = await run_job(job)
+
+    await asyncio.gather(*(lane(n == 0) for n in range(min(_CONCURRENCY, len(jobs)))))
+    return results
+
+
+async def _run(cmd: List[str], call: Optional[dict] = None) -> subprocess.CompletedProcess:
+    """Run cmd without blocking the event loop, raising CalledProcessError on failure.
+
+    A warm worker from the pool runs the command, or its API equivalent
+    call, when one is idle; otherwise the qiime CLI is spawned. Only the
+    last _TAIL_LINES lines of stdout and stderr are kept.
+    """
+    result = await _worker_call(cmd, call)
+    if result is not None:
+        result.check_returncode()
+        return result
+    process = await asyncio.create_subprocess_exec(
+        *cmd, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE, limit=1 << 20
+    )
+    stdout_tail: deque = deque(maxlen=_TAIL_LINES)
+    stderr_tail: deque = deque(maxlen=_TAIL_LINES)
+    try:
+        await asyncio.gather(_drain(process.stdout, stdout_tail), _drain(process.stderr, stderr_tail))
+        returncode = await process.wait()
+    except asyncio.CancelledError:
+        process.kill()
+        raise
+    # Only the kept tail is decoded, once, rather than every line as it streams past.
+    stdout = b"\n".join(stdout_tail).decode(errors="replace")
+    stderr = b"\n".join(stderr_tail).decode(errors="replace")
+    if returncode != 0:
+        raise subprocess.CalledProcessError(returncode, cmd, output=stdout, stderr=stderr)
+    return subprocess.CompletedProcess(cmd, returncode, stdout, stderr)
+
+
+# Invariant head of the qiime command line, built once at import.
+_COLLAPSE_PREFIX = ("qiime", "taxa", "collapse")
+
+
+async def taxa_collapse(
     i_table: Path,
     i_taxonomy: Path,
     p_level: int,
@@ -54,27 +287,31 @@ def taxa_collapse(
 
     # --- Command Construction ---
     cmd = [
-        "qiime", "taxa", "collapse",
-        "--i-table", str(i_table),
-        "--i-taxonomy", str(i_taxonomy),
+        *_COLLAPSE_PREFIX,
+        "--i-table", os.fspath(i_table),
+        "--i-taxonomy", os.fspath(i_taxonomy),
         "--p-level", str(p_level),
-        "--o-collapsed-table", str(o_collapsed_table),
+        "--o-collapsed-table", os.fspath(o_collapsed_table),
     ]
 
     if verbose:
         cmd.append("--verbose")
 
-    command_executed = " ".join(cmd)
+    # The warm worker runs the collapse through the Python API, skipping q2cli's
+    # argument parsing and action dispatch; the CLI fallback still uses cmd.
+    call = {
+        "table": os.fspath(i_table),
+        "taxonomy": os.fspath(i_taxonomy),
+        "level": p_level,
+        "output": os.fspath(o_collapsed_table),
+    }
+
+    command_executed = shlex.join(cmd)
     logger.info(f"Executing command: {command_executed}")
 
     # --- Subprocess Execution and Error Handling ---
     try:
-        result = subprocess.run(
-            cmd,
-            capture_output=True,
-            text=True,
-            check=True,
-        )
+        result = await _run(cmd, call)
     except FileNotFoundError:
         # This error occurs if 'qiime' is not in the system's PATH
         return {
@@ -105,5 +342,55 @@ def taxa_collapse(
         }
     }
 
+
+# Registered without the decorator so that taxa_collapse_batch can await
+# the coroutine itself, whatever fastmcp's tool() returns.
+mcp.tool()(taxa_collapse)
+
+
+@mcp.tool()
+async def taxa_collapse_batch(
+    i_tables: List[Path],
+    i_taxonomy: Path,
+    p_level: int,
+    o_collapsed_tables: List[Path],
+    verbose: bool = False,
+) -> List[dict]:
+    """
+    Collapse many feature tables against one taxonomy at the same level.
+
+    The tables are collapsed concurrently on up to QIIME_MCP_CONCURRENCY
+    lanes (default 4). Each lane runs its tables one after another inside
+    one warm QIIME 2 worker, so the interpreter and plugin start-up is paid
+    once per lane rather than once per table.
+
+    Args:
+        i_tables (List[Path]): Paths to the input feature table artifacts (.qza).
+        i_taxonomy (Path): Path to the taxonomy artifact (.qza) shared by all tables.
+        p_level (int): The taxonomic level at which the features should be collapsed.
+        o_collapsed_tables (List[Path]): Output paths, one per input table.
+        verbose (bool): If True, display verbose output for every table.
+                        Defaults to False.
+
+    Returns:
+        List[dict]: One `taxa_collapse` result per table, in input order. A
+                    table whose run raised is reported as a dict with an
+                    "error" key.
+    """
+    if len(i_tables) != len(o_collapsed_tables):
+        raise ValueError("i_tables and o_collapsed_tables must have the same length.")
+
+    async def run_job(job: Tuple[Path, Path]) -> dict:
+        i_table, o_collapsed_table = job
+        try:
+            return await taxa_collapse(i_table, i_taxonomy, p_level, o_collapsed_table, verbose)
+        except Exception as e:
+            return {"i_table": str(i_table), "error": str(e)}
+
+    return await _fan_out(list(zip(i_tables, o_collapsed_tables)), run_job)
+
+
 if __name__ == '__main__':
+    # Configure root logging only when run as a server, not on import.
+    logging.basicConfig(level=logging.INFO)
     mcp.run()
\ No newline at end of file
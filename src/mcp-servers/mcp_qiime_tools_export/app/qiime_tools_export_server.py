@@ -1,22 +1,258 @@
+import asyncio
+import contextlib
+import contextvars
+import json
+import os
+import shlex
 import subprocess
+import sys
 import logging
+from collections import deque
 from pathlib import Path
-from typing import Optional, List, Dict, Any
+from typing import Optional, List, Dict, Any, Awaitable, Callable, Iterator, Tuple
 
 from fastmcp import FastMCP
 
 # Initialize the MCP application
 mcp = FastMCP()
 
-# Setup logging
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-@mcp.tool()
-def tools_export(
+# Only the last _TAIL_LINES lines of each output stream are kept in memory.
+_TAIL_LINES = 2000
+
+
+async def _drain(stream: asyncio.StreamReader, tail: deque) -> None:
+    """Consume a subprocess stream, keeping its last raw lines in tail for _run to decode."""
+    async for line in stream:
+        tail.append(line.rstrip(b"\n"))
+
+
+# Source of the long-lived workers: each pays the qiime2/q2cli import and plugin
+# discovery once, then runs newline-delimited JSON requests through q2cli.
+_WORKER_SOURCE = r'''
+import contextlib, io, json, os, sys
+TAIL_LINES = int(sys.argv[1])
+protocol = os.fdopen(os.dup(1), "w")
+os.dup2(2, 1)
+from qiime2.sdk import PluginManager
+from q2cli.commands import RootCommand
+PluginManager()
+root = RootCommand()
+protocol.write(json.dumps({"ready": True}) + "\n")
+protocol.flush()
+for line in sys.stdin:
+    argv = json.loads(line)["argv"]
+    out, err = io.StringIO(), io.StringIO()
+    with contextlib.redirect_stdout(out), contextlib.redirect_stderr(err):
+        try:
+            rc = root.main(args=argv, prog_name="qiime", standalone_mode=False)
+            rc = rc if isinstance(rc, int) else 0
+        except SystemExit as exc:
+            rc = exc.code if isinstance(exc.code, int) else 1
+        except Exception as exc:
+            print(exc, file=sys.stderr)
+            rc = getattr(exc, "exit_code", 1)
+    tails = {name: "\n".join(buf.getvalue().splitlines()[-TAIL_LINES:]) for name, buf in (("stdout", out), ("stderr", err))}
+    protocol.write(json.dumps({"ok": rc == 0, "returncode": rc, **tails}) + "\n")
+    protocol.flush()
+'''
+
+# Pool of warm workers, created on first use; a slot holds None until its worker is started.
+# There is always at least one slot, so waiting for a worker cannot hang; set
+# QIIME_MCP_WORKER=0 to turn the workers off.
+_WORKER_COUNT = max(1, int(os.environ.get("QIIME_MCP_WORKERS", "2")))
+_worker_pool: Optional[asyncio.Queue] = None
+_worker_disabled = os.environ.get("QIIME_MCP_WORKER", "1") == "0"
+
+
+async def _start_worker() -> Optional[asyncio.subprocess.Process]:
+    """Spawn a warm worker and wait for its handshake; None if qiime2 cannot load."""
+    process = await asyncio.create_subprocess_exec(
+        sys.executable, "-c", _WORKER_SOURCE, str(_TAIL_LINES),
+        stdin=asyncio.subprocess.PIPE, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.DEVNULL,
+        limit=1 << 24,
+    )
+    if await process.stdout.readline():
+        return process
+    await process.wait()
+    return None
+
+
+# Set by _batch_worker so that every command of a batch runs in the same warm worker.
+_pinned_worker: contextvars.ContextVar = contextvars.ContextVar("_pinned_worker", default=None)
+
+
+def _pool() -> asyncio.Queue:
+    """The worker pool, with one empty slot per allowed worker on first use."""
+    global _worker_pool
+    if _worker_pool is None:
+        _worker_pool = asyncio.Queue()
+        for _ in range(_WORKER_COUNT):
+            _worker_pool.put_nowait(None)
+    return _worker_pool
+
+
+async def _exchange(worker: asyncio.subprocess.Process, cmd: List[str]) -> Optional[subprocess.CompletedProcess]:
+    """Run cmd in worker; None, after killing it, if the worker has died or the call is cancelled."""
+    try:
+        worker.stdin.write((json.dumps({"argv": cmd[1:]}) + "\n").encode())
+        await worker.stdin.drain()
+        reply = await worker.stdout.readline()
+    except (OSError, ValueError):
+        reply = b""
+    except asyncio.CancelledError:
+        # The worker may still be running the abandoned command, so it cannot be reused.
+        with contextlib.suppress(ProcessLookupError):
+            worker.kill()
+        raise
+    if not reply:
+        with contextlib.suppress(ProcessLookupError):
+            worker.kill()
+        await worker.wait()
+        return None
+    reply = json.loads(reply)
+    return subprocess.CompletedProcess(cmd, reply["returncode"], reply["stdout"], reply["stderr"])
+
+
+async def _worker_call(cmd: List[str]) -> Optional[subprocess.CompletedProcess]:
+    """Run a qiime command in the batch's pinned worker, or pin an idle one for this call.
+
+    Returns None when workers are disabled, all busy or the chosen one has
+    died, in which case the caller falls back to the qiime CLI.
+    """
+    if _worker_disabled or cmd[0] != "qiime":
+        return None
+    pinned = _pinned_worker.get()
+    if pinned is not None:
+        return None if pinned.returncode is not None else await _exchange(pinned, cmd)
+    async with _batch_worker(wait=False):
+        worker = _pinned_worker.get()
+        return None if worker is None else await _exchange(worker, cmd)
+
+
+@contextlib.asynccontextmanager
+async def _batch_worker(wait: bool = True):
+    """Pin one warm worker for the commands run inside the block.
+
+    With wait=False the block runs unpinned, on whatever worker or CLI
+    _worker_call finds, instead of waiting for a worker to become idle.
+    _worker_call also uses it, with wait=False, to pin a worker for a
+    single command.
+    """
+    global _worker_disabled
+    if _worker_disabled:
+        yield
+        return
+    try:
+        worker = await _pool().get() if wait else _pool().get_nowait()
+    except asyncio.QueueEmpty:
+        yield
+        return
+    token = None
+    try:
+        if worker is None or worker.returncode is not None:
+            worker = await _start_worker()
+            if worker is None:
+                _worker_disabled = True
+        if worker is not None:
+            token = _pinned_worker.set(worker)
+        yield
+    finally:
+        if token is not None:
+            _pinned_worker.reset(token)
+        _pool().put_nowait(worker)
+
+
+# Batch jobs run on up to _CONCURRENCY lanes; _qiime_slots caps jobs in flight across all batches.
+_CONCURRENCY = max(1, int(os.environ.get("QIIME_MCP_CONCURRENCY", "4")))
+_qiime_slots = asyncio.Semaphore(_CONCURRENCY)
+
+
+async def _fan_out(jobs: List[Any], run_job: Callable[[Any], Awaitable[Any]]) -> List[Any]:
+    """Await run_job for every job concurrently on up to _CONCURRENCY lanes, keeping input order.
+
+    Each lane pins its own warm worker; only the first waits for one to
+    become idle, the others fall back to unpinned runs.
+    """
+    results: List[Any] = [None] * len(jobs)
+    pending = iter(enumerate(jobs))
+
+    async def lane(wait: bool) -> None:
+        async with _batch_worker(wait):
+            for index, job in pending:
+                async with _qiime_slots:
+                    results[index] = await run_job(job)
+
+    await asyncio.gather(*(lane(n == 0) for n in range(min(_CONCURRENCY, len(jobs)))))
+    return results
+
+
+async def _run(cmd: List[str]) -> subprocess.CompletedProcess:
+    """Run cmd without blocking the event loop, raising CalledProcessError on failure.
+
+    A warm worker from the pool runs the command when one is idle; otherwise
+    the qiime CLI is spawned. Only the last _TAIL_LINES lines of stdout and
+    stderr are kept.
+    """
+    result = await _worker_call(cmd)
+    if result is not None:
+        result.check_returncode()
+        return result
+    process = await asyncio.create_subprocess_exec(
+        *cmd, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE, limit=1 << 20
+    )
+    stdout_tail: deque = deque(maxlen=_TAIL_LINES)
+    stderr_tail: deque = deque(maxlen=_TAIL_LINES)
+    try:
+        await asyncio.gather(_drain(process.stdout, stdout_tail), _drain(process.stderr, stderr_tail))
+        returncode = await process.wait()
+    except asyncio.CancelledError:
+        process.kill()
+        raise
+    # Only the kept tail is decoded, once, rather than every line as it streams past.
+    stdout = b"\n".join(stdout_tail).decode(errors="replace")
+    stderr = b"\n".join(stderr_tail).decode(errors="replace")
+    if returncode != 0:
+        raise subprocess.CalledProcessError(returncode, cmd, output=stdout, stderr=stderr)
+    return subprocess.CompletedProcess(cmd, returncode, stdout, stderr)
+
+
+def _walk_files(root: str) -> Iterator[str]:
+    """Yield the regular files under root using scandir's cached entry types, without extra stats."""
+    stack = [root]
+    while stack:
+        try:
+            with os.scandir(stack.pop()) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(entry.path)
+                    elif entry.is_file(follow_symlinks=False):
+                        yield entry.path
+        except (FileNotFoundError, NotADirectoryError):
+            continue
+
+
+def _list_exported(output_path: Path, max_files: Optional[int] = None) -> Tuple[List[str], int]:
+    """File paths under output_path, at most max_files of them (all when None), and the total file count."""
+    listed: List[str] = []
+    count = 0
+    for path in _walk_files(os.fspath(output_path)):
+        if max_files is None or count < max_files:
+            listed.append(path)
+        count += 1
+    return listed, count
+
+
+# Invariant head of the qiime command line, built once at import.
+_EXPORT_PREFIX = ("qiime", "tools", "export")
+
+
+async def tools_export(
     input_path: Path,
     output_path: Path,
     output_format: Optional[str] = None,
+    max_files: Optional[int] = None,
 ) -> Dict[str, Any]:
     """
     Export a QIIME 2 Artifact (.qza) or Visualization (.qzv) to a directory.
@@ -31,6 +267,9 @@ def tools_export(
                      The directory will be created if it does not exist.
         output_format: The specific format to export the data to. This is only
                        necessary if the artifact supports multiple export formats.
+        max_files: List at most this many exported files in `exported_files`.
+                   Lists all of them by default; `exported_file_count` is
+                   always the total.
 
     Returns:
         A dictionary containing the execution details, including the command,
@@ -41,19 +280,19 @@ def tools_export(
         raise FileNotFoundError(f"Input file does not exist: {input_path}")
     if not input_path.is_file():
         raise ValueError(f"Input path must be a file, not a directory: {input_path}")
+    if max_files is not None and max_files < 0:
+        raise ValueError("max_files must be a non-negative integer.")
 
     # Ensure the parent directory for the output exists, as QIIME 2 will create the final directory.
     output_path.parent.mkdir(parents=True, exist_ok=True)
 
     # --- Command Construction ---
     cmd = [
-        "qiime",
-        "tools",
-        "export",
+        *_EXPORT_PREFIX,
         "--input-path",
-        str(input_path),
+        os.fspath(input_path),
         "--output-path",
-        str(output_path),
+        os.fspath(output_path),
     ]
 
     if output_format:
@@ -61,21 +300,16 @@ def tools_export(
             raise ValueError("output_format cannot be an empty string.")
         cmd.extend(["--output-format", output_format])
 
-    command_str = " ".join(cmd)
+    command_str = shlex.join(cmd)
     logger.info(f"Executing command: {command_str}")
 
     # --- Subprocess Execution and Error Handling ---
     try:
-        result = subprocess.run(
-            cmd,
-            capture_output=True,
-            text=True,
-            check=True,
-        )
+        result = await _run(cmd)
 
         # --- Structured Result Return (Success) ---
-        # The primary output is the directory itself. We can list the files within it.
-        exported_files = [str(p) for p in output_path.rglob('*') if p.is_file()]
+        # The primary output is the directory itself. We also list the files within it.
+        exported_files, exported_file_count = await asyncio.to_thread(_list_exported, output_path, max_files)
 
         return {
             "command_executed": command_str,
@@ -83,6 +317,7 @@ def tools_export(
             "stderr": result.stderr,
             "output_directory": str(output_path),
             "exported_files": exported_files,
+            "exported_file_count": exported_file_count,
         }
 
     except FileNotFoundError:
@@ -104,5 +339,53 @@ def tools_export(
             "exported_files": [],
         }
 
+
+# Registered without the decorator so that tools_export_batch can await
+# the coroutine itself, whatever fastmcp's tool() returns.
+mcp.tool()(tools_export)
+
+
+@mcp.tool()
+async def tools_export_batch(
+    input_paths: List[Path],
+    output_paths: List[Path],
+    output_format: Optional[str] = None,
+    max_files: Optional[int] = None,
+) -> List[Dict[str, Any]]:
+    """
+    Export many QIIME 2 Artifacts or Visualizations to directories.
+
+    The exports run concurrently on up to QIIME_MCP_CONCURRENCY lanes
+    (default 4). Each lane runs its inputs one after another inside one
+    warm QIIME 2 worker, so the interpreter and plugin start-up is paid
+    once per lane rather than once per input.
+
+    Args:
+        input_paths: Paths to the QIIME 2 Artifacts (.qza) or Visualizations
+                     (.qzv) to be exported.
+        output_paths: Output directories, one per input path.
+        output_format: The format to export every input to, if they support
+                       more than one.
+        max_files: Passed to tools_export for every input.
+
+    Returns:
+        A list with one tools_export result per input, in input order. An
+        export that raised is reported as a dictionary with an "error" key.
+    """
+    if len(input_paths) != len(output_paths):
+        raise ValueError("input_paths and output_paths must have the same length.")
+
+    async def run_job(job: Tuple[Path, Path]) -> Dict[str, Any]:
+        input_path, output_path = job
+        try:
+            return await tools_export(input_path, output_path, output_format, max_files)
+        except Exception as e:
+            return {"input_path": str(input_path), "error": str(e)}
+
+    return await _fan_out(list(zip(input_paths, output_paths)), run_job)
+
+
 if __name__ == '__main__':
+    # Configure root logging only when run as a server, not on import.
+    logging.basicConfig(level=logging.INFO)
     mcp.run()
\ No newline at end of file
@@ -1,22 +1,214 @@
+import contextlib
+import json
+import os
+import shlex
+import stat
 import subprocess
+import sys
 import tempfile
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import Literal
+from typing import Annotated, Dict, List, Literal, Optional
 
 from fastmcp import FastMCP
+from pydantic import Field
 
 mcp = FastMCP()
 
 
+# Source of the long-lived worker: it pays the qiime2/q2cli import and plugin
+# discovery once, then runs newline-delimited JSON requests through q2cli.
+_WORKER_SOURCE = r'''
+import json, os, sys, tempfile
+protocol = os.fdopen(os.dup(1), "w")
+os.dup2(2, 1)
+from qiime2.sdk import PluginManager
+from q2cli.commands import RootCommand
+PluginManager()
+root = RootCommand()
+protocol.write(json.dumps({"ready": True}) + "\n")
+protocol.flush()
+saved = os.dup(1), os.dup(2)
+for line in sys.stdin:
+    argv = json.loads(line)["argv"]
+    # vsearch runs as a child process that inherits fds 1 and 2, so capture
+    # at the fd level rather than by swapping sys.stdout/sys.stderr.
+    with tempfile.TemporaryFile() as out, tempfile.TemporaryFile() as err:
+        sys.stdout.flush()
+        sys.stderr.flush()
+        os.dup2(out.fileno(), 1)
+        os.dup2(err.fileno(), 2)
+        try:
+            rc = root.main(args=argv, prog_name="qiime", standalone_mode=False)
+            rc = rc if isinstance(rc, int) else 0
+        except SystemExit as exc:
+            rc = exc.code if isinstance(exc.code, int) else 1
+        except Exception as exc:
+            print(exc, file=sys.stderr)
+            rc = getattr(exc, "exit_code", 1)
+        finally:
+            sys.stdout.flush()
+            sys.stderr.flush()
+            os.dup2(saved[0], 1)
+            os.dup2(saved[1], 2)
+        out.seek(0)
+        err.seek(0)
+        stdout = out.read().decode(errors="replace")
+        stderr = err.read().decode(errors="replace")
+    protocol.write(json.dumps({"ok": rc == 0, "returncode": rc, "stdout": stdout, "stderr": stderr}) + "\n")
+    protocol.flush()
+'''
+
+# Environment for the worker and the qiime CLI, built once: the server's own,
+# plus a headless matplotlib backend and no .pyc writes into the conda env.
+_QIIME_ENV = {**os.environ, "MPLBACKEND": "Agg", "PYTHONDONTWRITEBYTECODE": "1"}
+
+_worker: Optional[subprocess.Popen] = None
+_worker_lock = threading.Lock()
+_worker_disabled = os.environ.get("QIIME_MCP_WORKER", "1") == "0"
+
+
+def _start_worker() -> Optional[subprocess.Popen]:
+    """Spawn the warm worker and wait for its handshake; None if qiime2 cannot load."""
+    process = subprocess.Popen(
+        [sys.executable, "-c", _WORKER_SOURCE],
+        env=_QIIME_ENV,
+        stdin=subprocess.PIPE,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL,
+        text=True,
+        bufsize=1,
+    )
+    if process.stdout.readline():
+        return process
+    process.wait()
+    return None
+
+
+def _worker_call(cmd: List[str]) -> Optional[subprocess.CompletedProcess]:
+    """Run a qiime command in the shared warm worker.
+
+    Returns None when the worker is disabled, busy with another call or has
+    died, in which case the caller falls back to the qiime CLI.
+    """
+    global _worker, _worker_disabled
+    if _worker_disabled or cmd[0] != "qiime" or not _worker_lock.acquire(blocking=False):
+        return None
+    try:
+        if _worker is None or _worker.poll() is not None:
+            _worker = _start_worker()
+            if _worker is None:
+                _worker_disabled = True
+                return None
+        try:
+            _worker.stdin.write(json.dumps({"argv": cmd[1:]}) + "\n")
+            _worker.stdin.flush()
+            reply = _worker.stdout.readline()
+        except OSError:
+            reply = ""
+        if not reply:
+            _worker.kill()
+            _worker = None
+            return None
+    finally:
+        _worker_lock.release()
+    reply = json.loads(reply)
+    return subprocess.CompletedProcess(cmd, reply["returncode"], reply["stdout"], reply["stderr"])
+
+
+# CLI output is streamed line by line and only the most recent lines are kept.
+_TAIL_LINES = 4096
+
+
+def _drain(pipe, tail: deque, tee=None) -> None:
+    """Read a child pipe to EOF, keeping the last lines in tail and copying every line to tee."""
+    for line in iter(pipe.readline, b""):
+        tail.append(line)
+        if tee is not None:
+            tee.write(line)
+    pipe.close()
+
+
+def _run(cmd: List[str], stderr_file: Optional[Path] = None) -> subprocess.CompletedProcess:
+    """Run cmd to completion in the warm worker or the qiime CLI, raising CalledProcessError on failure.
+
+    stdout/stderr hold the last _TAIL_LINES lines of the CLI's output; the
+    full stderr is also written to stderr_file when one is given.
+    """
+    result = _worker_call(cmd)
+    if result is not None:
+        if stderr_file is not None:
+            stderr_file.write_text(result.stderr)
+        result.stdout = "".join(result.stdout.splitlines(keepends=True)[-_TAIL_LINES:])
+        result.stderr = "".join(result.stderr.splitlines(keepends=True)[-_TAIL_LINES:])
+        result.check_returncode()
+        return result
+    # The CLI's output is read as bytes and decoded once, not through a text wrapper.
+    process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=_QIIME_ENV)
+    stdout_tail: deque = deque(maxlen=_TAIL_LINES)
+    stderr_tail: deque = deque(maxlen=_TAIL_LINES)
+    with open(stderr_file, "wb") if stderr_file is not None else contextlib.nullcontext() as tee:
+        readers = [
+            threading.Thread(target=_drain, args=(process.stdout, stdout_tail), daemon=True),
+            threading.Thread(target=_drain, args=(process.stderr, stderr_tail, tee), daemon=True),
+        ]
+        for reader in readers:
+            reader.start()
+        returncode = process.wait()
+        for reader in readers:
+            reader.join()
+    stdout = b"".join(stdout_tail).decode(errors="replace")
+    stderr = b"".join(stderr_tail).decode(errors="replace")
+    if returncode != 0:
+        raise subprocess.CalledProcessError(returncode, cmd, output=stdout, stderr=stderr)
+    return subprocess.CompletedProcess(cmd, returncode, stdout, stderr)
+
+
+def _is_regular_file(path: Path) -> bool:
+    """Whether path is a regular file, from a single os.stat."""
+    try:
+        return stat.S_ISREG(os.stat(path).st_mode)
+    except OSError:
+        return False
+
+
+def _require_files(inputs: Dict[str, Path]) -> None:
+    """Raise FileNotFoundError for the first input that is not a file, statting them concurrently."""
+    with ThreadPoolExecutor(max_workers=len(inputs)) as executor:
+        found = list(executor.map(_is_regular_file, inputs.values()))
+    for (label, path), is_file in zip(inputs.items(), found):
+        if not is_file:
+            raise FileNotFoundError(f"{label} file not found: {path}")
+
+
+# Fixed argv of the tool, with None slots for the per-call values filled in order.
+_CLOSED_REF_TEMPLATE = (
+    "qiime", "vsearch", "cluster-features-closed-reference",
+    "--i-sequences", None,
+    "--i-table", None,
+    "--i-reference-sequences", None,
+    "--p-perc-identity", None,
+    "--p-strand", None,
+    "--p-threads", None,
+    "--o-clustered-table", None,
+    "--o-clustered-sequences", None,
+    "--o-unmatched-sequences", None,
+)
+_CLOSED_REF_SLOTS = tuple(i for i, arg in enumerate(_CLOSED_REF_TEMPLATE) if arg is None)
+
+
 @mcp.tool()
 def vsearch_cluster_features_closed_reference(
     sequences: Path,
     table: Path,
     reference_sequences: Path,
-    perc_identity: float,
+    perc_identity: Annotated[float, Field(ge=0.0, le=1.0)],
     strand: Literal["both", "plus"] = "plus",
     threads: int = 1,
     verbose: bool = False,
+    stream_to_file: Optional[Path] = None,
 ):
     """
     Performs closed-reference OTU clustering using the vsearch algorithm.
@@ -41,6 +233,9 @@ def vsearch_cluster_features_closed_reference(
         The number of threads to use for computation. Defaults to 1.
     verbose : bool
         Display verbose output during command execution. Defaults to False.
+    stream_to_file : Optional[Path]
+        File to write the command's full stderr to; the returned stdout and
+        stderr only hold their last lines. Defaults to None.
 
     Returns
     -------
@@ -52,67 +247,43 @@ def vsearch_cluster_features_closed_reference(
         - 'unmatched_sequences': The sequences that failed to match the reference.
     """
     # --- Input Validation ---
-    if not sequences.is_file():
-        raise FileNotFoundError(f"Input sequences file not found: {sequences}")
-    if not table.is_file():
-        raise FileNotFoundError(f"Input table file not found: {table}")
-    if not reference_sequences.is_file():
-        raise FileNotFoundError(
-            f"Input reference sequences file not found: {reference_sequences}"
-        )
-
-    if not (0.0 <= perc_identity <= 1.0):
-        raise ValueError("perc_identity must be between 0.0 and 1.0.")
+    # perc_identity and strand are checked by the tool's argument schema.
     if threads <= 0:
         raise ValueError("threads must be a positive integer.")
+    _require_files({
+        "Input sequences": sequences,
+        "Input table": table,
+        "Input reference sequences": reference_sequences,
+    })
 
     with tempfile.TemporaryDirectory() as temp_dir:
-        output_path = Path(temp_dir)
-        clustered_table = output_path / "clustered-table.qza"
-        clustered_sequences = output_path / "clustered-sequences.qza"
-        unmatched_sequences = output_path / "unmatched-sequences.qza"
+        clustered_table = os.path.join(temp_dir, "clustered-table.qza")
+        clustered_sequences = os.path.join(temp_dir, "clustered-sequences.qza")
+        unmatched_sequences = os.path.join(temp_dir, "unmatched-sequences.qza")
 
         # --- Command Construction ---
-        cmd = [
-            "qiime",
-            "vsearch",
-            "cluster-features-closed-reference",
-            "--i-sequences",
-            str(sequences),
-            "--i-table",
-            str(table),
-            "--i-reference-sequences",
-            str(reference_sequences),
-            "--p-perc-identity",
-            str(perc_identity),
-            "--p-strand",
-            strand,
-            "--p-threads",
-            str(threads),
-            "--o-clustered-table",
-            str(clustered_table),
-            "--o-clustered-sequences",
-            str(clustered_sequences),
-            "--o-unmatched-sequences",
-            str(unmatched_sequences),
-        ]
+        cmd = list(_CLOSED_REF_TEMPLATE)
+        values = (
+            os.fspath(sequences), os.fspath(table), os.fspath(reference_sequences),
+            str(perc_identity), strand, str(threads),
+            clustered_table, clustered_sequences, unmatched_sequences,
+        )
+        for slot, value in zip(_CLOSED_REF_SLOTS, values):
+            cmd[slot] = value
 
         if verbose:
             cmd.append("--verbose")
 
+        command_executed = shlex.join(cmd)
+
         # --- Subprocess Execution ---
         try:
-            process = subprocess.run(
-                cmd,
-                check=True,
-                capture_output=True,
-                text=True,
-            )
+            process = _run(cmd, stream_to_file)
             stdout = process.stdout
             stderr = process.stderr
         except subprocess.CalledProcessError as e:
             return {
-                "command_executed": " ".join(cmd),
+                "command_executed": command_executed,
                 "stdout": e.stdout,
                 "stderr": e.stderr,
                 "return_code": e.returncode,
@@ -121,13 +292,13 @@ def vsearch_cluster_features_closed_reference(
 
         # --- Return Structured Output ---
         return {
-            "command_executed": " ".join(cmd),
+            "command_executed": command_executed,
             "stdout": stdout,
             "stderr": stderr,
             "output_files": {
-                "clustered_table": str(clustered_table),
-                "clustered_sequences": str(clustered_sequences),
-                "unmatched_sequences": str(unmatched_sequences),
+                "clustered_table": clustered_table,
+                "clustered_sequences": clustered_sequences,
+                "unmatched_sequences": unmatched_sequences,
             },
         }
 
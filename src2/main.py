@@ -1,56 +1,159 @@
-import os
 import argparse
+import asyncio
+import json
+import time
+from functools import partial
+from skill_batch import submit_batch, collect_batch
 from skill_converter import BioinfoSkillConverter
 from pathlib import Path
 
+# Retries after the first attempt, and the backoff before each, doubling from
+# RETRY_BASE_DELAY seconds up to RETRY_MAX_DELAY.
+MAX_RETRIES = 5
+RETRY_BASE_DELAY = 1.0
+RETRY_MAX_DELAY = 30.0
+
 
 def convert_skill(tool_name, manual, run_help_command, model="openai",
-                  author="BioinfoMCP", license_name="BSD-3-Clause"):
-    """Run the skill converter with retry logic."""
+                  author="BioinfoMCP", license_name="BSD-3-Clause", max_retries=MAX_RETRIES,
+                  force_refresh=False):
+    """Run the skill converter, retrying up to max_retries times with exponential backoff.
+
+    force_refresh bypasses the converter's cache of manuals and replies.
+    """
     converter = BioinfoSkillConverter(model=model, author=author, license_name=license_name)
+    regenerate = partial(converter.autogenerate_skill, tool_name, manual, run_help_command,
+                         force_refresh=force_refresh)
 
-    result = converter.autogenerate_skill(tool_name, manual, run_help_command)
+    result = regenerate()
 
-    while not result[0]:
+    for attempt in range(max_retries):
+        if result[0]:
+            return result[2]
+        time.sleep(min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** attempt))
         if result[2] is None or not any(result[2].values()):
             # No usable content at all, regenerate from scratch
-            print(f"[Retry] No content found, regenerating...")
-            result = converter.autogenerate_skill(tool_name, manual, run_help_command)
+            print(f"[Retry {attempt + 1}/{max_retries}] No content found, regenerating...")
+            retry = regenerate
         else:
             # Has partial content, refine based on error
-            print(f"[Retry] Refining: {result[1]}")
-            result = converter.refine_after_feedback(
-                tool_name, contents=result[2], error_message=result[1]
-            )
+            print(f"[Retry {attempt + 1}/{max_retries}] Refining: {result[1]}")
+            retry = partial(converter.refine_after_feedback,
+                            tool_name, contents=result[2], error_message=result[1])
+        result = retry()
 
+    if not result[0]:
+        raise RuntimeError(f"Skill conversion failed after {max_retries} retries: {result[1]}")
     return result[2]
 
 
+async def convert_skill_async(tool_name, manual, run_help_command, model="openai",
+                              author="BioinfoMCP", license_name="BSD-3-Clause", max_retries=MAX_RETRIES,
+                              initial=None, force_refresh=False):
+    """Async version of convert_skill; LLM requests go through the converter's async client.
+
+    initial, a parse_skill result already obtained for this tool (e.g. from a
+    grouped request), replaces the first generation.
+    """
+    converter = BioinfoSkillConverter(model=model, author=author, license_name=license_name)
+    regenerate = partial(converter.autogenerate_skill_async, tool_name, manual, run_help_command,
+                         force_refresh=force_refresh)
+
+    result = initial if initial is not None else await regenerate()
+
+    for attempt in range(max_retries):
+        if result[0]:
+            return result[2]
+        await asyncio.sleep(min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** attempt))
+        if result[2] is None or not any(result[2].values()):
+            print(f"[{tool_name} retry {attempt + 1}/{max_retries}] No content found, regenerating...")
+            retry = regenerate
+        else:
+            print(f"[{tool_name} retry {attempt + 1}/{max_retries}] Refining: {result[1]}")
+            retry = partial(converter.refine_after_feedback_async,
+                            tool_name, contents=result[2], error_message=result[1])
+        result = await retry()
+
+    if not result[0]:
+        raise RuntimeError(f"Skill conversion failed after {max_retries} retries: {result[1]}")
+    return result[2]
+
+
+async def generate_group(group, run_help_command, model="openai", author="BioinfoMCP",
+                         license_name="BSD-3-Clause"):
+    """First-attempt parse_skill results for a group of batch entries, from one shared LLM request.
+
+    Returns None for every entry if the request itself fails, so that each
+    is then generated on its own.
+    """
+    converter = BioinfoSkillConverter(model=model, author=author, license_name=license_name)
+    try:
+        results = await converter.autogenerate_skills_async(
+            [(entry["name"], entry["manual"]) for entry in group], run_help_command
+        )
+    except Exception as e:
+        print(f"Grouped request for {len(group)} tools failed ({e}); converting them one by one")
+        return [None] * len(group)
+    return [results[entry["name"]] for entry in group]
+
+
+async def convert_batch(batch, output_dir, run_help_command, concurrency=4, group_size=1,
+                        model="openai", author="BioinfoMCP", license_name="BSD-3-Clause",
+                        max_retries=MAX_RETRIES, force_refresh=False):
+    """Convert and write every {"name", "manual"} entry of batch, at most concurrency groups at a time.
+
+    Entries are sent group_size to an LLM request; an entry whose part of
+    the reply fails validation is retried on its own. Returns the skill
+    directory of each entry, or the exception that entry raised, in input
+    order.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    converter_options = dict(model=model, author=author, license_name=license_name)
+
+    async def convert_one(entry, initial):
+        contents = await convert_skill_async(entry["name"], entry["manual"], run_help_command,
+                                             max_retries=max_retries, initial=initial,
+                                             force_refresh=force_refresh, **converter_options)
+        return await asyncio.to_thread(write_skill_files, entry["name"], contents, output_dir)
+
+    async def convert_group(group):
+        async with semaphore:
+            initial = [None] * len(group)
+            if len(group) > 1:
+                initial = await generate_group(group, run_help_command, **converter_options)
+            return await asyncio.gather(*(convert_one(entry, first) for entry, first in zip(group, initial)),
+                                        return_exceptions=True)
+
+    groups = [batch[i:i + group_size] for i in range(0, len(batch), group_size)]
+    results = await asyncio.gather(*(convert_group(group) for group in groups))
+    return [result for group_results in results for result in group_results]
+
+
 def write_skill_files(tool_name, contents, output_dir):
     """Write the skill package files to disk."""
     skill_dir = Path(output_dir) / tool_name
     refs_dir = skill_dir / "references"
     scripts_dir = skill_dir / "scripts"
 
-    os.makedirs(skill_dir, exist_ok=True)
-    os.makedirs(refs_dir, exist_ok=True)
-    os.makedirs(scripts_dir, exist_ok=True)
+    # The two leaf directories cover skill_dir itself
+    refs_dir.mkdir(parents=True, exist_ok=True)
+    scripts_dir.mkdir(parents=True, exist_ok=True)
 
     # Write SKILL.md
-    with open(skill_dir / "SKILL.md", "w") as f:
-        f.write(contents["skill_md"])
-    print(f"  Written: {skill_dir / 'SKILL.md'}")
+    skill_md = skill_dir / "SKILL.md"
+    skill_md.write_text(contents["skill_md"])
+    print(f"  Written: {skill_md}")
 
     # Write reference document
-    with open(refs_dir / f"{tool_name}_reference.md", "w") as f:
-        f.write(contents["reference_md"])
-    print(f"  Written: {refs_dir / f'{tool_name}_reference.md'}")
+    reference_md = refs_dir / f"{tool_name}_reference.md"
+    reference_md.write_text(contents["reference_md"])
+    print(f"  Written: {reference_md}")
 
     # Write example script (only if non-empty)
     if contents["example_script"] and contents["example_script"].strip():
-        with open(scripts_dir / f"{tool_name}_example.py", "w") as f:
-            f.write(contents["example_script"])
-        print(f"  Written: {scripts_dir / f'{tool_name}_example.py'}")
+        example_script = scripts_dir / f"{tool_name}_example.py"
+        example_script.write_text(contents["example_script"])
+        print(f"  Written: {example_script}")
 
     return skill_dir
 
@@ -59,10 +162,20 @@ if __name__ == '__main__':
     parser = argparse.ArgumentParser(
         description="Convert bioinformatics tool documentation into Claude Scientific Skills"
     )
-    parser.add_argument('--name', type=str, required=True,
+    parser.add_argument('--name', type=str,
                         help="Tool name (e.g., qiime_tools_import)")
-    parser.add_argument('--manual', type=str, required=True,
+    parser.add_argument('--manual', type=str,
                         help="Path to help document (PDF or MD file)")
+    parser.add_argument('--batch', type=str,
+                        help="JSON file with a list of {\"name\", \"manual\"} entries to convert concurrently")
+    parser.add_argument('--concurrency', type=int, default=4,
+                        help="Conversions run at once in batch mode (default: 4)")
+    parser.add_argument('--group_size', type=int, default=1,
+                        help="Tools sent together in one LLM request in batch mode (default: 1)")
+    parser.add_argument('--batch_api', action='store_true',
+                        help="Submit --batch as an OpenAI/Azure Batch API job (half price, up to 24h) and print its id")
+    parser.add_argument('--collect_batch', type=str,
+                        help="Batch API job id to wait for; writes the skills it generated")
     parser.add_argument('--run_help_command', type=bool, default=False,
                         help="Run help command instead of reading document")
     parser.add_argument('--output_location', type=str, default='./skills/',
@@ -74,7 +187,68 @@ if __name__ == '__main__':
                         help="Skill author name for YAML frontmatter")
     parser.add_argument('--license', type=str, default='BSD-3-Clause',
                         help="License for YAML frontmatter")
+    parser.add_argument('--max_retries', type=int, default=MAX_RETRIES,
+                        help=f"Retries before giving up on a failing conversion (default: {MAX_RETRIES})")
+    parser.add_argument('--force_refresh', action='store_true',
+                        help="Ignore cached manual text and LLM replies")
     args = parser.parse_args()
+    if args.batch is None and args.collect_batch is None and (args.name is None or args.manual is None):
+        parser.error("--name and --manual are required unless --batch or --collect_batch is given")
+    if args.batch_api and args.batch is None:
+        parser.error("--batch_api requires --batch")
+    if (args.batch_api or args.collect_batch) and args.model == 'gemini':
+        parser.error("the Batch API is only available with --model openai or azure")
+    if args.group_size < 1:
+        parser.error("--group_size must be at least 1")
+
+    options = dict(model=args.model, author=args.author, license_name=args.license,
+                   max_retries=args.max_retries, force_refresh=args.force_refresh)
+
+    # Azure serves batch chat completions without the /v1 prefix
+    batch_url = "/chat/completions" if args.model == 'azure' else "/v1/chat/completions"
+
+    if args.collect_batch is not None:
+        converter = BioinfoSkillConverter(model=args.model, author=args.author, license_name=args.license)
+        results = collect_batch(converter, args.collect_batch)
+
+        print(f"\n{'=='*30}")
+        for tool_name, (ok, error, contents) in results.items():
+            if ok:
+                skill_dir = write_skill_files(tool_name, contents, args.output_location)
+                print(f"SUCCESS: {tool_name} generated at {skill_dir}")
+            else:
+                print(f"FAILED:  {tool_name}: {error}")
+        print(f"{'=='*30}")
+        raise SystemExit(0 if all(result[0] for result in results.values()) else 1)
+
+    if args.batch is not None:
+        with open(args.batch) as f:
+            batch = json.load(f)
+        if args.batch_api:
+            converter = BioinfoSkillConverter(model=args.model, author=args.author, license_name=args.license)
+            batch_id = submit_batch(converter, batch, args.run_help_command, url=batch_url)
+            print(f"Submitted {len(batch)} conversions as batch {batch_id}")
+            print(f"Collect them with: python -m main --collect_batch {batch_id} --model {args.model}")
+            raise SystemExit(0)
+        print(f"{'=='*30}")
+        print(f"Generating {len(batch)} Claude Scientific Skills from: {args.batch}")
+        print(f"Output: {args.output_location}")
+        print(f"Model: {args.model}, concurrency: {args.concurrency}, group size: {args.group_size}")
+        print(f"{'=='*30}")
+
+        results = asyncio.run(convert_batch(
+            batch, args.output_location, args.run_help_command,
+            concurrency=args.concurrency, group_size=args.group_size, **options
+        ))
+
+        print(f"\n{'=='*30}")
+        for entry, result in zip(batch, results):
+            if isinstance(result, Exception):
+                print(f"FAILED:  {entry['name']}: {result}")
+            else:
+                print(f"SUCCESS: {entry['name']} generated at {result}")
+        print(f"{'=='*30}")
+        raise SystemExit(1 if any(isinstance(r, Exception) for r in results) else 0)
 
     print(f"{'=='*30}")
     print(f"Generating Claude Scientific Skill for: {args.name}")
@@ -84,10 +258,7 @@ if __name__ == '__main__':
     print(f"{'=='*30}")
 
     # Run conversion
-    contents = convert_skill(
-        args.name, args.manual, args.run_help_command,
-        model=args.model, author=args.author, license_name=args.license
-    )
+    contents = convert_skill(args.name, args.manual, args.run_help_command, **options)
 
     # Write output files
     skill_dir = write_skill_files(args.name, contents, args.output_location)
@@ -0,0 +1,84 @@
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# Manuals read at once while building a batch. Help commands and Markdown
+# reads overlap; PDF parsing is serialized or farmed out to processes by
+# skill_converter.extract_pdf_pages.
+EXTRACT_WORKERS = 8
+
+# Batch jobs are billed at half the synchronous price in exchange for a
+# completion window of up to a day, so this path suits bulk regeneration.
+COMPLETION_WINDOW = "24h"
+POLL_INTERVAL = 60
+FINAL_STATUSES = ("completed", "failed", "expired", "cancelled")
+
+
+def build_batch_lines(converter, batch, run_help_command, url="/v1/chat/completions"):
+    """Build one Batch API request line per {"name", "manual"} entry, keyed by tool name."""
+    with ThreadPoolExecutor(max_workers=EXTRACT_WORKERS) as executor:
+        all_help_docs = list(executor.map(
+            lambda entry: converter.extract_help_document(entry["name"], entry["manual"], run_help_command),
+            batch,
+        ))
+    lines = []
+    for entry, help_docs in zip(batch, all_help_docs):
+        lines.append({
+            "custom_id": entry["name"],
+            "method": "POST",
+            "url": url,
+            "body": {
+                "model": converter.api_model_name,
+                "messages": converter.build_messages(converter.generate_prompt(entry["name"], help_docs)),
+                "temperature": 0.1,
+            },
+        })
+    return lines
+
+
+def submit_batch(converter, batch, run_help_command, url="/v1/chat/completions"):
+    """Upload the conversion requests of batch as a JSONL file and start a Batch API job.
+
+    Returns the batch id to pass to collect_batch.
+    """
+    lines = build_batch_lines(converter, batch, run_help_command, url=url)
+    payload = "".join(json.dumps(line) + "\n" for line in lines).encode()
+    batch_file = converter.client.files.create(file=("skills_batch.jsonl", payload), purpose="batch")
+    job = converter.client.batches.create(
+        input_file_id=batch_file.id,
+        endpoint=url,
+        completion_window=COMPLETION_WINDOW,
+    )
+    return job.id
+
+
+def collect_batch(converter, batch_id, poll_interval=POLL_INTERVAL):
+    """Wait for a Batch API job and parse every response with parse_skill.
+
+    Returns a dict mapping each tool name to its parse_skill result; a
+    request that failed inside the job gets (0, error, None).
+    """
+    job = converter.client.batches.retrieve(batch_id)
+    while job.status not in FINAL_STATUSES:
+        print(f"Batch {batch_id} is {job.status}, checking again in {poll_interval}s")
+        time.sleep(poll_interval)
+        job = converter.client.batches.retrieve(batch_id)
+    if job.status != "completed":
+        raise RuntimeError(f"Batch {batch_id} ended with status {job.status}")
+
+    results = {}
+    if job.error_file_id:
+        for line in converter.client.files.content(job.error_file_id).text.splitlines():
+            record = json.loads(line)
+            results[record["custom_id"]] = (0, f"Batch request failed: {record.get('error')}", None)
+    if job.output_file_id:
+        for line in converter.client.files.content(job.output_file_id).text.splitlines():
+            record = json.loads(line)
+            response = record.get("response") or {}
+            if response.get("status_code") != 200:
+                error = record.get("error") or response.get("body")
+                results[record["custom_id"]] = (0, f"Batch request failed: {error}", None)
+                continue
+            content = response["body"]["choices"][0]["message"]["content"]
+            results[record["custom_id"]] = converter.parse_skill(content)
+    return results
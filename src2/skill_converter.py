@@ -1,6 +1,17 @@
+import asyncio
+import functools
+import contextlib
+import hashlib
+import mmap
 import os
+import shutil
 import subprocess
 import re
+import tempfile
+import threading
+import weakref
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
 import pymupdf
 from pathlib import Path
 from dotenv import load_dotenv
@@ -9,72 +20,338 @@ from skill_validator import validate_skill_md, validate_reference_md, validate_e
 # Load .env from project root
 load_dotenv(Path(__file__).parent.parent / '.env')
 
+# Read once at import and shared by every converter instance
+SYS_PROMPT = (Path(__file__).parent / 'system_prompt.txt').read_text(encoding='utf-8')
+
+# Delimiters the LLM puts before each block of a skill package, in order.
+SKILL_DELIMITER = "===SKILL.md==="
+REFERENCE_DELIMITER = "===REFERENCE.md==="
+SCRIPT_DELIMITER = "===EXAMPLE_SCRIPT.py==="
+PYTHON_FENCE = "```python\n"
+# Header line before each tool's package in a batched reply
+TOOL_HEADER_RE = re.compile(r'^===TOOL:(.+?)===[ \t]*$', re.MULTILINE)
+
+
+# Other fences a model may wrap the example script in: ``` or ~~~, tagged
+# python, python3, py or untagged, with stray spaces around the tag.
+OTHER_FENCE_RE = re.compile(r'^(```|~~~)[ \t]*(?:python3?|py)?[ \t]*\n(.*?)\n[ \t]*\1', re.MULTILINE | re.DOTALL)
+
+
+def strip_python_fence(script):
+    """The body of the first fenced code block in script, or script itself if there is none.
+
+    The usual ```python fence is found with str.find; other fence styles
+    are only searched for when it is absent, so that a script the model
+    fenced differently does not cost a refinement round.
+    """
+    fence_start = script.find(PYTHON_FENCE)
+    if fence_start != -1:
+        fence_end = script.find("\n```", fence_start + len(PYTHON_FENCE))
+        if fence_end != -1:
+            return script[fence_start + len(PYTHON_FENCE):fence_end]
+    match = OTHER_FENCE_RE.search(script)
+    if match:
+        return match.group(2)
+    return script
+
+
+# Blocks of a skill package in order: contents key, delimiter, validator and
+# the name used in error messages, and what a block-only fix must ensure.
+SKILL_BLOCKS = (
+    ("skill_md", SKILL_DELIMITER, validate_skill_md, "SKILL.md",
+     "1. It has valid YAML frontmatter with name, description, license, context, metadata keys\n"
+     "2. It contains ALL required sections: Overview, When to Use This Skill, Core Capabilities, "
+     "Installation and Setup, Quick Start, Standard Workflow, Common Tasks, Key Parameters, "
+     "Best Practices, Common Pitfalls, Additional Resources, Bundled Resources\n"
+     "3. It contains at least one code block"),
+    ("reference_md", REFERENCE_DELIMITER, validate_reference_md, "Reference",
+     "1. It is not empty and has headers"),
+    ("example_script", SCRIPT_DELIMITER, validate_example_script, "Example script",
+     "1. It has valid Python syntax, inside a single ```python code block"),
+)
+
+
+def text_after(text, delimiter, end_delimiter=None):
+    """The stripped text after the first delimiter, up to the next end_delimiter or the end.
+
+    Returns "" if delimiter does not occur.
+    """
+    start = text.find(delimiter)
+    if start == -1:
+        return ""
+    start += len(delimiter)
+    end = text.find(end_delimiter, start) if end_delimiter else -1
+    return text[start:end if end != -1 else None].strip()
+
+
+def split_blocks(text):
+    """The stripped SKILL.md, REFERENCE.md and EXAMPLE_SCRIPT.py blocks of text.
+
+    Same result as text_after for each block, but each delimiter is
+    searched for once: its first position also ends the block before it
+    whenever the delimiters come in order, which is the normal case.
+    """
+    skill = text.find(SKILL_DELIMITER)
+    reference = text.find(REFERENCE_DELIMITER)
+    script = text.find(SCRIPT_DELIMITER)
+
+    def block(start, delimiter, end, end_delimiter):
+        if start == -1:
+            return ""
+        start += len(delimiter)
+        if end_delimiter and end != -1 and end < start:
+            # An earlier end delimiter does not count; look past the block start
+            end = text.find(end_delimiter, start)
+        return text[start:end if end != -1 else None].strip()
+
+    return (
+        block(skill, SKILL_DELIMITER, reference, REFERENCE_DELIMITER),
+        block(reference, REFERENCE_DELIMITER, script, SCRIPT_DELIMITER),
+        block(script, SCRIPT_DELIMITER, -1, None),
+    )
+
+
+# Plain page text: keep whitespace and clip to the page, but expand ligatures
+# instead of preserving them as single glyphs.
+PDF_TEXT_FLAGS = pymupdf.TEXT_PRESERVE_WHITESPACE | pymupdf.TEXT_MEDIABOX_CLIP
+
+# PyMuPDF does not support use from several threads, so PDF parsing in this
+# process is serialized; manuals of at least PARALLEL_PAGES_MIN pages are
+# split into page ranges read by worker processes instead.
+PDF_LOCK = threading.Lock()
+PARALLEL_PAGES_MIN = 64
+PDF_WORKERS = min(os.cpu_count() or 1, 8)
+
+
+@functools.lru_cache(maxsize=None)
+def pdf_pool():
+    """The worker processes shared by every long manual read in this process.
+
+    Started on first use, so the interpreter start-up and pymupdf import of
+    each spawned worker are paid once per run rather than once per manual.
+    """
+    # spawn, not fork: the caller may have other threads running
+    return ProcessPoolExecutor(max_workers=PDF_WORKERS, mp_context=get_context("spawn"))
+
+
+def extract_page_range(manual_path, start, stop):
+    """Text of pages start to stop - 1 of the PDF at manual_path."""
+    with pymupdf.open(manual_path) as doc:
+        return [doc.load_page(i).get_text("text", flags=PDF_TEXT_FLAGS) for i in range(start, stop)]
+
+
+def extract_pdf_pages(manual_path):
+    """Text of every page of a PDF, read in parallel processes when it is long."""
+    with PDF_LOCK:
+        with pymupdf.open(manual_path) as doc:
+            if doc.page_count < PARALLEL_PAGES_MIN or PDF_WORKERS == 1:
+                return [page.get_text("text", flags=PDF_TEXT_FLAGS) for page in doc]
+            page_count = doc.page_count
+        # Looked up under the lock so concurrent first calls share one pool
+        executor = pdf_pool()
+    step = -(-page_count // PDF_WORKERS)
+    ranges = executor.map(
+        extract_page_range,
+        *zip(*((manual_path, start, min(start + step, page_count)) for start in range(0, page_count, step)))
+    )
+    return [text for page_range in ranges for text in page_range]
+
+
+# Most characters of PDF manual text put in a prompt; longer manuals keep the
+# pages that look like command-line documentation first.
+MANUAL_BUDGET_CHARS = 150_000
+CLI_PAGE_MARKERS = re.compile(r'--\w|[Uu]sage:|OPTIONS|SYNOPSIS')
+
+
+def select_pages(page_texts, budget_chars=MANUAL_BUDGET_CHARS):
+    """The page texts to keep within budget_chars, in page order.
+
+    Everything is kept when it fits. Otherwise pages matching
+    CLI_PAGE_MARKERS are taken first, then the rest, skipping any page
+    that would overrun the budget.
+    """
+    if sum(map(len, page_texts)) <= budget_chars:
+        return page_texts
+    cli_pages = [i for i, text in enumerate(page_texts) if CLI_PAGE_MARKERS.search(text)]
+    other_pages = [i for i, text in enumerate(page_texts) if not CLI_PAGE_MARKERS.search(text)]
+    kept, used = [], 0
+    for i in cli_pages + other_pages:
+        if used + len(page_texts[i]) <= budget_chars:
+            kept.append(i)
+            used += len(page_texts[i])
+    return [page_texts[i] for i in sorted(kept)]
+
+
+@functools.lru_cache(maxsize=None)
+def find_tool(tool_name):
+    """Path of tool_name's executable on PATH, or None; looked up once per process."""
+    return shutil.which(tool_name)
+
+
+# Connection limits of the HTTP pools that every converter's API clients share,
+# so parallel conversions reuse open (TLS) connections instead of each
+# client opening its own.
+HTTP_LIMITS = dict(max_connections=100, max_keepalive_connections=50)
+_async_http_clients = weakref.WeakKeyDictionary()
+
+
+@functools.lru_cache(maxsize=None)
+def shared_http_client():
+    """The blocking HTTP client shared by all converters in this process."""
+    import httpx
+    from openai import DefaultHttpxClient
+    return DefaultHttpxClient(limits=httpx.Limits(**HTTP_LIMITS))
+
+
+def shared_async_http_client():
+    """The async HTTP client shared within the running event loop.
+
+    An async pool cannot outlive the loop its connections were opened in,
+    so outside a loop each caller gets a client of its own.
+    """
+    import httpx
+    from openai import DefaultAsyncHttpxClient
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        return DefaultAsyncHttpxClient(limits=httpx.Limits(**HTTP_LIMITS))
+    client = _async_http_clients.get(loop)
+    if client is None:
+        client = _async_http_clients[loop] = DefaultAsyncHttpxClient(limits=httpx.Limits(**HTTP_LIMITS))
+    return client
+
+
+# Content-addressed cache of extracted manuals and validated LLM replies, so
+# re-running a conversion with unchanged inputs skips the parse and the request.
+CACHE_DIR = Path(os.getenv('BIOINFOMCP_CACHE', Path.home() / '.cache' / 'bioinfomcp'))
+
+
+def cache_key(*parts):
+    """blake2b hex digest over parts (str or bytes-like), unambiguous at part boundaries."""
+    digest = hashlib.blake2b()
+    for part in parts:
+        digest.update(part.encode() if isinstance(part, str) else part)
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+
+def cache_get(kind, key):
+    """Cached text for key, or None on a miss."""
+    try:
+        return (CACHE_DIR / kind / f"{key}.txt").read_text(encoding='utf-8')
+    except (OSError, UnicodeError):
+        return None
+
+
+def cache_put(kind, key, text):
+    """Store text for key atomically; a cache that cannot be written is skipped."""
+    cache_dir = CACHE_DIR / kind
+    tmp_name = None
+    try:
+        cache_dir.mkdir(parents=True, exist_ok=True)
+        with tempfile.NamedTemporaryFile('w', encoding='utf-8', dir=cache_dir, suffix='.tmp', delete=False) as f:
+            tmp_name = f.name
+            f.write(text)
+        os.replace(tmp_name, cache_dir / f"{key}.txt")
+    except (OSError, UnicodeError):
+        if tmp_name is not None:
+            with contextlib.suppress(OSError):
+                os.unlink(tmp_name)
+
 
 class BioinfoSkillConverter():
     def __init__(self, model="openai", author="BioinfoMCP", license_name="BSD-3-Clause"):
-        sys_prompt_path = Path(__file__).parent / 'system_prompt.txt'
-        with open(sys_prompt_path, 'r') as f:
-            self.sys_prompt = f.read()
+        self.sys_prompt = SYS_PROMPT
         self.api_model_name = os.getenv('MODEL_NAME')
         self.author = author
         self.license_name = license_name
 
+        # Each backend gets a blocking client and an asyncio one sharing the
+        # same settings; the async client lets batch conversions overlap.
         if model == "azure":
-            from openai import AzureOpenAI
+            from openai import AzureOpenAI, AsyncAzureOpenAI
             api_subscription_key = os.getenv('AZURE_OPENAI_KEY')
             api_version = os.getenv('AZURE_OPENAI_API_VERSION')
             api_endpoint = os.getenv('AZURE_OPENAI_ENDPOINT')
-            self.client = AzureOpenAI(
+            client_args = dict(
                 api_version=api_version,
                 azure_endpoint=api_endpoint,
                 api_key=api_subscription_key,
             )
+            self.client = AzureOpenAI(**client_args, http_client=shared_http_client())
+            self.async_client = AsyncAzureOpenAI(**client_args, http_client=shared_async_http_client())
 
         elif model == "openai":
-            from openai import OpenAI
+            from openai import OpenAI, AsyncOpenAI
             openai_api_key = os.getenv('OPENAI_API_KEY')
             self.client = OpenAI(
-                api_key=openai_api_key
+                api_key=openai_api_key,
+                http_client=shared_http_client()
+            )
+            self.async_client = AsyncOpenAI(
+                api_key=openai_api_key,
+                http_client=shared_async_http_client()
             )
 
         elif model == "gemini":
-            from openai import OpenAI
+            from openai import OpenAI, AsyncOpenAI
             gemini_api_key = os.getenv('GEMINI_API_KEY')
-            self.client = OpenAI(
+            client_args = dict(
                 api_key=gemini_api_key,
                 base_url="https://generativelanguage.googleapis.com/v1beta/openai/"
             )
+            self.client = OpenAI(**client_args, http_client=shared_http_client())
+            self.async_client = AsyncOpenAI(**client_args, http_client=shared_async_http_client())
 
         print(f"Successfully created a {self.api_model_name} model")
 
-    def is_tool_available(self, tool_name):
-        """Check whether that tool is installed or not"""
-        try:
-            subprocess.run([tool_name, '--version'],
-                           capture_output=True, timeout=20, text=True)
+    def is_tool_available(self, tool_name, verify_runs=False):
+        """Check whether that tool is installed or not.
+
+        A cached PATH lookup; with verify_runs, `tool_name --version` must
+        also start and finish within 5 seconds.
+        """
+        available = find_tool(tool_name) is not None
+        if available and verify_runs:
+            try:
+                subprocess.run([tool_name, '--version'],
+                               capture_output=True, timeout=5)
+            except (OSError, subprocess.TimeoutExpired):
+                available = False
+        if available:
             print(f"{tool_name} is installed")
-            return True
-        except:
+        else:
             print(f"{tool_name} is not installed!")
-            return False
+        return available
 
-    def extract_help_document(self, tool_name, manual, run_help_command=False):
+    def extract_help_document(self, tool_name, manual, run_help_command=False, force_refresh=False):
         """Extract help text from tool or document.
 
-        Supports PDF files and markdown (.md) files.
+        Supports PDF files and markdown (.md) files; PDF text is cut to
+        MANUAL_BUDGET_CHARS with select_pages. Text extracted from a document
+        is cached by a hash of its bytes unless force_refresh is set.
         """
         if not run_help_command:
             manual_path = str(manual)
-            if manual_path.lower().endswith('.md'):
-                with open(manual_path, 'r') as f:
-                    return f.read()
-            else:
-                doc = pymupdf.open(manual_path)
-                manual_content = ""
-                for page in doc:
-                    text = page.get_text()
-                    manual_content += text
-                return manual_content
+            is_markdown = manual_path.lower().endswith('.md')
+            # The file is memory-mapped rather than read: it is hashed, and a
+            # Markdown manual decoded, straight from the mapped pages. An empty
+            # file cannot be mapped.
+            with open(manual_path, 'rb') as f:
+                mapping = (mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                           if os.fstat(f.fileno()).st_size else contextlib.nullcontext(b""))
+                with mapping as manual_bytes:
+                    # The format and budget shape the extracted text, so they are part of the key
+                    key = cache_key(manual_bytes, 'md' if is_markdown else 'pdf', str(MANUAL_BUDGET_CHARS))
+                    cached = None if force_refresh else cache_get('manuals', key)
+                    if cached is not None:
+                        return cached
+                    if is_markdown:
+                        manual_content = str(manual_bytes, 'utf-8')
+            if not is_markdown:
+                manual_content = "".join(select_pages(extract_pdf_pages(manual_path)))
+            cache_put('manuals', key, manual_content)
+            return manual_content
 
         if self.is_tool_available(tool_name):
             try:
@@ -85,24 +362,53 @@ class BioinfoSkillConverter():
                 return None
 
     def generate_prompt(self, tool_name, help_docs):
-        """Generate the prompt for Claude Scientific Skills generation."""
+        """Generate the prompt for Claude Scientific Skills generation.
+
+        The fixed instructions come first and the tool-specific values
+        last, so that requests for different tools share the longest
+        possible prefix for the API's prompt caching.
+        """
         prompt = f"""
-Convert the following bioinformatics tool documentation into a Claude Scientific Skill package.
+Convert the bioinformatics tool documentation given below into a Claude Scientific Skill package.
+
+Generate the complete skill package with all three blocks:
+1. ===SKILL.md=== - The full SKILL.md with YAML frontmatter and all required sections
+2. ===REFERENCE.md=== - Comprehensive parameter reference
+3. ===EXAMPLE_SCRIPT.py=== - A working Python example script
+
+Make sure to extract ALL parameters and cover ALL subcommands from the documentation.
 
-Tool Name: {tool_name}
 Skill Author: {self.author}
 License: {self.license_name}
+Tool Name: {tool_name}
 
 Help Document:
 {help_docs}
+"""
+        return prompt
 
-Generate the complete skill package with all three blocks:
+    def generate_batched_prompt(self, tool_docs):
+        """Generate one prompt asking for the skill packages of several tools.
+
+        tool_docs is a list of (tool_name, help_docs) pairs. As in
+        generate_prompt, the tool-specific part comes last.
+        """
+        sections = "".join(f"\n===TOOL:{name}===\n{docs}\n" for name, docs in tool_docs)
+        prompt = f"""
+Convert the documentation of each bioinformatics tool given below into its own Claude Scientific Skill package.
+
+For every tool, in the order given, output its ===TOOL:<tool name>=== line followed by that tool's complete skill package with all three blocks:
 1. ===SKILL.md=== - The full SKILL.md with YAML frontmatter and all required sections
 2. ===REFERENCE.md=== - Comprehensive parameter reference
 3. ===EXAMPLE_SCRIPT.py=== - A working Python example script
 
-Make sure to extract ALL parameters and cover ALL subcommands from the documentation.
-"""
+Make sure to extract ALL parameters and cover ALL subcommands from each tool's documentation, and never mix content between tools.
+
+Skill Author: {self.author}
+License: {self.license_name}
+
+Help Documents for {len(tool_docs)} tools (each introduced by a ===TOOL:<tool name>=== line):
+{sections}"""
         return prompt
 
     def parse_skill(self, llm_response):
@@ -113,61 +419,124 @@ Make sure to extract ALL parameters and cover ALL subcommands from the documenta
 
         Returns (success_int, error_message_or_none, dict_of_contents).
         """
-        skill_md = ""
-        reference_md = ""
-        example_script = ""
-
-        # Extract SKILL.md block
-        skill_match = re.search(
-            r'===SKILL\.md===(.*?)(?:===REFERENCE\.md===|$)',
-            llm_response, re.DOTALL
-        )
-        if skill_match:
-            skill_md = skill_match.group(1).strip()
-
-        # Extract REFERENCE.md block
-        ref_match = re.search(
-            r'===REFERENCE\.md===(.*?)(?:===EXAMPLE_SCRIPT\.py===|$)',
-            llm_response, re.DOTALL
-        )
-        if ref_match:
-            reference_md = ref_match.group(1).strip()
-
-        # Extract EXAMPLE_SCRIPT.py block
-        script_match = re.search(
-            r'===EXAMPLE_SCRIPT\.py===(.*?)$',
-            llm_response, re.DOTALL
-        )
-        if script_match:
-            example_script = script_match.group(1).strip()
-            # Remove markdown code fences if present
-            code_block = re.findall(r'```python\n(.*?)\n```', example_script, re.DOTALL)
-            if code_block:
-                example_script = code_block[0]
+        # Each block runs from its delimiter to the next one, located with str.find
+        skill_md, reference_md, example_script = split_blocks(llm_response)
+        example_script = strip_python_fence(example_script)
 
         contents = {
             "skill_md": skill_md,
             "reference_md": reference_md,
             "example_script": example_script,
         }
+        return self.check_skill(contents)
 
-        # Validate each component
-        ok, err = validate_skill_md(skill_md)
-        if not ok:
-            return (0, f"SKILL.md validation failed: {err}", contents)
+    def invalid_block(self, contents):
+        """(key, error_message) of the first block of contents that fails validation, or None."""
+        for key, _, validate, label, _ in SKILL_BLOCKS:
+            ok, err = validate(contents.get(key, ""))
+            if not ok:
+                return (key, f"{label} validation failed: {err}")
+        return None
 
-        ok, err = validate_reference_md(reference_md)
-        if not ok:
-            return (0, f"Reference validation failed: {err}", contents)
-
-        ok, err = validate_example_script(example_script)
-        if not ok:
-            return (0, f"Example script validation failed: {err}", contents)
+    def check_skill(self, contents):
+        """Validate contents block by block, stopping at the first failure.
 
+        Returns (success_int, error_message_or_none, contents) like parse_skill.
+        """
+        failure = self.invalid_block(contents)
+        if failure:
+            return (0, failure[1], contents)
         return (1, None, contents)
 
-    def refine_after_feedback(self, tool_name, contents, error_message):
-        """Request the LLM to fix errors in the generated skill."""
+    def parse_skills_batch(self, llm_response, tool_names):
+        """Split a batched response at its ===TOOL:<name>=== lines and parse each part.
+
+        Returns a dict mapping each of tool_names to parse_skill's result
+        for its part; a tool missing from the response gets (0, error, None).
+        """
+        headers = list(TOOL_HEADER_RE.finditer(llm_response))
+        parts = {}
+        for header, following in zip(headers, headers[1:] + [None]):
+            end = following.start() if following else len(llm_response)
+            parts[header.group(1).strip()] = llm_response[header.end():end]
+        return {
+            name: self.parse_skill(parts[name]) if name in parts
+            else (0, f"No ===TOOL:{name}=== section in the response", None)
+            for name in tool_names
+        }
+
+    def build_messages(self, prompt):
+        """Chat messages sending prompt after the system prompt."""
+        return [
+            {
+                "role": "system",
+                "content": [{"type": "text", "text": self.sys_prompt}],
+            },
+            {
+                "role": "user",
+                "content": [{"type": "text", "text": prompt}],
+            }
+        ]
+
+    def complete(self, prompt):
+        """Send prompt to the LLM and return the text of its reply."""
+        response = self.client.chat.completions.create(
+            messages=self.build_messages(prompt),
+            model=self.api_model_name,
+            temperature=0.1
+        )
+        return response.choices[0].message.content
+
+    async def complete_async(self, prompt):
+        """Like complete, but awaits the reply on the async client."""
+        response = await self.async_client.chat.completions.create(
+            messages=self.build_messages(prompt),
+            model=self.api_model_name,
+            temperature=0.1
+        )
+        return response.choices[0].message.content
+
+    async def complete_streamed_async(self, prompt):
+        """Stream the LLM reply to prompt and return its text.
+
+        SKILL.md is validated on a worker thread as soon as its block is
+        complete, while the rest keeps streaming; if it fails, the stream is
+        closed early and the partial text returned, as parse_skill would
+        reject it anyway. Falls back to complete_async if streaming fails
+        before any text arrives.
+        """
+        text = ""
+        try:
+            stream = await self.async_client.chat.completions.create(
+                messages=self.build_messages(prompt),
+                model=self.api_model_name,
+                temperature=0.1,
+                stream=True
+            )
+            skill_check = None
+            search_from = 0
+            async for chunk in stream:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    text += chunk.choices[0].delta.content
+                if skill_check is None:
+                    end = text.find(REFERENCE_DELIMITER, search_from)
+                    # The delimiter may straddle two chunks, so rescan its length
+                    search_from = max(0, len(text) - len(REFERENCE_DELIMITER))
+                    if end != -1:
+                        skill_md = text_after(text, SKILL_DELIMITER, REFERENCE_DELIMITER)
+                        skill_check = asyncio.create_task(asyncio.to_thread(validate_skill_md, skill_md))
+                elif skill_check.done() and not skill_check.result()[0]:
+                    await stream.close()
+                    break
+        except Exception:
+            if text:
+                raise
+            print("Streaming failed, requesting the full response instead")
+            return await self.complete_async(prompt)
+        return text
+
+    def generate_refine_prompt(self, tool_name, contents, error_message):
+        """Generate the prompt asking the LLM to fix errors in a generated skill."""
         existing = ""
         if contents.get("skill_md"):
             existing += f"===SKILL.md===\n{contents['skill_md']}\n\n"
@@ -193,41 +562,116 @@ Please fix the content and ensure that:
 
 Provide the corrected output with all three blocks using the ===SKILL.md===, ===REFERENCE.md===, and ===EXAMPLE_SCRIPT.py=== delimiters.
 """
-        response = self.client.chat.completions.create(
-            messages=[
-                {
-                    "role": "system",
-                    "content": [{"type": "text", "text": self.sys_prompt}],
-                },
-                {
-                    "role": "user",
-                    "content": [{"type": "text", "text": prompt}],
-                }
-            ],
-            model=self.api_model_name,
-            temperature=0.1
-        )
-        response_content = response.choices[0].message.content
-        return self.parse_skill(response_content)
+        return prompt
 
-    def autogenerate_skill(self, tool_name, manual, run_help_command):
-        """Main entry point: generate a complete Claude Scientific Skill package."""
-        help_docs = self.extract_help_document(tool_name, manual, run_help_command)
-        prompt = self.generate_prompt(tool_name, help_docs)
+    def generate_block_refine_prompt(self, tool_name, key, block_text, error_message):
+        """Generate the prompt asking the LLM to fix a single block of a generated skill."""
+        _, delimiter, _, label, requirements = next(block for block in SKILL_BLOCKS if block[0] == key)
+        if key == "example_script":
+            block_text = f"```python\n{block_text}\n```"
 
-        response = self.client.chat.completions.create(
-            messages=[
-                {
-                    "role": "system",
-                    "content": [{"type": "text", "text": self.sys_prompt}],
-                },
-                {
-                    "role": "user",
-                    "content": [{"type": "text", "text": prompt}],
-                }
-            ],
-            temperature=0.1,
-            model=self.api_model_name
+        prompt = f"""
+The {label} block of the skill package for {tool_name}:
+
+{delimiter}
+{block_text}
+
+contains the following error:
+{error_message}
+
+Please fix this block only and ensure that:
+{requirements}
+
+Provide only the corrected block, starting with the {delimiter} delimiter. The other blocks are already valid; do not repeat them.
+"""
+        return prompt
+
+    def plan_refinement(self, tool_name, contents, error_message):
+        """The refine prompt for contents, and the key of the block it asks for, or None for the whole package.
+
+        A non-empty failing block is sent on its own, so the passing blocks
+        are neither resent nor regenerated; an empty one needs the rest of
+        the package as context.
+        """
+        failure = self.invalid_block(contents)
+        if failure and contents.get(failure[0]):
+            key = failure[0]
+            return self.generate_block_refine_prompt(tool_name, key, contents[key], error_message), key
+        return self.generate_refine_prompt(tool_name, contents, error_message), None
+
+    def apply_refinement(self, contents, key, llm_response):
+        """Parse a refine reply: splice a single corrected block into contents, or parse a whole package."""
+        if key is None:
+            return self.parse_skill(llm_response)
+        delimiter = next(block[1] for block in SKILL_BLOCKS if block[0] == key)
+        block_text = text_after(llm_response, delimiter) if delimiter in llm_response else llm_response.strip()
+        if key == "example_script":
+            block_text = strip_python_fence(block_text)
+        return self.check_skill(dict(contents, **{key: block_text}))
+
+    def refine_after_feedback(self, tool_name, contents, error_message):
+        """Request the LLM to fix errors in the generated skill."""
+        prompt, key = self.plan_refinement(tool_name, contents, error_message)
+        return self.apply_refinement(contents, key, self.complete(prompt))
+
+    async def refine_after_feedback_async(self, tool_name, contents, error_message):
+        """Async version of refine_after_feedback.
+
+        Only a whole-package reply is streamed: a single-block reply has no
+        SKILL.md block for complete_streamed_async to check early.
+        """
+        prompt, key = self.plan_refinement(tool_name, contents, error_message)
+        if key is None:
+            llm_response = await self.complete_streamed_async(prompt)
+        else:
+            llm_response = await self.complete_async(prompt)
+        return self.apply_refinement(contents, key, llm_response)
+
+    def response_cache_key(self, prompt):
+        """Cache key of the reply to prompt: the model, system prompt and prompt."""
+        return cache_key(self.api_model_name or "", self.sys_prompt, prompt)
+
+    def autogenerate_skill(self, tool_name, manual, run_help_command, force_refresh=False):
+        """Main entry point: generate a complete Claude Scientific Skill package.
+
+        A reply that passed validation for the same prompt before is reused
+        unless force_refresh is set; failing replies are never cached, so
+        retries always reach the LLM.
+        """
+        help_docs = self.extract_help_document(tool_name, manual, run_help_command, force_refresh)
+        prompt = self.generate_prompt(tool_name, help_docs)
+        key = self.response_cache_key(prompt)
+        cached = None if force_refresh else cache_get('responses', key)
+        if cached is not None:
+            return self.parse_skill(cached)
+        response_content = self.complete(prompt)
+        result = self.parse_skill(response_content)
+        if result[0]:
+            cache_put('responses', key, response_content)
+        return result
+
+    async def autogenerate_skill_async(self, tool_name, manual, run_help_command, force_refresh=False):
+        """Async version of autogenerate_skill; the manual is still read on a worker thread."""
+        help_docs = await asyncio.to_thread(
+            self.extract_help_document, tool_name, manual, run_help_command, force_refresh
         )
-        response_content = response.choices[0].message.content
-        return self.parse_skill(response_content)
+        prompt = self.generate_prompt(tool_name, help_docs)
+        key = self.response_cache_key(prompt)
+        cached = None if force_refresh else await asyncio.to_thread(cache_get, 'responses', key)
+        if cached is not None:
+            return self.parse_skill(cached)
+        response_content = await self.complete_streamed_async(prompt)
+        result = self.parse_skill(response_content)
+        if result[0]:
+            await asyncio.to_thread(cache_put, 'responses', key, response_content)
+        return result
+
+    async def autogenerate_skills_async(self, tools, run_help_command):
+        """Generate the skill packages of several (tool_name, manual) pairs with a single LLM request."""
+        help_docs = await asyncio.gather(*(
+            asyncio.to_thread(self.extract_help_document, tool_name, manual, run_help_command)
+            for tool_name, manual in tools
+        ))
+        tool_names = [tool_name for tool_name, _ in tools]
+        prompt = self.generate_batched_prompt(list(zip(tool_names, help_docs)))
+        return self.parse_skills_batch(await self.complete_async(prompt), tool_names)
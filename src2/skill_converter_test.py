@@ -0,0 +1,110 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+import skill_converter as converter
+from skill_validator import REQUIRED_SECTIONS
+
+
+SKILL_MD = "\n".join(
+    ["---", "name: demo", "description: Demo tool", "license: BSD-3-Clause", "context: cli", "metadata: {}", "---"]
+    + [f"# {section}\ntext" for section in REQUIRED_SECTIONS]
+    + ["```bash\ndemo --help\n```"]
+)
+REFERENCE_MD = "# Demo reference\nOptions."
+SCRIPT = "print('demo')"
+PACKAGE = (
+    f"{converter.SKILL_DELIMITER}\n{SKILL_MD}\n\n"
+    f"{converter.REFERENCE_DELIMITER}\n{REFERENCE_MD}\n\n"
+    f"{converter.SCRIPT_DELIMITER}\n```python\n{SCRIPT}\n```\n"
+)
+
+
+class StubCompletions:
+    """Stands in for client.chat.completions, replying with a fixed text."""
+
+    def __init__(self, reply, chunk_size=7):
+        self.reply = reply
+        self.chunk_size = chunk_size
+        self.calls = []
+
+    async def create(self, messages, model, temperature, stream=False):
+        self.calls.append("stream" if stream else "buffered")
+        if not stream:
+            return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=self.reply))])
+        return self.stream()
+
+    async def stream(self):
+        for i in range(0, len(self.reply), self.chunk_size):
+            delta = SimpleNamespace(content=self.reply[i:i + self.chunk_size])
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=delta)])
+
+
+def make_converter(reply):
+    skill_converter = converter.BioinfoSkillConverter.__new__(converter.BioinfoSkillConverter)
+    skill_converter.sys_prompt = "system"
+    skill_converter.api_model_name = "stub"
+    completions = StubCompletions(reply)
+    skill_converter.async_client = SimpleNamespace(chat=SimpleNamespace(completions=completions))
+    return skill_converter, completions
+
+
+def test_split_blocks_matches_text_after():
+    text = f"preamble\n{PACKAGE}"
+    assert converter.split_blocks(text) == (
+        converter.text_after(text, converter.SKILL_DELIMITER, converter.REFERENCE_DELIMITER),
+        converter.text_after(text, converter.REFERENCE_DELIMITER, converter.SCRIPT_DELIMITER),
+        converter.text_after(text, converter.SCRIPT_DELIMITER),
+    )
+    assert converter.split_blocks(text)[1] == REFERENCE_MD
+
+
+def test_split_blocks_without_some_delimiters():
+    text = f"{converter.SKILL_DELIMITER}\n{SKILL_MD}\n{converter.SCRIPT_DELIMITER}\n{SCRIPT}"
+    assert converter.split_blocks(text) == (f"{SKILL_MD}\n{converter.SCRIPT_DELIMITER}\n{SCRIPT}", "", SCRIPT)
+
+
+def test_split_blocks_ignores_end_delimiter_before_block():
+    text = (
+        f"Use {converter.REFERENCE_DELIMITER} next.\n"
+        f"{converter.SKILL_DELIMITER}\nskill\n{converter.REFERENCE_DELIMITER}\nreference"
+    )
+    assert converter.split_blocks(text)[0] == "skill"
+
+
+@pytest.mark.parametrize("script", [
+    "```python\nprint(1)\n```",
+    "Example:\n```python\nprint(1)\n```\ntrailing",
+    "~~~py\nprint(1)\n~~~",
+    "``` python3 \nprint(1)\n```",
+    "print(1)",
+])
+def test_strip_python_fence(script):
+    assert converter.strip_python_fence(script) == "print(1)"
+
+
+def test_block_refine_is_not_streamed():
+    skill_converter, completions = make_converter(f"{converter.REFERENCE_DELIMITER}\n{REFERENCE_MD}")
+    contents = {"skill_md": SKILL_MD, "reference_md": "no headers", "example_script": SCRIPT}
+
+    ok, error, refined = asyncio.run(
+        skill_converter.refine_after_feedback_async("demo", contents, "Reference document has no headers")
+    )
+
+    assert (ok, error) == (1, None)
+    assert refined == dict(contents, reference_md=REFERENCE_MD)
+    assert completions.calls == ["buffered"]
+
+
+def test_package_refine_is_streamed():
+    skill_converter, completions = make_converter(PACKAGE)
+    contents = {"skill_md": "", "reference_md": REFERENCE_MD, "example_script": SCRIPT}
+
+    ok, error, refined = asyncio.run(
+        skill_converter.refine_after_feedback_async("demo", contents, "SKILL.md content is empty")
+    )
+
+    assert (ok, error) == (1, None)
+    assert refined == {"skill_md": SKILL_MD, "reference_md": REFERENCE_MD, "example_script": SCRIPT}
+    assert completions.calls == ["stream"]
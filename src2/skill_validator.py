@@ -1,6 +1,8 @@
-import ast
+import functools
 import re
 
+import yaml
+
 
 REQUIRED_SECTIONS = [
     "Overview",
@@ -19,6 +21,12 @@ REQUIRED_SECTIONS = [
 
 REQUIRED_FRONTMATTER_KEYS = ["name", "description", "license", "context", "metadata"]
 
+# One pass finds every required section header present.
+SECTIONS_RE = re.compile(r'#\s+(' + '|'.join(re.escape(s) for s in REQUIRED_SECTIONS) + ')')
+
+# libyaml's loader when PyYAML was built with it, the pure-Python one otherwise
+YAML_LOADER = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+
 
 def validate_skill_md(content):
     """Validate SKILL.md content.
@@ -35,16 +43,23 @@ def validate_skill_md(content):
 
     frontmatter_text = fm_match.group(1)
 
-    # Check required frontmatter keys
-    for key in REQUIRED_FRONTMATTER_KEYS:
-        if f"{key}:" not in frontmatter_text:
-            return (0, f"YAML frontmatter is missing required key: {key}")
+    # Check required frontmatter keys, reporting every missing one at once so
+    # that a single refinement round can fix them all
+    try:
+        frontmatter = yaml.load(frontmatter_text, Loader=YAML_LOADER)
+    except yaml.YAMLError as e:
+        return (0, f"YAML frontmatter does not parse: {e}")
+    if not isinstance(frontmatter, dict):
+        return (0, "YAML frontmatter is not a mapping of keys to values")
+    missing_keys = [key for key in REQUIRED_FRONTMATTER_KEYS if key not in frontmatter]
+    if missing_keys:
+        return (0, f"YAML frontmatter is missing required keys: {', '.join(missing_keys)}")
 
     # Check required section headers
-    for section in REQUIRED_SECTIONS:
-        pattern = rf'#\s+{re.escape(section)}'
-        if not re.search(pattern, content):
-            return (0, f"SKILL.md is missing required section: '# {section}'")
+    found_sections = set(SECTIONS_RE.findall(content))
+    missing_sections = [f"'# {section}'" for section in REQUIRED_SECTIONS if section not in found_sections]
+    if missing_sections:
+        return (0, f"SKILL.md is missing required sections: {', '.join(missing_sections)}")
 
     # Check that at least one code block exists
     if '```' not in content:
@@ -68,20 +83,32 @@ def validate_reference_md(content):
     return (1, None)
 
 
+@functools.lru_cache(maxsize=256)
+def script_syntax_error(content):
+    """The SyntaxError raised compiling content, as text, or None.
+
+    Cached because refinement rounds often resubmit an unchanged script.
+    """
+    try:
+        compile(content, '<skill-example>', 'exec', dont_inherit=True)
+    except SyntaxError as e:
+        return str(e)
+    return None
+
+
 def validate_example_script(content):
     """Validate example Python script.
 
     Empty content is acceptable (tool may not need an example script).
-    If content exists, validate Python syntax with ast.parse().
+    If content exists, validate Python syntax by compiling it.
 
     Returns (1, None) on success, (0, error_message) on failure.
     """
     if not content or not content.strip():
         return (1, None)
 
-    try:
-        ast.parse(content)
-    except SyntaxError as e:
-        return (0, f"Example script has SyntaxError: {e}")
+    error = script_syntax_error(content)
+    if error is not None:
+        return (0, f"Example script has SyntaxError: {error}")
 
     return (1, None)
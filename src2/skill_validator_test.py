@@ -0,0 +1,30 @@
+import pytest
+
+from skill_validator import REQUIRED_SECTIONS, validate_skill_md
+
+
+def skill_md(frontmatter):
+    sections = "\n".join(f"# {section}\ntext" for section in REQUIRED_SECTIONS)
+    return f"---\n{frontmatter}\n---\n{sections}\n```bash\ndemo\n```"
+
+
+def test_valid_frontmatter():
+    frontmatter = "name: demo\ndescription: Demo\nlicense: MIT\ncontext: cli\nmetadata:\n  version: 1"
+    assert validate_skill_md(skill_md(frontmatter)) == (1, None)
+
+
+@pytest.mark.parametrize("frontmatter, message", [
+    ("name: [demo", "does not parse"),
+    ("- name\n- description", "not a mapping"),
+    ("name: demo\nlicense: MIT\ncontext: cli", "missing required keys: description, metadata"),
+])
+def test_invalid_frontmatter(frontmatter, message):
+    ok, error = validate_skill_md(skill_md(frontmatter))
+    assert ok == 0
+    assert message in error
+
+
+def test_missing_frontmatter():
+    ok, error = validate_skill_md("# Overview\ntext")
+    assert ok == 0
+    assert "missing YAML frontmatter" in error